@@ -0,0 +1,154 @@
+"""
+自适应推理: 按图片尺寸与低分辨率预识别结果为每张图片选择推理方式,
+图符足够大的图片只做低分辨率推理, 简单的图片不再切片推理, 没有管线的
+图片跳过线条模型.
+"""
+
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .detections import Detections
+from .image2hmi import tile_offsets
+from .settings import settings
+
+
+class InferencePlan:
+  """一张图片的推理计划"""
+
+  __slots__ = ("symbol", "line", "prepass", "symbol_size", "line_ratio")
+
+  def __init__(
+    self,
+    symbol: Optional[str],
+    line: Optional[str],
+    prepass: Optional[Detections],
+    symbol_size: Optional[float],
+    line_ratio: Optional[float],
+  ):
+    self.symbol = symbol
+    """图符的推理方式: prepass(预识别结果即为结果)、whole(整图)或
+    tiled(切片), 不识别图符时为None"""
+    self.line = line
+    """线条的推理方式, 见`line_mode`, 不识别线条时为None"""
+    self.prepass = prepass
+    """低分辨率整图预识别的图符结果"""
+    self.symbol_size = symbol_size
+    """预识别图符的边长中位数, 换算到整图缩放到预识别尺寸后的像素"""
+    self.line_ratio = line_ratio
+    """长直线像素占全部像素的比例, 见`line_ratio`"""
+
+  def to_dict(self) -> dict:
+    return {
+      "symbol": self.symbol,
+      "line": self.line,
+      "symbols": None if self.prepass is None else len(self.prepass),
+      "symbolSize": self.symbol_size,
+      "lineRatio": self.line_ratio,
+    }
+
+
+def line_ratio(img: np.ndarray, side: int = 1024) -> float:
+  """
+  估计图中管线的多少。二值化(前景取像素较少的一类, 浅色与深色背景
+  都适用)后缩小到最长边不超过`side`(任一前景像素落入即为前景, 细线
+  不会丢失), 再用长度为最长边1/16的水平与竖直结构元素做开运算,
+  只保留长直线。文字与图符内部的短笔画被去除, 表格边框会被保留。
+  Returns:
+    float: 长直线像素占全部像素的比例。
+  """
+  gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+  _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+  if np.count_nonzero(binary) * 2 > binary.size:
+    binary = cv2.bitwise_not(binary)
+  h, w = binary.shape
+  factor = side / max(h, w)
+  if factor < 1:
+    size = (max(1, round(w * factor)), max(1, round(h * factor)))
+    binary = cv2.resize(binary, size, interpolation=cv2.INTER_AREA)
+    binary = (binary > 0).astype(np.uint8) * 255
+  length = max(8, max(binary.shape) // 16)
+  horizontal = cv2.morphologyEx(
+    binary, cv2.MORPH_OPEN, np.ones((1, length), dtype=np.uint8)
+  )
+  vertical = cv2.morphologyEx(
+    binary, cv2.MORPH_OPEN, np.ones((length, 1), dtype=np.uint8)
+  )
+  return float(np.count_nonzero(horizontal | vertical)) / binary.size
+
+
+def adaptive_options() -> str:
+  """影响自适应推理结果的配置, 用于识别结果缓存键"""
+  return ",".join(
+    map(
+      str,
+      (
+        settings.ADAPTIVE_PREPASS_SIZE,
+        settings.ADAPTIVE_MIN_SYMBOL_SIZE,
+        settings.ADAPTIVE_MAX_WHOLE_SYMBOLS,
+        settings.ADAPTIVE_MIN_LINE_RATIO,
+      ),
+    )
+  )
+
+
+def _single_tile(shape: tuple) -> bool:
+  """图片是否不大于一个切片"""
+  tiles = tile_offsets(
+    shape[:2], settings.YOLO_TILE_SIZE, settings.YOLO_TILE_OVERLAP
+  )
+  return len(tiles) <= 1
+
+
+def line_mode(shape: tuple, lines: float) -> str:
+  """
+  线条的推理方式: 长直线比例低于`ADAPTIVE_MIN_LINE_RATIO`时不识别
+  (skip), 否则图片不大于一个切片时整图推理(whole), 更大时切片推理
+  (tiled)。只取决于图片尺寸与`line_ratio`, 不等待图符预识别, 线条模型
+  可以与预识别同时推理。
+  """
+  if lines < settings.ADAPTIVE_MIN_LINE_RATIO:
+    return "skip"
+  return "whole" if _single_tile(shape) else "tiled"
+
+
+def plan_inference(
+  shape: tuple, prepass: Optional[Detections], lines: Optional[float]
+) -> InferencePlan:
+  """
+  根据图片尺寸、低分辨率预识别的图符与长直线比例制定推理计划。图符:
+
+  - 预识别到图符, 且图符在整图缩放到`ADAPTIVE_PREPASS_SIZE`后的边长
+    中位数不小于`ADAPTIVE_MIN_SYMBOL_SIZE`、数量不超过
+    `ADAPTIVE_MAX_WHOLE_SYMBOLS`(过多时整图推理会漏检)时, 预识别结果
+    即为最终结果;
+  - 否则图片不大于一个切片时按模型输入尺寸整图推理, 更大时切片推理。
+
+  线条见`line_mode`。
+  Args:
+    shape (tuple): 图片的(高, 宽)。
+    prepass (Optional[Detections]): 预识别的图符, None表示不识别图符。
+    lines (Optional[float]): `line_ratio`, None表示不识别线条。
+  """
+  height, width = shape[:2]
+  single = _single_tile(shape)
+  symbol = size = None
+  if prepass is not None:
+    symbol = "whole" if single else "tiled"
+  if prepass is not None and len(prepass):
+    xyxy = prepass.xyxy
+    sides = np.maximum(xyxy[:, 2] - xyxy[:, 0], xyxy[:, 3] - xyxy[:, 1])
+    # 预识别时图片最长边缩放到预识别尺寸
+    scale = min(1.0, settings.ADAPTIVE_PREPASS_SIZE / max(height, width))
+    size = round(float(np.median(sides)) * scale, 1)
+    if (
+      size >= settings.ADAPTIVE_MIN_SYMBOL_SIZE
+      and len(prepass) <= settings.ADAPTIVE_MAX_WHOLE_SYMBOLS
+    ):
+      symbol = "prepass"
+  line = None
+  if lines is not None:
+    line = line_mode(shape, lines)
+    lines = round(lines, 5)
+  return InferencePlan(symbol, line, prepass, size, lines)
@@ -0,0 +1,255 @@
+"""
+准入控制: 限制每个进程同时进行的推理请求数量, 超出的请求有限排队,
+队列已满或排队超时时快速拒绝, 避免突发流量下内存耗尽、所有请求一起超时.
+"""
+
+import asyncio
+import math
+from collections import deque
+from time import monotonic
+from typing import AsyncIterator, Deque, Optional
+
+from .metrics import Counter, Gauge, queue_wait_seconds
+from .settings import settings
+
+admission_active = Gauge("hmi_admission_active", "正在推理的请求数")
+admission_queued = Gauge("hmi_admission_queued", "排队等待推理的请求数")
+admission_rejected = Counter(
+  "hmi_admission_rejected_total",
+  "被拒绝的请求数, reason为queue_full(队列已满)或timeout(排队超时)",
+  ["reason"],
+)
+_queue_wait = queue_wait_seconds.labels("admission")
+
+POSITION_POLL_INTERVAL = 0.5
+"""排队期间检查排队位置变化的间隔, 单位为秒"""
+
+
+class Overloaded(Exception):
+  """服务繁忙, 请求被拒绝。
+
+  `status`为HTTP状态码: 队列已满为429, 排队超时为503;
+  `retry_after`为建议的重试等待秒数, 用于`Retry-After`响应头。
+  """
+
+  def __init__(self, message: str, status: int, retry_after: int):
+    super().__init__(message)
+    self.status = status
+    self.retry_after = retry_after
+
+  @property
+  def headers(self) -> dict:
+    return {"Retry-After": str(self.retry_after)}
+
+
+class Ticket:
+  """一个请求的推理名额, 排队中或已获得; 用完须调用`release`"""
+
+  def __init__(self, controller: "AdmissionController", deadline: float):
+    self._controller = controller
+    self._granted: asyncio.Future = asyncio.get_running_loop().create_future()
+    self._released = False
+    self.deadline = deadline
+    self.queued_at = monotonic()
+    self.granted_at: Optional[float] = None
+
+  @property
+  def admitted(self) -> bool:
+    return self._granted.done() and not self._granted.cancelled()
+
+  @property
+  def position(self) -> int:
+    """排队位置, 从1开始; 已获得名额时为0"""
+    if self.admitted:
+      return 0
+    try:
+      return self._controller._waiters.index(self) + 1
+    except ValueError:
+      return 0
+
+  async def wait(self) -> AsyncIterator[int]:
+    """
+    等待获得名额, 排队位置变化时产出新的位置, 获得名额后返回。
+    Yields:
+      int: 当前排队位置。
+    Raises:
+      Overloaded: 超过排队期限。
+    """
+    reported = None
+    try:
+      while not self._granted.done():
+        position = self.position
+        if position != reported:
+          reported = position
+          yield position
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+          raise self._controller._timeout()
+        try:
+          await asyncio.wait_for(
+            asyncio.shield(self._granted),
+            min(remaining, POSITION_POLL_INTERVAL),
+          )
+        except asyncio.TimeoutError:
+          pass
+    finally:
+      if not self.admitted:
+        # 超时或客户端断开: 离开队列
+        self._controller._leave(self)
+
+  def release(self) -> None:
+    """归还名额(或离开队列), 可重复调用"""
+    if self._released:
+      return
+    self._released = True
+    if self.admitted:
+      self._controller._release(monotonic() - self.granted_at)
+    else:
+      self._controller._leave(self)
+
+
+class AdmissionController:
+  """推理准入控制。
+
+  同时推理的请求最多`max_concurrent`个, 其余请求按到达顺序排队,
+  队列最多`max_queue`个, 每个请求最多排队`timeout`秒。`Retry-After`
+  根据近期请求的平均推理耗时与排队人数估算。`max_concurrent`不大于0
+  时不限制。所有方法需在事件循环线程中调用。
+  """
+
+  def __init__(self, max_concurrent: int, max_queue: int, timeout: float):
+    self.max_concurrent = max_concurrent
+    self.max_queue = max(0, max_queue)
+    self.timeout = timeout
+    self.active = 0
+    self.admitted = 0
+    self.rejected = 0
+    self.timeouts = 0
+    self._waiters: Deque[Ticket] = deque()
+    self._service_time: Optional[float] = None
+    """推理耗时的指数移动平均, 单位为秒"""
+
+  @property
+  def enabled(self) -> bool:
+    return self.max_concurrent > 0
+
+  def try_acquire(self) -> Optional[Ticket]:
+    """
+    有空闲名额时立即获得, 否则返回None(调用方可改为排队)。
+    Raises:
+      Overloaded: 队列已满。
+    """
+    if self._has_slot():
+      return self.enqueue()
+    if len(self._waiters) >= self.max_queue:
+      raise self._queue_full()
+    return None
+
+  def enqueue(self, bounded: bool = True) -> Ticket:
+    """
+    申请名额: 有空闲名额时立即获得, 否则进入队列。
+    Args:
+      bounded (bool): 是否受队列长度与排队期限限制, 批量任务等后台
+        处理不受限制(其并发已由任务自身控制)。
+    Raises:
+      Overloaded: 队列已满。
+    """
+    deadline = monotonic() + self.timeout if bounded else math.inf
+    ticket = Ticket(self, deadline)
+    if self._has_slot():
+      self._grant(ticket)
+      return ticket
+    if bounded and len(self._waiters) >= self.max_queue:
+      raise self._queue_full()
+    self._waiters.append(ticket)
+    admission_queued.inc()
+    return ticket
+
+  async def acquire(self, bounded: bool = True) -> Ticket:
+    """
+    申请并等待名额。
+    Raises:
+      Overloaded: 队列已满或排队超时。
+    """
+    ticket = self.enqueue(bounded)
+    try:
+      async for _ in ticket.wait():
+        pass
+    except BaseException:
+      # 获得名额的同时被取消时归还名额
+      ticket.release()
+      raise
+    return ticket
+
+  def stats(self) -> dict:
+    return {
+      "max_concurrent": self.max_concurrent,
+      "max_queue": self.max_queue,
+      "timeout": self.timeout,
+      "active": self.active,
+      "queued": len(self._waiters),
+      "admitted": self.admitted,
+      "rejected": self.rejected,
+      "timeouts": self.timeouts,
+      "avg_service_time": self._service_time,
+    }
+
+  def _has_slot(self) -> bool:
+    # 有人排队时新请求也要排队, 保证先到先得
+    if not self.enabled:
+      return True
+    return self.active < self.max_concurrent and not self._waiters
+
+  def _grant(self, ticket: Ticket) -> None:
+    self.active += 1
+    self.admitted += 1
+    admission_active.inc()
+    ticket.granted_at = monotonic()
+    _queue_wait.observe(ticket.granted_at - ticket.queued_at)
+    ticket._granted.set_result(None)
+
+  def _release(self, elapsed: float) -> None:
+    self.active -= 1
+    admission_active.dec()
+    if self._service_time is None:
+      self._service_time = elapsed
+    else:
+      self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+    while self._waiters and self.active < self.max_concurrent:
+      ticket = self._waiters.popleft()
+      admission_queued.dec()
+      self._grant(ticket)
+
+  def _leave(self, ticket: Ticket) -> None:
+    try:
+      self._waiters.remove(ticket)
+    except ValueError:
+      return
+    admission_queued.dec()
+    ticket._granted.cancel()
+
+  def _retry_after(self) -> int:
+    """估算队列清空所需的秒数"""
+    service_time = self._service_time or 1.0
+    rounds = (len(self._waiters) + 1) / max(1, self.max_concurrent)
+    return max(1, math.ceil(service_time * rounds))
+
+  def _queue_full(self) -> Overloaded:
+    self.rejected += 1
+    admission_rejected.labels("queue_full").inc()
+    return Overloaded("服务繁忙, 请稍后重试", 429, self._retry_after())
+
+  def _timeout(self) -> Overloaded:
+    self.timeouts += 1
+    admission_rejected.labels("timeout").inc()
+    return Overloaded(
+      "服务繁忙, 排队超时, 请稍后重试", 503, self._retry_after()
+    )
+
+
+admission = AdmissionController(
+  settings.ADMISSION_MAX_CONCURRENT,
+  settings.ADMISSION_MAX_QUEUE,
+  settings.ADMISSION_QUEUE_TIMEOUT,
+)
+"""全局准入控制器, /image2hmi、/ocr与批量任务共用"""
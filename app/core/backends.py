@@ -0,0 +1,421 @@
+"""
+YOLO推理后端: PyTorch(ultralytics)与ONNX Runtime.
+
+导出ONNX模型:
+  python -m app.core.backends export [--int8]
+对比各后端的推理耗时:
+  python -m app.core.backends benchmark images/07.png
+"""
+
+import argparse
+import ast
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from .detections import Detections
+from .image2hmi import YoloModel
+from .metrics import model_load_seconds
+from .settings import settings
+
+YOLO_BACKENDS = ("torch", "onnx")
+
+# 与ultralytics的predict默认参数保持一致, 保证各后端结果可比
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+MAX_DET = 300
+LETTERBOX_COLOR = (114, 114, 114)
+STRIDE = 32
+"""YOLO的最大下采样倍数, 动态尺寸模型的输入边长须为其整数倍"""
+
+
+def letterbox(img: np.ndarray, imgsz: Tuple[int, int]):
+  """
+  等比缩放并居中填充到模型输入尺寸, 与ultralytics的LetterBox一致。
+  Args:
+    img (np.ndarray): BGR格式的图片。
+    imgsz (Tuple[int, int]): 模型输入的(高, 宽)。
+  Returns:
+    tuple: (3xHxW归一化RGB张量, 缩放比例, (左侧填充, 顶部填充))
+  """
+  h, w = img.shape[:2]
+  target_h, target_w = imgsz
+  ratio = min(target_h / h, target_w / w)
+  new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+  dw, dh = (target_w - new_w) / 2, (target_h - new_h) / 2
+  if (new_w, new_h) != (w, h):
+    img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+  top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+  left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+  img = cv2.copyMakeBorder(
+    img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR
+  )
+  # BGR HWC uint8 -> RGB CHW float32
+  tensor = np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1))
+  return tensor.astype(np.float32) / 255.0, ratio, (left, top)
+
+
+def restore_boxes(
+  xyxy: np.ndarray,
+  ratio: float,
+  pad: Tuple[int, int],
+  shape: Tuple[int, int],
+) -> np.ndarray:
+  """将letterbox后的坐标原地还原到原图(`shape`为原图的高与宽)"""
+  xyxy[:, [0, 2]] -= pad[0]
+  xyxy[:, [1, 3]] -= pad[1]
+  xyxy /= ratio
+  xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, shape[1])
+  xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, shape[0])
+  return xyxy
+
+
+def onnx_model_path(model_path: Path, int8: bool = False) -> Path:
+  """`.pt`模型对应的ONNX模型路径, INT8量化模型以`.int8.onnx`结尾"""
+  suffix = ".int8.onnx" if int8 else ".onnx"
+  return model_path.with_suffix(suffix)
+
+
+class OnnxYoloModel:
+  """ONNX Runtime推理后端。
+
+  加载由`export_onnx`导出的模型, 自行完成letterbox预处理、置信度过滤
+  与按类别NMS, 结果格式与`YoloModel`相同。不依赖PyTorch, 常驻内存
+  更小; 线程数与执行提供者(CPU、OpenVINO等)由`ONNX_*`配置决定。
+  """
+
+  backend = "onnx"
+
+  def __init__(self, model_path: Path):
+    import onnxruntime as ort
+
+    self.path = model_path
+    if not model_path.exists():
+      raise FileNotFoundError(
+        f"ONNX模型文件不存在: {model_path}, "
+        f"请先运行 python -m app.core.backends export"
+      )
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+    options.inter_op_num_threads = settings.ONNX_INTER_OP_THREADS
+    available = ort.get_available_providers()
+    providers = [p for p in settings.ONNX_PROVIDERS if p in available]
+    self.session = ort.InferenceSession(
+      str(model_path),
+      sess_options=options,
+      providers=providers or ["CPUExecutionProvider"],
+    )
+    self.input = self.session.get_inputs()[0]
+    metadata = self.session.get_modelmeta().custom_metadata_map
+    self.names: Dict[int, str] = ast.literal_eval(metadata["names"])
+    imgsz = ast.literal_eval(metadata.get("imgsz", "[640, 640]"))
+    self.imgsz: Tuple[int, int] = (int(imgsz[0]), int(imgsz[1]))
+    # 导出时未启用dynamic的模型只能逐张推理, 输入尺寸也是固定的
+    self.dynamic_batch = not isinstance(self.input.shape[0], int)
+    self.dynamic_shape = not isinstance(self.input.shape[2], int)
+
+  def predict(self, img: np.ndarray, imgsz: Optional[int] = None) -> Detections:
+    """
+    推理一张图片。
+    Args:
+      img (np.ndarray): BGR格式的图片。
+      imgsz (Optional[int]): 本次推理的输入尺寸, 向上取整为`STRIDE`的
+        倍数; 默认及固定输入尺寸的模型使用导出时的尺寸。
+    """
+    if imgsz is None or not self.dynamic_shape:
+      return self.predict_batch([img])[0]
+    side = -(-imgsz // STRIDE) * STRIDE
+    return self.predict_letterboxed([letterbox(img, (side, side))], [img])[0]
+
+  def predict_batch(self, imgs: List[np.ndarray]) -> List[Detections]:
+    """
+    一次前向推理处理多张图片。
+    Args:
+      imgs (List[np.ndarray]): BGR格式的图片列表。
+    Returns:
+      List[Detections]: 与`imgs`一一对应。
+    """
+    if not self.dynamic_batch and len(imgs) > 1:
+      return [self.predict(img) for img in imgs]
+    letterboxed = [letterbox(img, self.imgsz) for img in imgs]
+    return self.predict_letterboxed(letterboxed, imgs)
+
+  def predict_letterboxed(
+    self, letterboxed: List[tuple], imgs: List[np.ndarray]
+  ) -> List[Detections]:
+    """
+    推理已经过`letterbox`预处理的图片, 预处理结果可供多个模型共用。
+    Args:
+      letterboxed (List[tuple]): 各图片的`letterbox`返回值。
+      imgs (List[np.ndarray]): 原图, 用于还原坐标。
+    """
+    batch = np.stack([item[0] for item in letterboxed])
+    (output,) = self.session.run(None, {self.input.name: batch})
+    return [
+      self._postprocess(pred, ratio, pad, img.shape[:2])
+      for pred, (_, ratio, pad), img in zip(output, letterboxed, imgs)
+    ]
+
+  def _postprocess(
+    self,
+    pred: np.ndarray,
+    ratio: float,
+    pad: Tuple[int, int],
+    shape: Tuple[int, int],
+  ) -> Detections:
+    """
+    解码单张图片的输出(4+类别数, 候选框数), 过滤低置信度并按类别NMS,
+    再将坐标还原到原图。
+    """
+    pred = pred.T
+    scores = pred[:, 4:]
+    cls = scores.argmax(axis=1)
+    conf = scores[np.arange(len(cls)), cls]
+    keep = conf > CONF_THRESHOLD
+    if not keep.any():
+      return Detections.empty(self.names)
+    boxes, conf, cls = pred[keep, :4], conf[keep], cls[keep]
+    # 中心点宽高 -> 左上角宽高, 供OpenCV的NMS使用
+    xywh = boxes.copy()
+    xywh[:, :2] -= boxes[:, 2:] / 2
+    indexes = cv2.dnn.NMSBoxesBatched(
+      xywh.tolist(),
+      conf.tolist(),
+      cls.tolist(),
+      CONF_THRESHOLD,
+      IOU_THRESHOLD,
+    )
+    indexes = np.asarray(indexes, dtype=np.int64).reshape(-1)[:MAX_DET]
+    xyxy = np.empty((len(indexes), 4), dtype=np.float32)
+    xyxy[:, :2] = xywh[indexes, :2]
+    xyxy[:, 2:] = xywh[indexes, :2] + xywh[indexes, 2:]
+    return Detections(
+      restore_boxes(xyxy, ratio, pad, shape),
+      conf[indexes].astype(np.float32),
+      cls[indexes].astype(np.int32),
+      self.names,
+    )
+
+
+InferenceModel = Union[YoloModel, OnnxYoloModel]
+
+
+class PairedYoloModel:
+  """图符与线条模型共用一次预处理。
+
+  两个模型推理同一张图片时, letterbox缩放、填充与张量转换只做一次,
+  同一个输入张量同时送入两个模型: 线条模型在辅助线程中推理, 与调用
+  线程中的图符模型推理并行(PyTorch与ONNX Runtime推理时释放GIL)。
+  `predict`返回(图符, 线条)两组识别结果, 可像单个模型一样交给
+  `BatchingPredictor`批处理。两个模型的后端或输入尺寸不同时退化为
+  分别(仍然并行)推理。
+  """
+
+  backend = "paired"
+
+  def __init__(self, symbol: InferenceModel, line: InferenceModel):
+    self.symbol = symbol
+    self.line = line
+    self.shared = _input_size(symbol) is not None and (
+      _input_size(symbol) == _input_size(line)
+    )
+    """两个模型能否共用预处理结果"""
+    # 线程在第一次提交时才创建
+    self._pool = ThreadPoolExecutor(
+      max_workers=settings.INFERENCE_EXECUTOR_WORKERS,
+      thread_name_prefix="paired",
+    )
+
+  def _concurrently(
+    self, symbol: Callable[[], list], line: Callable[[], list]
+  ) -> List[Tuple[Detections, Detections]]:
+    """在辅助线程中执行`line`, 同时在当前线程中执行`symbol`"""
+    lines = self._pool.submit(line)
+    try:
+      symbols = symbol()
+    finally:
+      # 图符推理失败时也等待线条推理结束, 调用返回后模型不再被使用
+      wait([lines])
+    return list(zip(symbols, lines.result()))
+
+  def predict(self, img: np.ndarray) -> Tuple[Detections, Detections]:
+    return self.predict_batch([img])[0]
+
+  def predict_batch(
+    self, imgs: List[np.ndarray]
+  ) -> List[Tuple[Detections, Detections]]:
+    """
+    一次预处理, 两个模型分别前向推理。
+    Returns:
+      List[Tuple[Detections, Detections]]: 与`imgs`一一对应的
+        (图符, 线条)识别结果。
+    """
+    if not self.shared:
+      return self._concurrently(
+        lambda: self.symbol.predict_batch(imgs),
+        lambda: self.line.predict_batch(imgs),
+      )
+    if isinstance(self.symbol, OnnxYoloModel):
+      if not self.symbol.dynamic_batch or not self.line.dynamic_batch:
+        return [self.predict_batch([img])[0] for img in imgs]
+      letterboxed = [letterbox(img, self.symbol.imgsz) for img in imgs]
+      return self._concurrently(
+        lambda: self.symbol.predict_letterboxed(letterboxed, imgs),
+        lambda: self.line.predict_letterboxed(letterboxed, imgs),
+      )
+    import torch
+
+    letterboxed = [letterbox(img, self.symbol.imgsz) for img in imgs]
+    # ultralytics对张量输入不再做letterbox, 坐标为张量上的坐标
+    tensor = torch.from_numpy(np.stack([item[0] for item in letterboxed]))
+    symbol, line = self.symbol, self.line
+    return self._concurrently(
+      lambda: self._restore(symbol.predict_tensor(tensor), letterboxed, imgs),
+      lambda: self._restore(line.predict_tensor(tensor), letterboxed, imgs),
+    )
+
+  @staticmethod
+  def _restore(
+    results: List[Detections], letterboxed: List[tuple], imgs: List[np.ndarray]
+  ) -> List[Detections]:
+    for detections, (_, ratio, pad), img in zip(results, letterboxed, imgs):
+      restore_boxes(detections.xyxy, ratio, pad, img.shape[:2])
+    return results
+
+
+def _input_size(model: InferenceModel):
+  """模型的推理后端与输入尺寸, 不是本进程中的torch或onnx模型时为None"""
+  if isinstance(model, (YoloModel, OnnxYoloModel)):
+    return (model.backend, model.imgsz)
+  return None
+
+
+def model_file(model_path: Path, backend: str = None) -> Path:
+  """按推理后端返回实际加载的模型文件路径"""
+  backend = (backend or settings.YOLO_BACKEND).lower()
+  if backend == "onnx":
+    return onnx_model_path(model_path, settings.YOLO_ONNX_INT8)
+  return model_path
+
+
+def load_yolo_model(
+  model_path: Path, backend: str = None, label: str = None
+) -> InferenceModel:
+  """
+  按`YOLO_BACKEND`配置加载YOLO模型。
+  Args:
+    model_path (Path): `.pt`模型文件路径, ONNX后端会加载同目录下导出的
+      `.onnx`(或`YOLO_ONNX_INT8`时的`.int8.onnx`)文件。
+    backend (str): 推理后端, 默认取`YOLO_BACKEND`配置。
+    label (str): `model_load_seconds`指标中的模型名称, 默认为文件名。
+  Raises:
+    ValueError: 推理后端无效。
+  """
+  backend = (backend or settings.YOLO_BACKEND).lower()
+  if backend not in YOLO_BACKENDS:
+    raise ValueError(
+      f"无效的推理后端: {backend}, 可选值: {', '.join(YOLO_BACKENDS)}"
+    )
+  label = label or model_path.stem
+  with model_load_seconds.labels(f"{label}.{backend}").time():
+    if backend == "onnx":
+      return OnnxYoloModel(model_file(model_path, backend))
+    return YoloModel(model_path)
+
+
+def export_onnx(model_path: Path) -> Path:
+  """
+  将`.pt`模型导出为ONNX(动态batch, 使用onnxslim简化)。
+  Returns:
+    Path: 导出的ONNX模型路径。
+  """
+  from ultralytics import YOLO
+
+  return Path(
+    YOLO(model_path).export(format="onnx", dynamic=True, simplify=True)
+  )
+
+
+def quantize_onnx(model_path: Path) -> Path:
+  """
+  对已导出的ONNX模型做INT8动态量化(权重量化, 激活在推理时量化)。
+  Returns:
+    Path: 量化后的模型路径。
+  """
+  from onnxruntime.quantization import QuantType, quantize_dynamic
+
+  quantized = onnx_model_path(model_path, int8=True)
+  quantize_dynamic(
+    onnx_model_path(model_path), quantized, weight_type=QuantType.QUInt8
+  )
+  return quantized
+
+
+def benchmark(image_path: Path, backends: List[str], runs: int) -> None:
+  """
+  逐个后端加载符号与线条模型, 输出推理耗时与识别数量, 以及两个模型
+  共用预处理(`PairedYoloModel`)时的总耗时。
+  """
+  img = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+  if img is None:
+    raise ValueError(f"无法读取图片: {image_path}")
+
+  def timed(model) -> tuple:
+    result = model.predict(img)  # 预热
+    started = perf_counter()
+    for _ in range(runs):
+      result = model.predict(img)
+    return (perf_counter() - started) / runs, result
+
+  for backend in backends:
+    models = []
+    for model_path in (settings.MODEL_PATH, settings.MODEL_LINE_PATH):
+      model = load_yolo_model(model_path, backend)
+      models.append(model)
+      elapsed, detections = timed(model)
+      print(
+        f"{backend:6} {model.path.name:28} "
+        f"{elapsed * 1000:8.1f} ms  {len(detections)} 个目标"
+      )
+    elapsed, (symbols, lines) = timed(PairedYoloModel(*models))
+    print(
+      f"{backend:6} {'paired':28} "
+      f"{elapsed * 1000:8.1f} ms  {len(symbols)}+{len(lines)} 个目标"
+    )
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m app.core.backends")
+  commands = parser.add_subparsers(dest="command", required=True)
+  export = commands.add_parser("export", help="导出ONNX模型")
+  export.add_argument(
+    "--int8", action="store_true", help="同时导出INT8量化模型"
+  )
+  bench = commands.add_parser("benchmark", help="对比各后端推理耗时")
+  bench.add_argument("image", type=Path)
+  bench.add_argument("--backends", default=",".join(YOLO_BACKENDS))
+  bench.add_argument("--runs", type=int, default=10)
+  args = parser.parse_args()
+
+  if args.command == "export":
+    # 导出全部模型配置中的模型
+    for directory in settings.MODEL_PROFILES.values():
+      for model_path in (
+        directory / settings.MODEL_PATH.name,
+        directory / settings.MODEL_LINE_PATH.name,
+      ):
+        print(f"导出: {export_onnx(model_path)}")
+        if args.int8:
+          print(f"量化: {quantize_onnx(model_path)}")
+  else:
+    benchmark(args.image, args.backends.split(","), args.runs)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,177 @@
+"""
+YOLO动态微批处理: 将短时间内到达的多张图片合并为一次批量推理.
+"""
+
+import asyncio
+import contextvars
+from collections import Counter
+from time import monotonic
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .detections import Detections
+from .executor import inference_executor, inflight_work
+from .backends import InferenceModel
+from .metrics import queue_wait_seconds
+
+batching_predictors: List["BatchingPredictor"] = []
+"""所有已创建的批处理器, 用于汇总统计信息"""
+
+
+class BatchingStats:
+  """批处理统计: 批次填充率与排队等待时间"""
+
+  def __init__(self, max_batch_size: int):
+    self.max_batch_size = max_batch_size
+    self.batches = 0
+    self.images = 0
+    self.errors = 0
+    self.batch_sizes: Counter = Counter()
+    self.queue_wait_total = 0.0
+    self.queue_wait_max = 0.0
+
+  def record(self, waits: List[float]) -> None:
+    self.batches += 1
+    self.images += len(waits)
+    self.batch_sizes[len(waits)] += 1
+    self.queue_wait_total += sum(waits)
+    self.queue_wait_max = max(self.queue_wait_max, *waits)
+
+  def to_dict(self) -> dict:
+    return {
+      "batches": self.batches,
+      "images": self.images,
+      "errors": self.errors,
+      "max_batch_size": self.max_batch_size,
+      "batch_sizes": dict(sorted(self.batch_sizes.items())),
+      "avg_batch_fill": (
+        self.images / (self.batches * self.max_batch_size)
+        if self.batches
+        else 0.0
+      ),
+      "avg_queue_wait": (
+        self.queue_wait_total / self.images if self.images else 0.0
+      ),
+      "max_queue_wait": self.queue_wait_max,
+    }
+
+
+class BatchingPredictor:
+  """YOLO动态微批处理器。
+
+  请求调用`predict`时图片进入队列; 后台任务取出第一张图片后, 在
+  `max_wait`秒内继续收集, 直到达到`max_batch_size`张, 然后在推理
+  线程池中执行一次批量推理, 再把各自的结果返回给等待的请求。
+  同一模型同时只有一个批次在推理, 推理期间到达的请求会组成下一批。
+  `max_batch_size`不大于1时直接逐张推理。
+  """
+
+  def __init__(
+    self, name: str, model: InferenceModel, max_batch_size: int, max_wait: float
+  ):
+    self.name = name
+    self.model = model
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    self.stats = BatchingStats(max_batch_size)
+    self._queue_wait = queue_wait_seconds.labels(name)
+    self._queue: Optional[asyncio.Queue] = None
+    self._worker: Optional[asyncio.Task] = None
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+    batching_predictors.append(self)
+
+  async def predict(self, img: np.ndarray) -> Detections:
+    """
+    提交一张图片并等待其识别结果。
+    Args:
+      img (np.ndarray): BGR格式的图片。
+    Returns:
+      Detections: 与`YoloModel.predict`相同格式的结果。
+    """
+    if self.max_batch_size <= 1:
+      return await inference_executor.run(self.model.predict, img)
+    self._ensure_worker()
+    future = self._loop.create_future()
+    # 批量推理在后台任务中执行, 请求被取消时仍要等待所在批次推理完毕
+    work = inflight_work.get()
+    done = work.hold() if work is not None else None
+    self._queue.put_nowait((img, future, monotonic(), done))
+    return await future
+
+  def close(self) -> None:
+    """停止后台批处理任务并移除统计信息, 模型被淘汰时调用"""
+    if self._worker is not None:
+      self._worker.cancel()
+    if self in batching_predictors:
+      batching_predictors.remove(self)
+
+  def _ensure_worker(self) -> None:
+    """在当前事件循环中启动后台批处理任务(每个事件循环一个)"""
+    loop = asyncio.get_running_loop()
+    if self._loop is not loop or self._worker is None or self._worker.done():
+      self._loop = loop
+      self._queue = asyncio.Queue()
+      # 使用新的上下文: 后台任务不属于触发创建它的请求
+      self._worker = loop.create_task(
+        self._run(), context=contextvars.Context()
+      )
+
+  async def _collect(self) -> list:
+    """收集一个批次: 阻塞等待第一张, 之后最多再等待`max_wait`秒"""
+    batch = [await self._queue.get()]
+    deadline = monotonic() + self.max_wait
+    while len(batch) < self.max_batch_size:
+      timeout = deadline - monotonic()
+      if timeout <= 0:
+        # 不再等待, 但已在队列中的图片仍然并入本批次
+        if self._queue.empty():
+          break
+        batch.append(self._queue.get_nowait())
+        continue
+      try:
+        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+      except asyncio.TimeoutError:
+        break
+    return batch
+
+  async def _run(self) -> None:
+    while True:
+      collected = await self._collect()
+      # 跳过已取消(客户端已断开)的请求
+      batch = [item for item in collected if not item[1].done()]
+      _finish([item for item in collected if item[1].done()])
+      if not batch:
+        continue
+      started = monotonic()
+      waits = [started - queued for _, _, queued, _ in batch]
+      self.stats.record(waits)
+      for wait in waits:
+        self._queue_wait.observe(wait)
+      try:
+        results = await inference_executor.run(
+          self.model.predict_batch, [img for img, _, _, _ in batch]
+        )
+      except Exception as e:
+        self.stats.errors += 1
+        for _, future, _, _ in batch:
+          if not future.done():
+            future.set_exception(e)
+        _finish(batch)
+        continue
+      for (_, future, _, _), result in zip(batch, results):
+        if not future.done():
+          future.set_result(result)
+      _finish(batch)
+
+
+def _finish(items: list) -> None:
+  """通知各请求的`InflightWork`: 这些图片的推理已结束"""
+  for *_, done in items:
+    if done is not None:
+      done()
+
+
+def batching_stats() -> Dict[str, dict]:
+  """返回所有批处理器的统计信息"""
+  return {p.name: p.stats.to_dict() for p in batching_predictors}
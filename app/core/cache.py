@@ -0,0 +1,280 @@
+"""
+识别结果缓存: 以图片内容哈希为键, 相同图片再次上传时直接复用识别结果.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from .detections import Detections
+from .metrics import cache_requests
+from .settings import settings
+
+
+def content_digest(content: bytes) -> str:
+  """计算图片内容的SHA-256哈希"""
+  return hashlib.sha256(content).hexdigest()
+
+
+def file_fingerprint(*paths: Path) -> str:
+  """
+  根据文件路径、大小与修改时间计算模型版本标识, 替换模型文件后
+  旧的缓存结果自然失效。
+  """
+  h = hashlib.sha1()
+  for path in paths:
+    try:
+      stat = os.stat(path)
+      h.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    except OSError:
+      h.update(f"{path}:missing;".encode("utf-8"))
+  return h.hexdigest()[:16]
+
+
+def cache_key(*parts: Any) -> str:
+  """将端点名称、内容哈希、模型版本及请求参数拼接为缓存键"""
+  return ":".join(str(part) for part in parts)
+
+
+def _default(value: Any) -> Any:
+  """JSON序列化`Detections`与NumPy数值"""
+  if isinstance(value, Detections):
+    return {
+      "__detections__": {
+        "xyxy": value.xyxy.tolist(),
+        "conf": value.conf.tolist(),
+        "cls": value.cls.tolist(),
+        "names": value.names,
+      }
+    }
+  if isinstance(value, (np.ndarray, np.generic)):
+    return value.tolist()
+  raise TypeError(f"无法缓存的类型: {type(value).__name__}")
+
+
+def _object_hook(obj: dict) -> Any:
+  data = obj.get("__detections__")
+  if data is None:
+    return obj
+  return Detections(
+    np.asarray(data["xyxy"], dtype=np.float32).reshape(-1, 4),
+    np.asarray(data["conf"], dtype=np.float32),
+    np.asarray(data["cls"], dtype=np.int32),
+    # JSON对象的键只能是字符串
+    {int(k): v for k, v in data["names"].items()},
+  )
+
+
+def serialize(value: Any) -> bytes:
+  """
+  将识别结果序列化为JSON。不使用pickle: 磁盘层的文件被改写时,
+  读取缓存也不会执行任意代码。元组会变为列表。
+  """
+  return json.dumps(
+    value, default=_default, ensure_ascii=False, separators=(",", ":")
+  ).encode("utf-8")
+
+
+def deserialize(data: bytes) -> Any:
+  """`serialize`的逆操作"""
+  return json.loads(data, object_hook=_object_hook)
+
+
+class ResultCache:
+  """两级识别结果缓存。
+
+  内存层按序列化后的字节数做LRU淘汰; 可选的磁盘层将结果写入
+  `disk_dir`, 服务重启后仍然有效, 磁盘层超过`disk_max_bytes`时
+  删除最久未写入的文件。所有方法线程安全。
+  """
+
+  def __init__(
+    self,
+    max_bytes: int,
+    disk_dir: Optional[Path] = None,
+    disk_max_bytes: int = 0,
+  ):
+    self.max_bytes = max_bytes
+    self.disk_dir = Path(disk_dir) if disk_dir else None
+    self.disk_max_bytes = disk_max_bytes
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries: OrderedDict[str, bytes] = OrderedDict()
+    self._size = 0
+    self._disk_size: Optional[int] = None
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self) -> bool:
+    return self.max_bytes > 0 or self.disk_dir is not None
+
+  def get(self, key: str) -> Optional[Any]:
+    """
+    读取缓存, 内存未命中时尝试磁盘层并回填内存层。
+    Returns:
+      Optional[Any]: 缓存的值, 未命中时返回None。
+    """
+    if not self.enabled:
+      return None
+    tier = "memory"
+    with self._lock:
+      data = self._entries.get(key)
+      if data is not None:
+        self._entries.move_to_end(key)
+    if data is None and self.disk_dir is not None:
+      tier = "disk"
+      data = self._read_disk(key)
+    value = None
+    if data is not None:
+      try:
+        value = deserialize(data)
+      except (ValueError, KeyError, TypeError):
+        # 损坏或旧格式的条目, 删除后视为未命中
+        self._evict(key)
+        data = None
+    with self._lock:
+      if data is None:
+        self.misses += 1
+      elif tier == "memory":
+        self.hits += 1
+      else:
+        self.disk_hits += 1
+        self._put_memory(key, data)
+    cache_requests.labels("miss" if data is None else tier).inc()
+    return value
+
+  def set(self, key: str, value: Any) -> None:
+    """写入缓存(内存层与磁盘层)"""
+    if not self.enabled:
+      return
+    data = serialize(value)
+    with self._lock:
+      self._put_memory(key, data)
+    if self.disk_dir is not None:
+      self._write_disk(key, data)
+
+  def _evict(self, key: str) -> None:
+    """删除某个条目(内存层与磁盘层)"""
+    with self._lock:
+      data = self._entries.pop(key, None)
+      if data is not None:
+        self._size -= len(data)
+    if self.disk_dir is None:
+      return
+    path = self._disk_path(key)
+    try:
+      size = path.stat().st_size
+      path.unlink()
+    except OSError:
+      return
+    with self._lock:
+      if self._disk_size is not None:
+        self._disk_size -= size
+
+  def clear(self) -> None:
+    """清空内存层(磁盘层保留)"""
+    with self._lock:
+      self._entries.clear()
+      self._size = 0
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        "entries": len(self._entries),
+        "bytes": self._size,
+        "max_bytes": self.max_bytes,
+        "hits": self.hits,
+        "disk_hits": self.disk_hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "disk_bytes": self._disk_size,
+      }
+
+  def _put_memory(self, key: str, data: bytes) -> None:
+    """写入内存层并按字节数淘汰最久未使用的条目, 调用方需持有锁"""
+    if len(data) > self.max_bytes:
+      return
+    old = self._entries.pop(key, None)
+    if old is not None:
+      self._size -= len(old)
+    self._entries[key] = data
+    self._size += len(data)
+    while self._size > self.max_bytes:
+      _, evicted = self._entries.popitem(last=False)
+      self._size -= len(evicted)
+      self.evictions += 1
+
+  def _disk_path(self, key: str) -> Path:
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return self.disk_dir / name[:2] / f"{name}.json"
+
+  def _read_disk(self, key: str) -> Optional[bytes]:
+    try:
+      return self._disk_path(key).read_bytes()
+    except OSError:
+      return None
+
+  def _write_disk(self, key: str, data: bytes) -> None:
+    path = self._disk_path(key)
+    try:
+      path.parent.mkdir(parents=True, exist_ok=True)
+      # 先写临时文件再替换, 避免其它进程读到不完整的文件
+      tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+      tmp.write_bytes(data)
+      try:
+        # 覆盖已有文件时只增加大小之差
+        replaced = path.stat().st_size
+      except OSError:
+        replaced = 0
+      os.replace(tmp, path)
+    except OSError as e:
+      print(f"写入结果缓存失败: {e}")
+      return
+    with self._lock:
+      if self._disk_size is None:
+        self._disk_size = self._scan_disk_size()
+      else:
+        self._disk_size += len(data) - replaced
+      if self.disk_max_bytes and self._disk_size > self.disk_max_bytes:
+        self._prune_disk()
+
+  def _scan_disk_size(self) -> int:
+    return sum(p.stat().st_size for p in self.disk_dir.glob("*/*.json"))
+
+  def _prune_disk(self) -> None:
+    """删除最久未写入的文件, 直到磁盘层低于上限的90%"""
+    files = []
+    for p in self.disk_dir.glob("*/*.json"):
+      try:
+        stat = p.stat()
+      except OSError:
+        continue
+      files.append((stat.st_mtime, stat.st_size, p))
+    files.sort()
+    size = sum(f[1] for f in files)
+    target = self.disk_max_bytes * 0.9
+    for _, file_size, p in files:
+      if size <= target:
+        break
+      try:
+        p.unlink()
+        size -= file_size
+      except OSError:
+        pass
+    self._disk_size = size
+
+
+result_cache = ResultCache(
+  settings.RESULT_CACHE_MAX_BYTES,
+  settings.RESULT_CACHE_DIR,
+  settings.RESULT_CACHE_DISK_MAX_BYTES,
+)
+"""全局识别结果缓存, /image2hmi 与 /ocr 共用"""
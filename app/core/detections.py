@@ -0,0 +1,190 @@
+"""
+YOLO与PaddleOCR识别结果的列式表示.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+from ultralytics.engine.results import Results
+
+
+class Detections:
+  """YOLO识别结果的列式表示。
+
+  从`Results`中一次性取出坐标、置信度和类别为NumPy数组, 不再持有
+  原图与张量, 便于缓存、序列化以及批量后处理。
+  """
+
+  __slots__ = ("xyxy", "conf", "cls", "names")
+
+  def __init__(
+    self,
+    xyxy: np.ndarray,
+    conf: np.ndarray,
+    cls: np.ndarray,
+    names: Dict[int, str],
+  ):
+    self.xyxy = xyxy
+    """(N, 4) float32, 左上角与右下角坐标"""
+    self.conf = conf
+    """(N,) float32, 置信度"""
+    self.cls = cls
+    """(N,) int32, 类别ID"""
+    self.names = names
+    """类别ID到类别名称的映射"""
+
+  @classmethod
+  def empty(cls, names: Dict[int, str] = None) -> "Detections":
+    return cls(
+      np.zeros((0, 4), dtype=np.float32),
+      np.zeros(0, dtype=np.float32),
+      np.zeros(0, dtype=np.int32),
+      names or {},
+    )
+
+  @classmethod
+  def from_results(cls, results: List[Results]) -> "Detections":
+    """
+    合并一组YOLO`Results`中的所有检测框。
+    Args:
+      results (List[Results]): `YoloModel.predict`的返回值。
+    Returns:
+      Detections: 列式识别结果。
+    """
+    results = [item for item in results if item.boxes is not None]
+    if not results:
+      return cls.empty()
+    boxes = [item.boxes for item in results]
+    return cls(
+      np.concatenate([b.xyxy.cpu().numpy() for b in boxes]).astype(
+        np.float32, copy=False
+      ),
+      np.concatenate([b.conf.cpu().numpy() for b in boxes]).astype(
+        np.float32, copy=False
+      ),
+      np.concatenate([b.cls.cpu().numpy() for b in boxes]).astype(np.int32),
+      dict(results[0].names),
+    )
+
+  @classmethod
+  def concatenate(cls, items: List["Detections"]) -> "Detections":
+    """合并多组识别结果(如多个切片的结果)"""
+    items = [item for item in items if len(item)]
+    if not items:
+      return cls.empty()
+    return cls(
+      np.concatenate([item.xyxy for item in items]),
+      np.concatenate([item.conf for item in items]),
+      np.concatenate([item.cls for item in items]),
+      items[0].names,
+    )
+
+  def shift(self, dx: float, dy: float) -> "Detections":
+    """平移坐标, 用于将切片内的坐标还原到原图"""
+    return Detections(
+      self.xyxy + np.array([dx, dy, dx, dy], dtype=np.float32),
+      self.conf,
+      self.cls,
+      self.names,
+    )
+
+  def rescale(self, factor: float) -> "Detections":
+    """缩放坐标, 用于将缩小解码的图片上的坐标还原到原图"""
+    return Detections(self.xyxy * factor, self.conf, self.cls, self.names)
+
+  def select(self, indexes: np.ndarray) -> "Detections":
+    """按索引或布尔掩码选取部分识别结果"""
+    return Detections(
+      self.xyxy[indexes], self.conf[indexes], self.cls[indexes], self.names
+    )
+
+  def __len__(self) -> int:
+    return len(self.conf)
+
+  @property
+  def nbytes(self) -> int:
+    return self.xyxy.nbytes + self.conf.nbytes + self.cls.nbytes
+
+
+class TextDetections:
+  """PaddleOCR识别结果的列式表示。
+
+  PaddleOCR返回按行嵌套的列表, 每个文本框一项; 这里一次展平为
+  NumPy数组, 后续的过滤与坐标计算按列批量进行。坐标与置信度使用
+  float64, 转换回Python数值时与PaddleOCR的原始值一致。
+  """
+
+  __slots__ = ("boxes", "conf", "texts")
+
+  def __init__(self, boxes: np.ndarray, conf: np.ndarray, texts: List[str]):
+    self.boxes = boxes
+    """(N, 4, 2) float64, 文本框四个顶点(左上、右上、右下、左下)"""
+    self.conf = conf
+    """(N,) float64, 置信度"""
+    self.texts = texts
+    """识别出的文本"""
+
+  @classmethod
+  def from_ocr(cls, ocr_result: list) -> "TextDetections":
+    """
+    展平PaddleOCR识别结果, 跳过空结果(`[None]`)与格式不完整的项。
+    Args:
+      ocr_result (list): `ocr`的返回值。
+    Returns:
+      TextDetections: 列式识别结果。
+    """
+    boxes, conf, texts = [], [], []
+    for item in ocr_result:
+      # PaddleOCR 在未识别到文字时返回 [None]
+      if not item:
+        continue
+      for box, content in item:
+        if len(content) < 2 or len(box) < 4:
+          continue
+        boxes.append(box[:4])
+        texts.append(content[0])
+        conf.append(content[1])
+    if not boxes:
+      return cls(np.zeros((0, 4, 2)), np.zeros(0), [])
+    return cls(
+      np.asarray(boxes, dtype=np.float64),
+      np.asarray(conf, dtype=np.float64),
+      texts,
+    )
+
+  @property
+  def xyxy(self) -> np.ndarray:
+    """(N, 4) 左上角与右下角坐标"""
+    return self.boxes[:, [0, 2]].reshape(-1, 4)
+
+  def select(self, indexes: np.ndarray) -> "TextDetections":
+    """按索引或布尔掩码选取部分识别结果"""
+    indexes = np.flatnonzero(indexes) if indexes.dtype == bool else indexes
+    return TextDetections(
+      self.boxes[indexes],
+      self.conf[indexes],
+      [self.texts[i] for i in indexes.tolist()],
+    )
+
+  def __len__(self) -> int:
+    return len(self.texts)
+
+
+def box_areas(xyxy: np.ndarray) -> np.ndarray:
+  """
+  批量计算矩形的位置与尺寸, 与`calculate_area`逐个计算的结果相同。
+  Args:
+    xyxy (np.ndarray): (N, 4) 左上角与右下角坐标。
+  Returns:
+    np.ndarray: (N, 4) int64, 每行为x、y、width、height。
+  """
+  # 与int()相同, 向零取整
+  ints = xyxy.astype(np.int64)
+  return np.column_stack(
+    (
+      ints[:, 0],
+      ints[:, 1],
+      np.abs(ints[:, 2] - ints[:, 0]),
+      np.abs(ints[:, 3] - ints[:, 1]),
+    )
+  )
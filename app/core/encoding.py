@@ -0,0 +1,45 @@
+"""
+SSE事件编码: 事件直接编码为UTF-8字节交给`StreamingResponse`, 不再逐个
+拼接字符串后再由框架编码. JSON使用orjson序列化.
+"""
+
+from typing import Dict, Union
+
+import orjson
+
+
+def dumps(obj) -> bytes:
+  """
+  序列化为紧凑的UTF-8 JSON, 中文不转义。NumPy数值与数组按Python数值
+  与列表序列化(orjson默认不接受`np.float64`等)。
+  """
+  return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def with_payload(payload: bytes, rest: dict) -> bytes:
+  """
+  拼接已编码的`payload`与其余字段, 结果与`dumps({"payload": ..., **rest})`
+  相同, 但`payload`(如符号映射)不再重复序列化。
+  Args:
+    payload (bytes): 已编码的`payload`字段值。
+    rest (dict): 其余字段, 不能为空。
+  """
+  return b'{"payload":' + payload + b"," + dumps(rest)[1:]
+
+
+_prefixes: Dict[str, bytes] = {}
+
+
+def sse_event(event: str, data: Union[str, bytes]) -> bytes:
+  """
+  编码一个SSE事件。
+  Args:
+    event (str): 事件类型。
+    data (Union[str, bytes]): 事件数据, 不能包含换行。
+  """
+  prefix = _prefixes.get(event)
+  if prefix is None:
+    prefix = _prefixes[event] = f"event: {event}\ndata: ".encode("utf-8")
+  if isinstance(data, str):
+    data = data.encode("utf-8")
+  return prefix + data + b"\n\n"
@@ -0,0 +1,119 @@
+"""
+推理执行器: 在线程池中运行模型推理, 避免阻塞事件循环.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Callable, Optional
+
+from .metrics import queue_wait_seconds
+from .settings import settings
+
+_executor_wait = queue_wait_seconds.labels("executor")
+
+
+class InflightWork:
+  """一个请求提交的、尚未执行完毕的推理。
+
+  取消等待推理的协程(如客户端断开)不会停止已经开始执行的推理线程,
+  线程仍在使用推理名额与模型。请求的各阶段都结束后调用`close`, 此后
+  所有登记的推理执行完毕时调用`on_idle`(只调用一次), 用于在推理真正
+  结束后才归还名额与模型占用。只在事件循环线程中使用。
+  """
+
+  def __init__(self, on_idle: Callable[[], None]):
+    self._on_idle: Optional[Callable[[], None]] = on_idle
+    self._pending = 0
+    self._closed = False
+
+  def hold(self) -> Callable[..., None]:
+    """登记一项推理, 返回推理结束时调用的函数(可重复调用, 只生效一次)"""
+    self._pending += 1
+    finished = False
+
+    def done(*_) -> None:
+      nonlocal finished
+      if not finished:
+        finished = True
+        self._pending -= 1
+        self._check()
+
+    return done
+
+  def close(self) -> None:
+    """不再登记新的推理"""
+    self._closed = True
+    self._check()
+
+  def _check(self) -> None:
+    if self._closed and not self._pending and self._on_idle is not None:
+      on_idle, self._on_idle = self._on_idle, None
+      on_idle()
+
+
+inflight_work: ContextVar[Optional[InflightWork]] = ContextVar(
+  "inflight_work", default=None
+)
+"""当前请求的`InflightWork`, 推理提交时登记到其中"""
+
+
+class InferenceExecutor:
+  """模型推理线程池。
+
+  YOLO(PyTorch)与PaddleOCR在推理时会释放GIL, 因此使用线程池即可让
+  符号、线条、文字三个阶段并行执行, 同时保持事件循环可响应其它请求
+  (健康检查、其它SSE流等)。线程池在首次使用时创建。
+  """
+
+  def __init__(self, max_workers: int):
+    self.max_workers = max_workers
+    self._executor: Optional[ThreadPoolExecutor] = None
+
+  @property
+  def executor(self) -> ThreadPoolExecutor:
+    if self._executor is None:
+      self._executor = ThreadPoolExecutor(
+        max_workers=self.max_workers, thread_name_prefix="inference"
+      )
+    return self._executor
+
+  async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    在线程池中执行同步函数并等待其结果。
+    Args:
+      func (Callable): 需要执行的同步函数, 如`model.predict`。
+      *args, **kwargs: 传递给`func`的参数。
+    Returns:
+      Any: `func`的返回值。
+    """
+    submitted = perf_counter()
+
+    def call():
+      # 记录提交到开始执行之间的排队时间
+      _executor_wait.observe(perf_counter() - submitted)
+      return func(*args, **kwargs)
+
+    task = self.executor.submit(call)
+    future = asyncio.wrap_future(task)
+    work = inflight_work.get()
+    if work is not None:
+      future.add_done_callback(work.hold())
+    try:
+      # 被取消时不取消`future`: 它在线程真正执行完毕时才结束
+      return await asyncio.shield(future)
+    except asyncio.CancelledError:
+      # 尚未开始执行的推理不再执行, 已开始的只能等待其执行完毕
+      task.cancel()
+      raise
+
+  def shutdown(self) -> None:
+    """关闭线程池, 等待正在执行的推理完成。"""
+    if self._executor is not None:
+      self._executor.shutdown(wait=True)
+      self._executor = None
+
+
+inference_executor = InferenceExecutor(settings.INFERENCE_EXECUTOR_WORKERS)
+"""全局推理执行器实例"""
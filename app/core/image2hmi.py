@@ -2,50 +2,223 @@
 Core logic for image to HMI conversion.
 """
 
-import json
+import asyncio
 import re
+import threading
 from asyncio import sleep
 from datetime import datetime
+from itertools import count
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from time import monotonic
+from typing import Any, Awaitable, Dict, Iterator, List, Optional
 
-import cv2
 import numpy as np
 from ultralytics import YOLO
-from ultralytics.engine.results import Results
 
+from .detections import Detections, TextDetections, box_areas
+from .encoding import dumps, sse_event, with_payload
+from .lines import LineNetwork, vectorize_lines
+from .metrics import RequestTimings
 from .settings import settings
+from .symbol_mapping import SymbolMapper
+from .tags import TaggedDetections, bind_texts
 
 # 配置常量
 ALLOWED_MIME_TYPES = ["image/jpeg", "image/png", "image/jpg"]
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png"}
 
+# SSE推送方式:
+#   stream: 每个识别结果一个事件, 不等待, 推送耗时只取决于推理
+#   paced: 每个识别结果前后等待`SERVER_SEND_EVENTS_INTERVAL`秒(动画效果)
+#   batch: 多个识别结果合并为一个`batch`事件
+DELIVERY_MODES = ("stream", "paced", "batch")
+BATCH_LABELS = {"symbol": "图符", "line": "线条", "text": "文字"}
+# 增量识别的事件类型
+REVISION_LABELS = {"remove": "删除", "update": "修改", "add": "新增"}
 
-class SymbolMapper:
-  def __init__(self, mapping_path: Path):
-    self.mapping = self._load_mapping(mapping_path)
+# 固定内容的事件, 只编码一次
+START_EVENT = sse_event("start", "开始图片分析任务")
+DRAW_EVENT = sse_event("message", "开始绘制:")
+DONE_EVENT = sse_event("done", "图片分析完成")
 
-  def _load_mapping(self, path: Path) -> dict:
-    try:
-      with open(path, "r", encoding="utf-8") as file:
-        return json.load(file)
-    except Exception as e:
-      print(f"加载符号映射文件失败: {e}")
-      return {}
 
-  def to_hmi_symbol(self, name: str) -> Optional[Any]:
-    flag = self.mapping.get(name, None)
-    if flag is None:
-      print(f"未找到名称: {name}")
-    return flag
+class YoloModel:
+  """PyTorch推理后端, 通过`ultralytics.YOLO`加载`.pt`模型"""
 
+  backend = "torch"
 
-class YoloModel:
   def __init__(self, model_path: Path):
+    self.path = model_path
     self.model = YOLO(model_path)
+    # ultralytics的predictor不是线程安全的, 同一模型的推理需要串行
+    self._lock = threading.Lock()
+    imgsz = self.model.overrides.get("imgsz", 640)
+    if isinstance(imgsz, int):
+      imgsz = (imgsz, imgsz)
+    self.imgsz = (int(imgsz[0]), int(imgsz[1]))
+    """训练时的输入尺寸(高, 宽), 也是ultralytics推理时的默认尺寸"""
+
+  def predict(self, img: np.ndarray, imgsz: Optional[int] = None) -> Detections:
+    """
+    推理一张图片。
+    Args:
+      img (np.ndarray): BGR格式的图片。
+      imgsz (Optional[int]): 本次推理的输入尺寸(如自适应推理的低分辨率
+        预识别), 默认为训练时的尺寸。
+    """
+    options = {} if imgsz is None else {"imgsz": imgsz}
+    with self._lock:
+      results = self.model.predict(source=img, verbose=False, **options)
+    return Detections.from_results(results)
+
+  def predict_batch(self, imgs: List[np.ndarray]) -> List[Detections]:
+    """
+    一次前向推理处理多张图片。
+    Args:
+      imgs (List[np.ndarray]): BGR格式的图片列表。
+    Returns:
+      List[Detections]: 与`imgs`一一对应, 每项格式与`predict`相同。
+    """
+    with self._lock:
+      results = self.model.predict(source=imgs, verbose=False)
+    return [Detections.from_results([result]) for result in results]
+
+  def predict_tensor(self, tensor) -> List[Detections]:
+    """
+    推理已经预处理的BCHW张量(RGB, 0~1), 坐标为张量上的坐标。
+    用于多个模型共用一次预处理, 见`backends.PairedYoloModel`。
+    """
+    with self._lock:
+      results = self.model.predict(source=tensor, verbose=False)
+    return [Detections.from_results([result]) for result in results]
+
+
+class TiledPredictor:
+  """切片推理: 用于尺寸很大、符号很小的工艺流程图。
+
+  整图一次缩放到YOLO输入尺寸会丢失小图符。切片推理将图片切成互相
+  重叠的`tile_size`见方的切片(NumPy视图, 不复制像素), 与缩放后的整图
+  一起提交给`predictor`(通常是`BatchingPredictor`, 多个切片会合并为
+  批量推理), 再把坐标还原到原图, 最后用NMS合并切片边界处的重复结果。
+  同时在途的切片最多`max_inflight`个, 超大图片的内存占用有上限。
+  `predictor`返回(图符, 线条)元组(共用预处理)时, 两组结果分别合并。
+  """
+
+  def __init__(
+    self,
+    predictor,
+    tile_size: int,
+    overlap: float,
+    merge_threshold: float,
+    max_inflight: int,
+  ):
+    self.predictor = predictor
+    self.tile_size = tile_size
+    self.overlap = overlap
+    self.merge_threshold = merge_threshold
+    self.max_inflight = max(1, max_inflight)
+
+  async def predict(self, img: np.ndarray) -> Detections:
+    """
+    切片推理一张图片。
+    Args:
+      img (np.ndarray): BGR格式的图片。
+    Returns:
+      Detections: 合并后的识别结果, 坐标为原图坐标。
+    """
+    tiles = tile_offsets(img.shape[:2], self.tile_size, self.overlap)
+    if len(tiles) <= 1:
+      return await self.predictor.predict(img)
+    # 整图也参与推理, 识别跨越多个切片的大图符
+    full = asyncio.ensure_future(self.predictor.predict(img))
+    results = []
+    try:
+      for start in range(0, len(tiles), self.max_inflight):
+        chunk = tiles[start : start + self.max_inflight]
+        detections = await asyncio.gather(
+          *(
+            self.predictor.predict(
+              img[y : y + self.tile_size, x : x + self.tile_size]
+            )
+            for x, y in chunk
+          )
+        )
+        results.extend(
+          _shift(item, x, y) for item, (x, y) in zip(detections, chunk)
+        )
+      results.append(await full)
+    finally:
+      full.cancel()
+    return _merge_tiles(results, self.merge_threshold)
+
+
+def _shift(item, dx: float, dy: float):
+  """平移切片结果, `item`为`Detections`或(图符, 线条)元组"""
+  if isinstance(item, tuple):
+    return tuple(detections.shift(dx, dy) for detections in item)
+  return item.shift(dx, dy)
+
+
+def _merge_tiles(results: list, threshold: float):
+  """合并各切片的结果, (图符, 线条)元组按位置分别合并"""
+  if isinstance(results[0], tuple):
+    return tuple(
+      _merge_tiles(list(parts), threshold) for parts in zip(*results)
+    )
+  merged = Detections.concatenate(results)
+  return merged.select(non_max_suppression(merged, threshold))
+
+
+def tile_offsets(shape: tuple, tile_size: int, overlap: float) -> List[tuple]:
+  """
+  计算覆盖整张图片的切片左上角坐标, 相邻切片重叠`overlap`比例。
+  最后一行/列的切片贴齐图片边缘, 保证每个切片都是完整尺寸。
+  Returns:
+    List[tuple]: (x, y)列表, 图片不大于切片尺寸时只有一个(0, 0)。
+  """
+  height, width = shape
+  step = max(1, int(tile_size * (1 - overlap)))
+
+  def starts(length: int) -> List[int]:
+    if length <= tile_size:
+      return [0]
+    positions = list(range(0, length - tile_size, step))
+    positions.append(length - tile_size)
+    return positions
+
+  return [(x, y) for y in starts(height) for x in starts(width)]
+
 
-  def predict(self, img: np.ndarray) -> List[Results]:
-    return self.model.predict(source=img, verbose=False)
+def non_max_suppression(detections: Detections, threshold: float) -> np.ndarray:
+  """
+  按类别的NMS, 用于合并切片边界处的重复结果。
+  重叠度使用交集除以较小框面积(而不是IoU): 被切片边界截断的残缺框
+  完全落在完整框之内, IoU很低但交集占比接近1。
+  Returns:
+    np.ndarray: 保留的结果索引, 按置信度降序。
+  """
+  if not len(detections):
+    return np.zeros(0, dtype=np.int64)
+  # 不同类别的框平移到互不重叠的区域, 一次NMS即可按类别抑制
+  offset = detections.xyxy.max() + 1
+  boxes = detections.xyxy + (detections.cls * offset)[:, None]
+  areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+  order = np.argsort(-detections.conf, kind="stable")
+  keep = []
+  while order.size:
+    i = order[0]
+    keep.append(i)
+    rest = order[1:]
+    w = np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(
+      boxes[i, 0], boxes[rest, 0]
+    )
+    h = np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(
+      boxes[i, 1], boxes[rest, 1]
+    )
+    inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+    smaller = np.maximum(np.minimum(areas[i], areas[rest]), 1e-6)
+    order = rest[inter / smaller <= threshold]
+  return np.array(keep, dtype=np.int64)
 
 
 class ImageValidator:
@@ -57,176 +230,656 @@ class ImageValidator:
     if file_extension not in ALLOWED_EXTENSIONS:
       raise ValueError("文件扩展名无效")
 
-  @staticmethod
-  def read_image_bytes(content: bytes) -> np.ndarray:
-    nparr = np.frombuffer(content, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if img is None:
-      raise ValueError("无法解码图片")
-    return img
-
 
 class HMIEventGenerator:
   """生成HMI事件的异步生成器。
   用于处理YOLO和PaddleOCR的识别结果，并生成HMI符号和文本事件。
   """
 
-  def __init__(self, symbol_mapper: SymbolMapper):
+  def __init__(
+    self,
+    symbol_mapper: SymbolMapper,
+    merge_lines: bool = False,
+    bind_texts: bool = False,
+  ):
+    """
+    Args:
+      symbol_mapper (SymbolMapper): 符号映射。
+      merge_lines (bool): 是否将线条矢量化为管线折线, 见`merged_lines`。
+      bind_texts (bool): 是否将文字绑定到所标注的图符, 见`tagged_symbols`。
+    """
     self.symbol_mapper = symbol_mapper
+    self.merge_lines = merge_lines
+    self.bind_texts = bind_texts
+    self.plan: Optional[asyncio.Future] = None
+    """自适应推理计划(`adaptive.InferencePlan`)的future, 设置后在计划
+    确定时推送`plan`事件, 不阻塞开始事件与识别结果"""
 
   async def generate(
     self,
-    symbol_results: List[Results],
-    line_results: List[Results],
-    text_results: List[Results],
+    symbol_results: Detections,
+    line_results: Detections,
+    text_results: list,
     fileInfo: dict,
     lang: Optional[str] = "ch",
+    delivery: Optional[str] = None,
+    timings: Optional[RequestTimings] = None,
+    stats: bool = False,
   ):
     """
     生成HMI事件的异步生成器。
     Args:
-      symbol_results (List[Results]): YOLO识别的符号结果。
-      line_results (List[Results]): YOLO识别的线条结果。
-      text_results (List[Results]): PaddleOCR识别的文本结果。
+      symbol_results (Detections): YOLO识别的符号结果。
+      line_results (Detections): YOLO识别的线条结果。
+      text_results (list): PaddleOCR识别的文本结果。
       fileInfo (dict): 包含文件信息的字典，如文件名、类型等。
       lang (Optional[str]): 语言选项，默认中文'ch',可选'en'表示英文,
         'fr'表示法文, 'german'表示德文, 'korean'表示韩文, 'japan'表示日文
+      delivery (Optional[str]): 推送方式, 见`DELIVERY_MODES`,
+        默认取`SERVER_SEND_EVENTS_MODE`配置。
+      timings (Optional[RequestTimings]): 请求的各阶段耗时, 推送耗时
+        记为`sse`阶段。
+      stats (bool): 是否在`done`事件之前发送包含各阶段耗时的`stats`事件。
+    Yields:
+      bytes: UTF-8编码的事件，包含识别的符号、线条和文本信息。
+    """
+    started = monotonic()
+    delivery = resolve_delivery_mode(delivery)
+    # 事件序号在一次生成过程中的所有阶段间共享
+    counter = count(1)
+    async for msg in self._start_events(fileInfo, delivery):
+      yield msg
+    if self.plan is not None:
+      async for msg in self._plan_events():
+        yield msg
+
+    if self.merge_lines:
+      line_results = await asyncio.to_thread(
+        self.merged_lines, line_results, symbol_results
+      )
+    if self.bind_texts:
+      symbol_results = await asyncio.to_thread(
+        self.tagged_symbols, symbol_results, text_results
+      )
+    for name, results in (
+      ("symbol", symbol_results),
+      ("line", line_results),
+      ("text", text_results),
+    ):
+      async for msg in self._stage_events(name, results, counter, delivery):
+        yield msg
+
+    for msg in self._end_events(started, timings, stats):
+      yield msg
+
+  async def generate_progressive(
+    self,
+    stages: Dict[str, Awaitable],
+    fileInfo: dict,
+    lang: Optional[str] = "ch",
+    delivery: Optional[str] = None,
+    timings: Optional[RequestTimings] = None,
+    stats: bool = False,
+  ):
+    """
+    渐进式生成HMI事件: 立即发送`start`事件, 各识别阶段并行执行,
+    哪个阶段先完成就先发送该阶段的事件, 多个阶段的事件合并为一个流。
+    Args:
+      stages (Dict[str, Awaitable]): 阶段名称("symbol"、"line"、
+        "text")到该阶段识别结果的可等待对象。
+      fileInfo (dict): 包含文件信息的字典，如文件名、类型等。
+      lang (Optional[str]): 语言选项，默认中文'ch'。
+      delivery (Optional[str]): 推送方式, 见`DELIVERY_MODES`。
+      timings, stats: 同`generate`。
     Yields:
-      str: 生成的事件字符串，包含识别的符号、线条和文本信息。
+      bytes: UTF-8编码的事件。某个阶段失败时发送`error`事件,
+        其它阶段不受影响。
     """
+    started = monotonic()
+    delivery = resolve_delivery_mode(delivery)
+    counter = count(1)
+    stages = self._dependent_stages(stages)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump(name: str, stage: Awaitable[list]):
+      """等待阶段结果, 并将该阶段的事件放入合并队列"""
+      try:
+        results = await stage
+        async for msg in self._stage_events(name, results, counter, delivery):
+          await queue.put(msg)
+      except Exception as e:
+        await queue.put(sse_event("error", f"{name}识别失败: {str(e)}"))
+      finally:
+        # None 表示该阶段结束
+        await queue.put(None)
+
+    async def pump_plan():
+      """计划确定后将`plan`事件放入合并队列"""
+      try:
+        async for msg in self._plan_events():
+          await queue.put(msg)
+      finally:
+        await queue.put(None)
+
+    # 先启动推理, 再发送开始事件, 让推理尽早开始
+    tasks = [
+      asyncio.create_task(pump(name, stage)) for name, stage in stages.items()
+    ]
+    if self.plan is not None:
+      tasks.append(asyncio.create_task(pump_plan()))
+    try:
+      async for msg in self._start_events(fileInfo, delivery):
+        yield msg
+      remaining = len(tasks)
+      while remaining:
+        msg = await queue.get()
+        if msg is None:
+          remaining -= 1
+          continue
+        yield msg
+    finally:
+      # 客户端断开连接时取消仍在等待的阶段
+      for task in tasks:
+        task.cancel()
 
-    yield "event: start\ndata: 开始图片分析任务\n\n"
+    for msg in self._end_events(started, timings, stats):
+      yield msg
+
+  async def generate_revision(
+    self,
+    changes: dict,
+    fileInfo: dict,
+    timings: Optional[RequestTimings] = None,
+    stats: bool = False,
+  ):
+    """
+    生成增量识别的事件: 各阶段相对旧版本删除、修改、新增的识别结果,
+    分别为`remove`、`update`、`add`事件, 逐条立即推送。
+    Args:
+      changes (dict): 阶段名称到`revisions.StageChanges`的映射。
+      fileInfo (dict): 包含文件信息的字典，如文件名、类型等。
+      timings, stats: 同`generate`。
+    Yields:
+      bytes: UTF-8编码的事件。
+    """
+    started = monotonic()
+    counter = count(1)
+    async for msg in self._start_events(fileInfo, "stream"):
+      yield msg
+    for name in ("symbol", "line", "text"):
+      for kind, label, data in self._revision_items(name, changes[name]):
+        yield sse_event(
+          "message", f"{next(counter)}. {REVISION_LABELS[kind]} {label} <br />"
+        ) + sse_event(kind, data)
+    for msg in self._end_events(started, timings, stats):
+      yield msg
+
+  def _revision_items(self, name: str, stage) -> Iterator[tuple]:
+    """
+    某个阶段的增量事件数据: `{"type": 阶段, "item": 事件数据}`, 修改
+    事件另有`previous`(旧的事件数据)。未配置映射等不推送的结果跳过,
+    修改前后只有一方会被推送时改为新增或删除。
+    Yields:
+      tuple[str, str, bytes]: 事件类型、消息文本与编码后的事件数据。
+    """
+    head = b'{"type":' + dumps(name) + b',"item":'
+    for label, data in self.encoded_items(name, stage.removed):
+      yield "remove", label, head + data + b"}"
+    for previous, current in stage.updated:
+      old = self.encoded_items(name, previous)
+      new = self.encoded_items(name, current)
+      if old and new:
+        label, data = new[0]
+        yield "update", label, head + data + b',"previous":' + old[0][1] + b"}"
+      for label, data in new if not old else []:
+        yield "add", label, head + data + b"}"
+      for label, data in old if not new else []:
+        yield "remove", label, head + data + b"}"
+    for label, data in self.encoded_items(name, stage.added):
+      yield "add", label, head + data + b"}"
+
+  def _dependent_stages(self, stages: Dict[str, Awaitable]) -> dict:
+    """
+    线条矢量化需要图符识别结果吸附端点, 位号绑定需要文字识别结果;
+    被依赖的阶段包装为任务, 同时供原阶段与依赖它的阶段等待。
+    """
+    merge_lines = self.merge_lines and stages.get("line") is not None
+    bind_texts = self.bind_texts and stages.get("symbol") is not None
+    if not (merge_lines or bind_texts):
+      return stages
+    stages = dict(stages)
+    symbols = stages.get("symbol")
+    if symbols is not None:
+      symbols = stages["symbol"] = asyncio.ensure_future(symbols)
+    if merge_lines:
+      stages["line"] = self._merged_line_stage(stages["line"], symbols)
+    if bind_texts:
+      texts = stages.get("text")
+      if texts is not None:
+        texts = stages["text"] = asyncio.ensure_future(texts)
+      stages["symbol"] = self._tagged_symbol_stage(symbols, texts)
+    return stages
+
+  async def _tagged_symbol_stage(
+    self, symbols: Awaitable, texts: Optional[Awaitable]
+  ) -> TaggedDetections:
+    """等待图符与文字识别结果后在线程中绑定, 文字识别失败时不绑定"""
+    symbol_results = await symbols
+    text_results = []
+    if texts is not None:
+      try:
+        text_results = await texts
+      except Exception:
+        pass
+    return await asyncio.to_thread(
+      self.tagged_symbols, symbol_results, text_results
+    )
+
+  def tagged_symbols(
+    self, symbol_results: Detections, text_results: list
+  ) -> TaggedDetections:
+    """
+    将文字绑定到所标注的图符(见`tags.bind_texts`)。只处理会被推送的
+    图符与文字, 每个文字最多绑定到一个图符, 文字仍单独推送`text`事件。
+    Args:
+      symbol_results (Detections): YOLO识别的图符结果。
+      text_results (list): PaddleOCR识别结果。
+    Returns:
+      TaggedDetections: 过滤后的图符及每个图符绑定的文字。
+    """
+    detections = self._mapped(symbol_results)[1]
+    texts = _visible_texts(text_results)
+    xyxy = texts.xyxy
+    owner = bind_texts(detections.xyxy, xyxy, settings.TEXT_BIND_DISTANCE)
+    tags: List[List[dict]] = [[] for _ in range(len(detections))]
+    bound = np.flatnonzero(owner >= 0)
+    # 按文字框的上边、左边排序, 每个图符的文字按阅读顺序排列
+    bound = bound[np.lexsort((xyxy[bound, 0], xyxy[bound, 1]))]
+    for i, symbol, conf, (x1, y1, x2, y2) in zip(
+      bound.tolist(),
+      owner[bound].tolist(),
+      texts.conf[bound].tolist(),
+      xyxy[bound].tolist(),
+    ):
+      tags[symbol].append(
+        {
+          "text": texts.texts[i],
+          "confidence": conf,
+          "x1": x1,
+          "y1": y1,
+          "x2": x2,
+          "y2": y2,
+        }
+      )
+    return TaggedDetections(detections, tags)
+
+  async def _merged_line_stage(
+    self, lines: Awaitable, symbols: Optional[Awaitable]
+  ) -> LineNetwork:
+    """等待线条与图符识别结果后在线程中矢量化, 图符识别失败时不吸附"""
+    line_results = await lines
+    symbol_results = None
+    if symbols is not None:
+      try:
+        symbol_results = await symbols
+      except Exception:
+        pass
+    return await asyncio.to_thread(
+      self.merged_lines, line_results, symbol_results
+    )
+
+  def merged_lines(
+    self, line_results: Detections, symbol_results: Optional[Detections]
+  ) -> LineNetwork:
+    """
+    将线条识别结果矢量化为管线折线(见`lines.vectorize_lines`)。
+    只处理会被推送的线条与图符: 未配置映射或置信度过低的结果不参与
+    合并与吸附。
+    Args:
+      line_results (Detections): YOLO识别的线条结果。
+      symbol_results (Optional[Detections]): YOLO识别的图符结果,
+        用于端点吸附, None表示不吸附。
+    """
+    symbols = None
+    if symbol_results is not None:
+      symbols = self._mapped(symbol_results)[1].xyxy
+    return vectorize_lines(
+      self._mapped(line_results)[1], symbols, settings.LINE_MERGE_GAP
+    )
+
+  def _end_events(
+    self, started: float, timings: Optional[RequestTimings], stats: bool
+  ) -> List[bytes]:
+    """生成结束事件, 并记录推送耗时"""
+    events = []
+    if timings is not None:
+      timings.record("sse", monotonic() - started)
+      if stats:
+        events.append(sse_event("stats", dumps(timings.to_dict())))
+    events.append(DONE_EVENT)
+    return events
+
+  async def _start_events(self, fileInfo: dict, delivery: str):
+    """生成开始事件及提示消息"""
+    yield START_EVENT
     msg = (
       f"收到用户发送的图片{fileInfo['filename']}, "
       f"我需要识别这个图片中的内容, "
       f"转换为 HMI 符号, 并在当前图纸上绘制出来."
     )
-    yield f"event: message\ndata: {msg}\n\n"
+    yield sse_event("message", msg)
 
-    await sleep(settings.SERVER_SEND_EVENTS_INTERVAL)
-    yield "event: message\ndata: 开始绘制:\n\n"
-    index = 0
+    if delivery == "paced":
+      await sleep(settings.SERVER_SEND_EVENTS_INTERVAL)
+    yield DRAW_EVENT
 
-    async def process_yolo_results(
-      results: List[Results], result_type: str, symbol_mapper: SymbolMapper
-    ):
-      """
-      处理YOLO识别结果的生成器。
-      Args:
-        results (List[Results]): YOLO识别结果列表。
-        result_type (str): 事件类型，默认为"symbol"或"line"。
-      Yields:
-        str: 生成的事件字符串，包含识别的符号或线条信息。
-      """
-      # Use `nonlocal index` to share the `index`
-      #   variable across nested functions, allowing
-      #   it to track the sequence of processed items
-      #   globally within the generator.
-      nonlocal index
-      for item in results:
-        for box in item.boxes:
-          await sleep(settings.SERVER_SEND_EVENTS_INTERVAL)
-          cls = box.cls.item()
-          cls_name = item.names[int(cls)]
-          payload = symbol_mapper.to_hmi_symbol(cls_name)
-          if payload is None:
-            continue
-          x1, y1, x2, y2 = box.xyxy[0].tolist()
-          attrs = calculate_area(x1, y1, x2, y2)
-          conf = box.conf.item()
-          index += 1
-          yield f"event: message\ndata: {index}. {cls_name} <br />\n\n"
-          await sleep(settings.SERVER_SEND_EVENTS_INTERVAL)
-          yield (
-            f"event: {result_type}\ndata: "
-            + json.dumps(
-              {
-                "payload": payload,
-                "origin": {
-                  "name": cls_name,
-                  "confidence": conf,
-                  "x1": x1,
-                  "y1": y1,
-                  "x2": x2,
-                  "y2": y2,
-                },
-                "attrs": attrs,
-                "createdAt": f"{datetime.now().isoformat()}",
-              },
-              ensure_ascii=False,
-            )
-            + "\n\n"
-          )
+  async def _plan_events(self):
+    """等待自适应推理计划并生成`plan`事件, 计划失败时由各阶段报告错误"""
+    try:
+      plan = await asyncio.shield(self.plan)
+    except Exception:
+      return
+    yield sse_event("plan", dumps(plan.to_dict()))
 
-    async def process_paddleocr_results(
-      results: list, result_type: str = "text"
-    ):
-      """处理PaddleOCR识别结果的生成器。
-      Args:
-        results (list): PaddleOCR识别结果列表。
-        result_type (str): 事件类型，默认为"text"。
-      Yields:
-        str: 生成的事件字符串，包含识别的文本和相关信息。
-      """
-      # Use `nonlocal index` to share the `index`
-      #   variable across nested functions, allowing
-      #   it to track the sequence of processed items
-      nonlocal index
-      for item in results:
-        for box, content in item:
-          if len(content) < 2:
-            continue
-          if len(box) < 4:
-            continue
-
-          await sleep(settings.SERVER_SEND_EVENTS_INTERVAL)
-          x1, y1 = box[0]
-          x2, y2 = box[2]
-          confidence = content[1]
-          text = content[0].strip()
-          if not text:
-            continue
-          payload = {"text": text}
-          origin = {
+  async def _stage_events(
+    self, name: str, results, counter: Iterator[int], delivery: str
+  ):
+    """
+    按推送方式生成某个识别阶段的事件。
+    Args:
+      name (str): 阶段名称, 同时也是事件类型("symbol"、"line"、"text")。
+      results: 该阶段的识别结果, 符号/线条为`Detections`,
+        文字为PaddleOCR识别结果列表。
+      counter (Iterator[int]): 事件序号计数器, 在各阶段间共享。
+      delivery (str): 推送方式, 见`DELIVERY_MODES`。
+    Yields:
+      bytes: UTF-8编码的事件。
+    """
+    items = self.encoded_items(name, results)
+
+    if delivery == "batch":
+      async for msg in self._batch_events(name, items, counter):
+        yield msg
+      return
+
+    if delivery == "stream":
+      # 不等待时提示消息与识别结果合并为一次发送
+      for label, data in items:
+        yield sse_event(
+          "message", f"{next(counter)}. {label} <br />"
+        ) + sse_event(name, data)
+      return
+
+    for label, data in items:
+      await sleep(settings.SERVER_SEND_EVENTS_INTERVAL)
+      yield sse_event("message", f"{next(counter)}. {label} <br />")
+      await sleep(settings.SERVER_SEND_EVENTS_INTERVAL)
+      yield sse_event(name, data)
+
+  async def _batch_events(
+    self, name: str, items: List[tuple], counter: Iterator[int]
+  ):
+    """
+    批量推送: 将多个识别结果合并为一个`batch`事件。
+    达到`SERVER_SEND_EVENTS_BATCH_SIZE`条或距离缓冲区中第一条结果
+    超过`SERVER_SEND_EVENTS_BATCH_LATENCY`秒时发送一次。
+    """
+    batch_size = max(1, settings.SERVER_SEND_EVENTS_BATCH_SIZE)
+    max_latency = settings.SERVER_SEND_EVENTS_BATCH_LATENCY
+    buffer: List[bytes] = []
+    first_at = 0.0
+    # `{"type": name, "items": [...]}`, 各条结果已编码, 直接拼接
+    head = b'{"type":' + dumps(name) + b',"items":['
+
+    def flush() -> bytes:
+      indexes = [next(counter) for _ in buffer]
+      first, last = indexes[0], indexes[-1]
+      label = BATCH_LABELS.get(name, name)
+      batch = head + b",".join(buffer) + b"]}"
+      return sse_event(
+        "message", f"{first}~{last}. {label} x {len(buffer)} <br />"
+      ) + sse_event("batch", batch)
+
+    for _, data in items:
+      if not buffer:
+        first_at = monotonic()
+      buffer.append(data)
+      if len(buffer) >= batch_size or monotonic() - first_at >= max_latency:
+        yield flush()
+        buffer = []
+        # 让出事件循环, 使已生成的批次尽快发送
+        await sleep(0)
+    if buffer:
+      yield flush()
+
+  def stage_items(self, name: str, results) -> List[tuple]:
+    """
+    将某个识别阶段的结果转换为事件数据。
+    Args:
+      name (str): 阶段名称("symbol"、"line"、"text")。
+      results: 该阶段的识别结果。
+    Returns:
+      List[tuple[str, dict]]: 消息文本与事件数据。
+    """
+    if name == "text":
+      return self._paddleocr_items(results)
+    if isinstance(results, LineNetwork):
+      return self._network_items(results)
+    if isinstance(results, TaggedDetections):
+      return self._yolo_items(results.detections, tags=results.tags)
+    return self._yolo_items(results)
+
+  def encoded_items(self, name: str, results) -> List[tuple]:
+    """
+    同`stage_items`, 但事件数据已编码为JSON, 用于生成SSE事件。
+    符号的`payload`使用`SymbolMapper`预先编码的结果, 不再逐条序列化。
+    Returns:
+      List[tuple[str, bytes]]: 消息文本与编码后的事件数据。
+    """
+    if name == "text":
+      return self._paddleocr_items(results, encode=True)
+    if isinstance(results, LineNetwork):
+      return self._network_items(results, encode=True)
+    if isinstance(results, TaggedDetections):
+      return self._yolo_items(
+        results.detections, encode=True, tags=results.tags
+      )
+    return self._yolo_items(results, encode=True)
+
+  def _yolo_items(
+    self,
+    detections: Detections,
+    encode: bool = False,
+    tags: Optional[List[List[dict]]] = None,
+  ) -> List[tuple]:
+    """
+    将YOLO识别结果转换为事件数据。
+    置信度阈值与类别映射按列批量过滤, 坐标与尺寸批量计算后一次转换
+    为Python数值, 再一次性生成各项事件数据。
+    Args:
+      detections (Detections): YOLO识别结果。
+      encode (bool): 是否将事件数据编码为JSON。
+      tags (Optional[List[List[dict]]]): 每个图符绑定的文字, 写入
+        `tags`字段; 不为None时`detections`须已经过滤。
+    Returns:
+      List[tuple[str, dict]]: 消息文本与事件数据, 未配置映射的类别与
+        置信度低于`YOLO_MIN_CONFIDENCE`的结果会被跳过。
+    """
+    if tags is None:
+      lookup, detections = self._mapped(detections)
+    else:
+      lookup = self.symbol_mapper.lookup(detections.names)
+    created_at = datetime.now().isoformat()
+    if encode:
+      payloads, build = lookup.encoded, with_payload
+    else:
+      payloads, build = lookup.payloads, _with_payload
+    classes = detections.cls.tolist()
+    rests = [
+      {
+        "origin": {
+          "name": lookup.names[c],
+          "confidence": conf,
+          "x1": x1,
+          "y1": y1,
+          "x2": x2,
+          "y2": y2,
+        },
+        "attrs": {"x": x, "y": y, "width": w, "height": h},
+        "createdAt": created_at,
+      }
+      for (x1, y1, x2, y2), conf, c, (x, y, w, h) in zip(
+        detections.xyxy.tolist(),
+        detections.conf.tolist(),
+        classes,
+        box_areas(detections.xyxy).tolist(),
+      )
+    ]
+    if tags is not None:
+      for rest, tag in zip(rests, tags):
+        rest["tags"] = tag
+    return [
+      (lookup.names[c], build(payloads[c], rest))
+      for c, rest in zip(classes, rests)
+    ]
+
+  def _mapped(self, detections: Detections) -> tuple:
+    """
+    按类别映射与置信度阈值过滤YOLO识别结果。
+    Returns:
+      tuple[ClassLookup, Detections]: 类别映射结果与过滤后的识别结果。
+    """
+    lookup = self.symbol_mapper.lookup(detections.names)
+    cls = detections.cls
+    keep = (cls >= 0) & (cls < len(lookup.mapped))
+    keep[keep] = lookup.mapped[cls[keep]]
+    if settings.YOLO_MIN_CONFIDENCE > 0:
+      keep &= detections.conf >= settings.YOLO_MIN_CONFIDENCE
+    return lookup, detections.select(keep)
+
+  def _network_items(
+    self, network: LineNetwork, encode: bool = False
+  ) -> List[tuple]:
+    """
+    将矢量化的线条转换为事件数据, 每条管线一项。
+    `origin`与`attrs`为管线的外接框, `polylines`为折线坐标,
+    `segments`为合并的原始线条数量。
+    """
+    lookup = self.symbol_mapper.lookup(network.names)
+    created_at = datetime.now().isoformat()
+    if encode:
+      payloads, build = lookup.encoded, with_payload
+    else:
+      payloads, build = lookup.payloads, _with_payload
+    return [
+      (
+        f"{lookup.names[c]}({segments}段)",
+        build(
+          payloads[c],
+          {
+            "origin": {
+              "name": lookup.names[c],
+              "confidence": conf,
+              "x1": x1,
+              "y1": y1,
+              "x2": x2,
+              "y2": y2,
+            },
+            "attrs": {"x": x, "y": y, "width": w, "height": h},
+            "polylines": polylines,
+            "segments": segments,
+            "createdAt": created_at,
+          },
+        ),
+      )
+      for polylines, (x1, y1, x2, y2), conf, c, segments, (x, y, w, h) in zip(
+        network.polylines,
+        network.bounds.tolist(),
+        network.conf.tolist(),
+        network.cls.tolist(),
+        network.counts.tolist(),
+        box_areas(network.bounds).tolist(),
+      )
+    ]
+
+  def _paddleocr_items(
+    self, results: list, encode: bool = False
+  ) -> List[tuple]:
+    """将PaddleOCR识别结果转换为事件数据。
+    Args:
+      results (list): PaddleOCR识别结果列表。
+      encode (bool): 是否将事件数据编码为JSON。
+    Returns:
+      List[tuple[str, dict]]: 消息文本与事件数据, 空文本与置信度低于
+        `OCR_MIN_CONFIDENCE`的结果会被跳过。
+    """
+    texts = _visible_texts(results)
+    xyxy = texts.xyxy
+    created_at = datetime.now().isoformat()
+    items = [
+      (
+        f"文字: {text}",
+        {
+          "payload": {"text": text},
+          "origin": {
             "name": text,  # 识别出的文本内容
-            "confidence": confidence,  # 置信度分数
+            "confidence": conf,  # 置信度分数
             "x1": x1,  # 文本框左上角x坐标
             "y1": y1,  # 文本框左上角y坐标
             "x2": x2,  # 文本框右下角x坐标
             "y2": y2,  # 文本框右下角y坐标
-          }
-          attrs = calculate_area(x1, y1, x2, y2)
-          index += 1
-          yield f"event: message\ndata: {index}. 文字: {text} <br />\n\n"
-          await sleep(settings.SERVER_SEND_EVENTS_INTERVAL)
-          yield (
-            f"event: {result_type}\ndata: "
-            + json.dumps(
-              {
-                "payload": payload,
-                "origin": origin,
-                "attrs": attrs,
-                "createdAt": f"{datetime.now().isoformat()}",
-              },
-              ensure_ascii=False,
-            )
-            + "\n\n"
-          )
+          },
+          "attrs": {"x": x, "y": y, "width": w, "height": h},
+          "createdAt": created_at,
+        },
+      )
+      for text, conf, (x1, y1, x2, y2), (x, y, w, h) in zip(
+        texts.texts,
+        texts.conf.tolist(),
+        xyxy.tolist(),
+        box_areas(xyxy).tolist(),
+      )
+    ]
+    if encode:
+      return [(label, dumps(data)) for label, data in items]
+    return items
 
-    async for msg in process_yolo_results(
-      symbol_results, "symbol", self.symbol_mapper
-    ):
-      yield msg
 
-    async for msg in process_yolo_results(
-      line_results, "line", self.symbol_mapper
-    ):
-      yield msg
+def _visible_texts(results: list) -> TextDetections:
+  """
+  PaddleOCR识别结果中会被推送的文字: 去掉首尾空白, 跳过空文本与置信度
+  低于`OCR_MIN_CONFIDENCE`的结果。
+  """
+  texts = TextDetections.from_ocr(results)
+  stripped = [text.strip() for text in texts.texts]
+  keep = np.fromiter(map(bool, stripped), dtype=bool, count=len(stripped))
+  if settings.OCR_MIN_CONFIDENCE > 0:
+    keep &= texts.conf >= settings.OCR_MIN_CONFIDENCE
+  indexes = np.flatnonzero(keep)
+  return TextDetections(
+    texts.boxes[indexes],
+    texts.conf[indexes],
+    [stripped[i] for i in indexes.tolist()],
+  )
 
-    async for msg in process_paddleocr_results(text_results, "text"):
-      yield msg
 
-    yield "event: done\ndata: 图片分析完成\n\n"
+def _with_payload(payload: Any, rest: dict) -> dict:
+  """`encoding.with_payload`的未编码版本"""
+  return {"payload": payload, **rest}
+
+
+def resolve_delivery_mode(delivery: Optional[str]) -> str:
+  """
+  解析推送方式, 未指定时使用`SERVER_SEND_EVENTS_MODE`配置。
+  Raises:
+    ValueError: 推送方式无效。
+  """
+  delivery = (delivery or settings.SERVER_SEND_EVENTS_MODE).lower()
+  if delivery not in DELIVERY_MODES:
+    raise ValueError(
+      f"无效的推送方式: {delivery}, 可选值: {', '.join(DELIVERY_MODES)}"
+    )
+  return delivery
 
 
 def calculate_area(
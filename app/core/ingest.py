@@ -0,0 +1,201 @@
+"""
+图片接收与解码: /image2hmi 与 /ocr 共用的上传读取与解码流程.
+"""
+
+import asyncio
+import io
+import os
+import threading
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .settings import settings
+
+CHUNK_SIZE = 1024 * 1024
+HEADER_SIZE = 64 * 1024
+"""读取图片尺寸时先尝试的文件头长度, 避免复制整个文件"""
+
+# 缩小解码: OpenCV解码时直接缩小为1/2、1/4、1/8, JPEG无需先解码全尺寸
+REDUCED_FLAGS = {
+  2: cv2.IMREAD_REDUCED_COLOR_2,
+  4: cv2.IMREAD_REDUCED_COLOR_4,
+  8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class DecodedImage:
+  """解码后的图片。
+
+  `img`为BGR格式, YOLO与PaddleOCR共用同一个数组, 不再各自复制。
+  启用缩小解码时`scale`为原图与`img`的尺寸比例, 识别结果的坐标需要
+  乘以`scale`才能还原到原图。
+  """
+
+  __slots__ = ("img", "scale", "width", "height")
+
+  def __init__(self, img: np.ndarray, scale: int, width: int, height: int):
+    self.img = img
+    self.scale = scale
+    self.width = width
+    """原图宽度"""
+    self.height = height
+    """原图高度"""
+
+
+class UploadBufferPool:
+  """上传内容缓冲区池。
+
+  缓冲区按上传文件的大小分配(向上取整到2的幂, 不超过`max_size`),
+  用完归还, 之后不大于该缓冲区的上传可以复用它, 避免每个请求都为上传
+  内容分配新的内存。空闲缓冲区的总大小不超过`max_bytes`, 超出时归还
+  的缓冲区直接释放。所有方法线程安全。
+  """
+
+  def __init__(self, max_size: int, max_bytes: int):
+    self.max_size = max_size
+    self.max_bytes = max_bytes
+    self._idle: List[bytearray] = []
+    self._idle_bytes = 0
+    self._lock = threading.Lock()
+
+  def acquire(self, size: int) -> bytearray:
+    """取得不小于`size`字节的缓冲区, 优先复用最小的空闲缓冲区"""
+    with self._lock:
+      fits = [buffer for buffer in self._idle if len(buffer) >= size]
+      if fits:
+        buffer = min(fits, key=len)
+        self._idle.remove(buffer)
+        self._idle_bytes -= len(buffer)
+        return buffer
+    capacity = max(HEADER_SIZE, 1 << max(size - 1, 0).bit_length())
+    return bytearray(max(size, min(capacity, self.max_size)))
+
+  def release(self, buffer: bytearray) -> None:
+    with self._lock:
+      if self._idle_bytes + len(buffer) <= self.max_bytes:
+        self._idle.append(buffer)
+        self._idle_bytes += len(buffer)
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {"idle": len(self._idle), "idle_bytes": self._idle_bytes}
+
+
+upload_buffers = UploadBufferPool(
+  settings.IMAGE_MAX_BYTES, settings.UPLOAD_BUFFER_POOL_BYTES
+)
+"""全局上传缓冲区池"""
+
+
+def _file_size(file) -> int:
+  """上传文件(已缓存在内存或临时文件中)的大小"""
+  file.seek(0, os.SEEK_END)
+  size = file.tell()
+  file.seek(0)
+  return size
+
+
+def _read_into(file, buffer: bytearray, size: int) -> int:
+  """将上传文件的前`size`字节分块读入缓冲区, 返回读取的字节数"""
+  view = memoryview(buffer)
+  read = 0
+  while read < size:
+    n = file.readinto(view[read : min(read + CHUNK_SIZE, size)])
+    if not n:
+      break
+    read += n
+  return read
+
+
+@asynccontextmanager
+async def read_upload(upload):
+  """
+  将上传文件读入可复用的缓冲区。
+  Args:
+    upload (UploadFile): FastAPI上传文件。
+  Yields:
+    memoryview: 上传内容(缓冲区的视图, 不复制), 仅在上下文内有效。
+      上下文正常退出时缓冲区归还给`upload_buffers`, 因异常(含取消)
+      退出时丢弃。
+  Raises:
+    ValueError: 文件超过`IMAGE_MAX_BYTES`。
+  """
+  # 请求体已由框架接收完毕, 按实际大小分配缓冲区, 超限时不再读取
+  size = await asyncio.to_thread(_file_size, upload.file)
+  if size > settings.IMAGE_MAX_BYTES:
+    raise ValueError(
+      f"图片文件过大, 最大允许 {settings.IMAGE_MAX_BYTES // 1024 // 1024} MB"
+    )
+  buffer = upload_buffers.acquire(size)
+  try:
+    size = await asyncio.to_thread(_read_into, upload.file, buffer, size)
+    view = memoryview(buffer)
+    content = view[:size]
+    yield content
+  except BaseException:
+    # 请求被取消或出错时, 已开始的线程(读取、计算哈希、解码)不会停止,
+    # 可能仍在使用缓冲区: 不归还、不释放视图, 线程结束后由垃圾回收释放
+    raise
+  try:
+    content.release()
+    view.release()
+  except BufferError:
+    # 视图仍被导出(如某些NumPy版本下`np.frombuffer`的数组), 缓冲区
+    # 不能复用
+    return
+  upload_buffers.release(buffer)
+
+
+def probe_size(content) -> tuple:
+  """
+  只读取图片文件头获取尺寸, 不解码像素。
+  Raises:
+    ValueError: 无法识别的图片。
+  """
+  # 文件头(如很大的EXIF)超出HEADER_SIZE时再使用完整内容
+  for data in (content[:HEADER_SIZE], content):
+    try:
+      with Image.open(io.BytesIO(data)) as image:
+        return image.size
+    except Exception as e:
+      error = e
+  raise ValueError(f"无法识别的图片: {error}")
+
+
+def decode_image(content, max_side: Optional[int] = None) -> DecodedImage:
+  """
+  解码图片为BGR数组: 先读取文件头校验尺寸, 再决定是否缩小解码。
+  Args:
+    content (bytes | memoryview): 图片文件内容。
+    max_side (Optional[int]): 解码后最长边上限, 超出时按1/2、1/4、1/8
+      缩小解码, 默认取`IMAGE_DECODE_MAX_SIDE`配置, 0表示不缩小。
+  Returns:
+    DecodedImage: 解码后的图片。
+  Raises:
+    ValueError: 图片像素数超过`IMAGE_MAX_PIXELS`或无法解码。
+  """
+  width, height = probe_size(content)
+  if width * height > settings.IMAGE_MAX_PIXELS:
+    raise ValueError(
+      f"图片尺寸过大: {width}x{height}, "
+      f"最多允许 {settings.IMAGE_MAX_PIXELS} 像素"
+    )
+  if max_side is None:
+    max_side = settings.IMAGE_DECODE_MAX_SIDE
+  scale = 1
+  if max_side:
+    for factor in REDUCED_FLAGS:
+      if max(width, height) / scale <= max_side:
+        break
+      scale = factor
+  # np.frombuffer直接引用上传缓冲区, 不复制
+  data = np.frombuffer(content, np.uint8)
+  flags = REDUCED_FLAGS.get(scale, cv2.IMREAD_COLOR)
+  img = cv2.imdecode(data, flags)
+  if img is None:
+    raise ValueError("无法解码图片")
+  return DecodedImage(img, scale, width, height)
@@ -0,0 +1,409 @@
+"""
+识别任务队列: `/image2hmi?job=true`时识别在后台执行, SSE事件按顺序写入
+SQLite事件日志, 客户端断线后凭`Last-Event-ID`从断点继续接收, 不必重新
+上传与识别.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from time import time
+from typing import AsyncIterator, Callable, List, Optional
+
+from .admission import Overloaded
+from .encoding import sse_event
+from .settings import settings
+
+FINISHED = ("done", "error")
+"""任务结束的状态, 结束后事件日志不再增加"""
+
+INSTANCE_ID = uuid.uuid4().hex
+"""本进程的实例标识。容器重启后进程号会被复用(如1号进程), 不能用进程号
+判断任务是否属于本进程"""
+
+
+def split_events(chunk: bytes) -> List[bytes]:
+  """将生成器产出的字节拆分为单个SSE事件(不含结尾的空行)"""
+  return [event for event in chunk.split(b"\n\n") if event]
+
+
+class EventLog:
+  """SQLite事件日志: 任务状态与每个任务按序号排列的SSE事件。
+
+  同一数据库文件可以被多个worker进程共用, 任意worker都能读取其它
+  worker中任务的事件。每个任务记录执行它的进程的实例标识与心跳时间,
+  心跳过期的未完成任务视为中断。数据库在第一次使用时打开。所有方法
+  线程安全, 会阻塞, 需要在线程中调用。
+  """
+
+  def __init__(self, path: Path):
+    self.path = Path(path)
+    self._conn: Optional[sqlite3.Connection] = None
+    self._lock = threading.Lock()
+
+  @property
+  def _db(self) -> sqlite3.Connection:
+    """数据库连接, 调用方需持有锁"""
+    if self._conn is None:
+      self.path.parent.mkdir(parents=True, exist_ok=True)
+      conn = sqlite3.connect(
+        self.path, timeout=30, check_same_thread=False, isolation_level=None
+      )
+      # WAL: 写入事件时不阻塞其它进程读取; NORMAL: 提交时不等待落盘
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("PRAGMA synchronous=NORMAL")
+      conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+          id TEXT PRIMARY KEY,
+          status TEXT NOT NULL,
+          filename TEXT,
+          owner INTEGER NOT NULL,
+          created_at REAL NOT NULL,
+          finished_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS events (
+          job_id TEXT NOT NULL,
+          seq INTEGER NOT NULL,
+          event BLOB NOT NULL,
+          PRIMARY KEY (job_id, seq)
+        );
+        """
+      )
+      columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+      # 早期版本的数据库没有实例标识与心跳
+      for column in ("instance TEXT", "heartbeat REAL"):
+        if column.split()[0] not in columns:
+          conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+      self._conn = conn
+    return self._conn
+
+  def create(self, job_id: str, filename: Optional[str]) -> None:
+    now = time()
+    with self._lock:
+      self._db.execute(
+        "INSERT INTO jobs (id, status, filename, owner, instance, heartbeat,"
+        " created_at) VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+        (job_id, filename, os.getpid(), INSTANCE_ID, now, now),
+      )
+
+  def heartbeat(self) -> None:
+    """更新本进程所有未完成任务的心跳时间"""
+    with self._lock:
+      self._db.execute(
+        "UPDATE jobs SET heartbeat = ?"
+        " WHERE instance = ? AND status NOT IN (?, ?)",
+        (time(), INSTANCE_ID, *FINISHED),
+      )
+
+  def stale(self, timeout: float) -> List[str]:
+    """
+    其它进程中心跳超过`timeout`秒没有更新的未完成任务(含早期版本记录的
+    没有心跳的任务)。
+    """
+    with self._lock:
+      return [
+        row[0]
+        for row in self._db.execute(
+          "SELECT id FROM jobs WHERE status NOT IN (?, ?)"
+          " AND (instance IS NULL OR instance != ?)"
+          " AND COALESCE(heartbeat, 0) < ?",
+          (*FINISHED, INSTANCE_ID, time() - timeout),
+        )
+      ]
+
+  def start(self, job_id: str) -> None:
+    with self._lock:
+      self._db.execute(
+        "UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,)
+      )
+
+  def append(self, job_id: str, events: List[bytes]) -> None:
+    """按顺序追加事件, 同一任务只能由一个写入者追加"""
+    with self._lock, self._db as db:
+      db.execute("BEGIN")
+      self._insert(db, job_id, events)
+
+  def finish(self, job_id: str, status: str, events: List[bytes] = ()) -> bool:
+    """
+    结束任务并追加最后的事件, 任务已结束时不做任何修改。
+    Returns:
+      bool: 是否由本次调用结束。
+    """
+    with self._lock, self._db as db:
+      db.execute("BEGIN")
+      updated = db.execute(
+        "UPDATE jobs SET status = ?, finished_at = ?"
+        " WHERE id = ? AND status NOT IN (?, ?)",
+        (status, time(), job_id, *FINISHED),
+      ).rowcount
+      if updated:
+        self._insert(db, job_id, events)
+    return bool(updated)
+
+  @staticmethod
+  def _insert(db: sqlite3.Connection, job_id: str, events: List[bytes]):
+    last = db.execute(
+      "SELECT COALESCE(MAX(seq), 0) FROM events WHERE job_id = ?", (job_id,)
+    ).fetchone()[0]
+    db.executemany(
+      "INSERT INTO events (job_id, seq, event) VALUES (?, ?, ?)",
+      [(job_id, last + i, event) for i, event in enumerate(events, 1)],
+    )
+
+  def read(self, job_id: str, after: int, limit: int) -> List[tuple]:
+    """
+    读取序号大于`after`的事件。
+    Returns:
+      List[tuple]: (序号, 事件)列表, 最多`limit`项。
+    """
+    with self._lock:
+      return self._db.execute(
+        "SELECT seq, event FROM events WHERE job_id = ? AND seq > ?"
+        " ORDER BY seq LIMIT ?",
+        (job_id, after, limit),
+      ).fetchall()
+
+  def get(self, job_id: str) -> Optional[dict]:
+    """
+    任务状态与已记录的事件数量, `instance`与`heartbeat`为内部字段,
+    不返回给客户端。
+    """
+    with self._lock:
+      row = self._db.execute(
+        "SELECT j.id, j.status, j.filename, j.created_at, j.finished_at,"
+        " j.instance, j.heartbeat, COUNT(e.seq) FROM jobs j"
+        " LEFT JOIN events e ON e.job_id = j.id WHERE j.id = ?"
+        " GROUP BY j.id",
+        (job_id,),
+      ).fetchone()
+    if row is None:
+      return None
+    keys = (
+      "id",
+      "status",
+      "filename",
+      "createdAt",
+      "finishedAt",
+      "instance",
+      "heartbeat",
+    )
+    return {**dict(zip(keys, row)), "events": row[-1]}
+
+  def prune(self, retention: float) -> int:
+    """删除结束超过`retention`秒的任务及其事件, 返回删除的任务数"""
+    with self._lock, self._db as db:
+      db.execute("BEGIN")
+      expired = [
+        row[0]
+        for row in db.execute(
+          "SELECT id FROM jobs WHERE finished_at < ?", (time() - retention,)
+        )
+      ]
+      db.executemany(
+        "DELETE FROM events WHERE job_id = ?", [(i,) for i in expired]
+      )
+      db.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in expired])
+    return len(expired)
+
+
+class JobQueue:
+  """识别任务队列。
+
+  任务进入内存队列, 由`workers`个后台工作协程依次执行: 迭代任务的事件
+  生成器, 把事件写入事件日志。工作协程数量限制同时识别的任务数, 与
+  HTTP连接无关; 推理仍受准入控制的名额限制。排队中的任务(含上传内容)
+  只保存在当前进程中; 进程在执行任务期间定时更新心跳, 进程退出后心跳
+  过期, 未完成的任务在启动或读取时标记为失败。
+  """
+
+  def __init__(self, log: EventLog, workers: int, max_pending: int):
+    self.log = log
+    self.workers = max(1, workers)
+    self.max_pending = max(1, max_pending)
+    self._queue: Optional[asyncio.Queue] = None
+    self._tasks: List[asyncio.Task] = []
+    self._signals: dict[str, set[asyncio.Event]] = {}
+    """各任务的订阅者(`events`)等待新事件的信号"""
+    self._active = 0
+    """本进程中排队或执行中的任务数"""
+    self.submitted = 0
+    self.failed = 0
+
+  @property
+  def pending(self) -> int:
+    return 0 if self._queue is None else self._queue.qsize()
+
+  async def submit(
+    self, filename: Optional[str], events: Callable[[], AsyncIterator[bytes]]
+  ) -> str:
+    """
+    创建任务并排队。
+    Args:
+      filename (Optional[str]): 上传的文件名, 用于查询任务状态。
+      events (Callable): 返回该任务SSE事件生成器的函数, 在工作协程中调用。
+    Returns:
+      str: 任务ID。
+    Raises:
+      Overloaded: 排队的任务数已达`max_pending`(429)。
+    """
+    if self._queue is None:
+      self._queue = asyncio.Queue()
+      self._tasks = [
+        asyncio.create_task(self._work()) for _ in range(self.workers)
+      ]
+      self._tasks.append(asyncio.create_task(self._heartbeat()))
+      await asyncio.to_thread(self.log.prune, settings.JOB_RETENTION)
+      # 启动时结束已退出的进程(如重启前)留下的未完成任务
+      for job_id in await asyncio.to_thread(
+        self.log.stale, settings.JOB_HEARTBEAT_TIMEOUT
+      ):
+        await self._interrupt(job_id)
+    if self._queue.qsize() >= self.max_pending:
+      raise Overloaded("任务队列已满, 请稍后重试", 429, 1)
+    job_id = uuid.uuid4().hex
+    await asyncio.to_thread(self.log.create, job_id, filename)
+    self._queue.put_nowait((job_id, events))
+    self._active += 1
+    self.submitted += 1
+    return job_id
+
+  async def _heartbeat(self) -> None:
+    """有排队或执行中的任务时定时更新心跳"""
+    while True:
+      await asyncio.sleep(settings.JOB_HEARTBEAT_TIMEOUT / 4)
+      if self._active:
+        try:
+          await asyncio.to_thread(self.log.heartbeat)
+        except sqlite3.Error as e:
+          print(f"更新识别任务心跳失败: {e}")
+
+  async def _interrupt(self, job_id: str) -> None:
+    """结束执行进程已退出的任务"""
+    await asyncio.to_thread(
+      self.log.finish,
+      job_id,
+      "error",
+      split_events(sse_event("error", "任务中断, 请重新提交")),
+    )
+    self._notify(job_id)
+
+  async def _work(self) -> None:
+    while True:
+      job_id, events = await self._queue.get()
+      try:
+        await asyncio.to_thread(self.log.start, job_id)
+        await self._record(job_id, events())
+        await asyncio.to_thread(self.log.finish, job_id, "done")
+      except Exception as e:
+        self.failed += 1
+        await asyncio.to_thread(
+          self.log.finish,
+          job_id,
+          "error",
+          split_events(sse_event("error", str(e))),
+        )
+      self._active -= 1
+      self._notify(job_id)
+      if self._queue.empty():
+        await asyncio.to_thread(self.log.prune, settings.JOB_RETENTION)
+
+  async def _record(self, job_id: str, events: AsyncIterator[bytes]) -> None:
+    """
+    迭代事件生成器并写入事件日志。写入在线程中进行, 期间产出的事件
+    积累起来下一次一并写入, 事件越密集每次写入的事件越多。
+    """
+    buffer: List[bytes] = []
+    produced = asyncio.Event()
+
+    async def produce():
+      try:
+        async for chunk in events:
+          buffer.extend(split_events(chunk))
+          produced.set()
+      finally:
+        produced.set()
+
+    producer = asyncio.create_task(produce())
+    try:
+      while True:
+        await produced.wait()
+        produced.clear()
+        if buffer:
+          batch = buffer[:]
+          del buffer[:]
+          await asyncio.to_thread(self.log.append, job_id, batch)
+          self._notify(job_id)
+        if producer.done() and not buffer:
+          break
+    finally:
+      producer.cancel()
+    producer.result()
+
+  def _notify(self, job_id: str) -> None:
+    for signal in self._signals.get(job_id, ()):
+      signal.set()
+
+  async def events(self, job_id: str, after: int = 0):
+    """
+    推送任务中序号大于`after`的事件, 每个事件带`id`字段(序号), 任务结束
+    后返回。其它worker进程中的任务每`JOB_POLL_INTERVAL`秒查询一次。
+    Yields:
+      bytes: UTF-8编码的事件。
+    """
+    signal = asyncio.Event()
+    self._signals.setdefault(job_id, set()).add(signal)
+    try:
+      while True:
+        signal.clear()
+        # 先取状态再读事件: 状态已结束时事件日志中已有全部事件
+        job = await asyncio.to_thread(self.log.get, job_id)
+        if job is None:
+          # 任务已被`prune`清理, 事件随之删除
+          return
+        rows = await asyncio.to_thread(self.log.read, job_id, after, 1000)
+        for seq, event in rows:
+          yield event + b"\nid: " + str(seq).encode() + b"\n\n"
+          after = seq
+        if rows:
+          continue
+        if job["status"] in FINISHED:
+          return
+        if (
+          job["instance"] != INSTANCE_ID
+          and time() - (job["heartbeat"] or 0) > settings.JOB_HEARTBEAT_TIMEOUT
+        ):
+          # 执行任务的进程已退出(如服务重启), 任务不会再有新的事件
+          await self._interrupt(job_id)
+          continue
+        try:
+          await asyncio.wait_for(signal.wait(), settings.JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+          pass
+    finally:
+      # 最后一个订阅者离开时删除该任务的信号
+      signals = self._signals.get(job_id)
+      if signals is not None:
+        signals.discard(signal)
+        if not signals:
+          del self._signals[job_id]
+
+  def stats(self) -> dict:
+    return {
+      "workers": self.workers,
+      "pending": self.pending,
+      "max_pending": self.max_pending,
+      "active": self._active,
+      "subscribed": len(self._signals),
+      "submitted": self.submitted,
+      "failed": self.failed,
+    }
+
+
+job_queue = JobQueue(
+  EventLog(settings.JOB_DB_PATH), settings.JOB_WORKERS, settings.JOB_MAX_PENDING
+)
+"""全局识别任务队列"""
@@ -0,0 +1,221 @@
+"""
+批量任务: 一次提交多张图纸, 后台并发识别, 可轮询进度或以SSE方式接收结果.
+"""
+
+import asyncio
+import shutil
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, List, Optional
+
+from .encoding import dumps, sse_event
+from .settings import settings
+
+
+class BatchFile:
+  """批量任务中的一个文件"""
+
+  __slots__ = ("index", "filename", "path", "status", "error", "result")
+
+  def __init__(self, index: int, filename: str, path: Path):
+    self.index = index
+    self.filename = filename
+    self.path: Optional[Path] = path
+    """暂存文件内容的临时文件, 处理完成后删除"""
+    self.status = "pending"
+    self.error: Optional[str] = None
+    self.result: Optional[Any] = None
+
+  def read(self) -> bytes:
+    """读取文件内容(阻塞, 需要在线程中调用)"""
+    return self.path.read_bytes()
+
+  def discard(self) -> None:
+    """删除暂存的文件内容"""
+    if self.path is not None:
+      self.path.unlink(missing_ok=True)
+      self.path = None
+
+  def summary(self) -> dict:
+    return {
+      "index": self.index,
+      "filename": self.filename,
+      "status": self.status,
+      "error": self.error,
+    }
+
+  def to_dict(self) -> dict:
+    return {**self.summary(), "result": self.result}
+
+
+class BatchJob:
+  """批量任务: 记录各文件的状态与结果, 以及文件完成的先后顺序"""
+
+  def __init__(
+    self, files: List[BatchFile], options: dict, spool: Optional[Path] = None
+  ):
+    self.id = uuid.uuid4().hex
+    self.files = files
+    self.options = options
+    self.spool = spool
+    """暂存文件内容的临时目录, 任务结束后删除"""
+    self.status = "pending"
+    self.created_at = datetime.now().isoformat()
+    self.finished_at: Optional[str] = None
+    self.completed: List[int] = []
+    """已完成(成功或失败)的文件序号, 按完成先后排列"""
+    self._changed = asyncio.Condition()
+
+  @property
+  def finished(self) -> bool:
+    return self.status == "done"
+
+  def summary(self) -> dict:
+    """任务进度与各文件状态(不含识别结果)"""
+    failed = sum(1 for f in self.files if f.status == "error")
+    return {
+      "id": self.id,
+      "status": self.status,
+      "total": len(self.files),
+      "completed": len(self.completed),
+      "failed": failed,
+      "createdAt": self.created_at,
+      "finishedAt": self.finished_at,
+      "options": self.options,
+      "files": [f.summary() for f in self.files],
+    }
+
+  async def mark(self, file: BatchFile) -> None:
+    """记录文件完成并通知等待中的`watch`"""
+    async with self._changed:
+      self.completed.append(file.index)
+      self._changed.notify_all()
+
+  async def finish(self) -> None:
+    async with self._changed:
+      self.status = "done"
+      self.finished_at = datetime.now().isoformat()
+      self._changed.notify_all()
+
+  async def watch(self):
+    """
+    按完成顺序逐个产出已完成的文件, 先补发已完成的, 再等待后续文件,
+    任务结束后返回。多个客户端可以同时或先后订阅同一个任务。
+    Yields:
+      BatchFile: 已完成的文件。
+    """
+    sent = 0
+    while True:
+      async with self._changed:
+        await self._changed.wait_for(
+          lambda: sent < len(self.completed) or self.finished
+        )
+        ready = self.completed[sent:]
+        finished = self.finished
+      for index in ready:
+        yield self.files[index]
+      sent += len(ready)
+      if finished and sent == len(self.completed):
+        return
+
+
+class BatchJobManager:
+  """批量任务管理。
+
+  每个任务中同时处理的文件最多`concurrency`个: 多个文件的推理请求
+  同时进入YOLO批处理器与OCR线程池, 解码、推理与结果转换按流水线方式
+  重叠执行。任务保存在进程内存中, 最多保留`max_jobs`个, 超出时删除
+  最早结束的任务。
+  """
+
+  def __init__(self, concurrency: int, max_jobs: int):
+    self.concurrency = max(1, concurrency)
+    self.max_jobs = max(1, max_jobs)
+    self._jobs: OrderedDict[str, BatchJob] = OrderedDict()
+    self._tasks: dict[str, asyncio.Task] = {}
+
+  def submit(
+    self,
+    files: List[BatchFile],
+    options: dict,
+    process: Callable[[BatchFile], Awaitable[Any]],
+    spool: Optional[Path] = None,
+  ) -> BatchJob:
+    """
+    创建任务并在后台开始处理。
+    Args:
+      files (List[BatchFile]): 待处理的文件。
+      options (dict): 任务参数, 原样返回给客户端。
+      process (Callable): 处理单个文件的协程函数, 返回值作为该文件的结果。
+      spool (Optional[Path]): 暂存文件内容的临时目录, 任务结束后删除。
+    Returns:
+      BatchJob: 新建的任务。
+    """
+    job = BatchJob(files, options, spool)
+    self._jobs[job.id] = job
+    self._prune()
+    task = asyncio.create_task(self._run(job, process))
+    self._tasks[job.id] = task
+    task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+    return job
+
+  def get(self, job_id: str) -> Optional[BatchJob]:
+    return self._jobs.get(job_id)
+
+  async def _run(self, job: BatchJob, process) -> None:
+    job.status = "running"
+    semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def run_file(file: BatchFile):
+      async with semaphore:
+        file.status = "running"
+        try:
+          file.result = await process(file)
+          file.status = "done"
+        except Exception as e:
+          file.status = "error"
+          file.error = str(e)
+        finally:
+          await asyncio.to_thread(file.discard)
+        await job.mark(file)
+
+    try:
+      await asyncio.gather(*(run_file(file) for file in job.files))
+    finally:
+      if job.spool is not None:
+        await asyncio.to_thread(shutil.rmtree, job.spool, True)
+      await job.finish()
+
+  def _prune(self) -> None:
+    """删除最早结束的任务, 未结束的任务不删除"""
+    for job_id in list(self._jobs):
+      if len(self._jobs) <= self.max_jobs:
+        return
+      if self._jobs[job_id].finished:
+        del self._jobs[job_id]
+
+
+batch_jobs = BatchJobManager(
+  settings.BATCH_JOB_CONCURRENCY, settings.BATCH_JOB_MAX_JOBS
+)
+"""全局批量任务管理器"""
+
+
+async def job_events(job: BatchJob):
+  """
+  以SSE方式推送批量任务进度: 每个文件完成时推送`file`与`progress`事件,
+  任务结束时推送`done`事件。
+  Yields:
+    bytes: UTF-8编码的事件。
+  """
+  total = len(job.files)
+  yield sse_event("start", dumps({"id": job.id, "total": total}))
+  completed = 0
+  async for file in job.watch():
+    completed += 1
+    yield sse_event("file", dumps(file.to_dict()))
+    progress = {"id": job.id, "completed": completed, "total": total}
+    yield sse_event("progress", dumps(progress))
+  yield sse_event("done", dumps(job.summary()))
@@ -0,0 +1,316 @@
+"""
+线条矢量化: 将线条模型输出的大量轴对齐小框合并为相连的折线(管线),
+端点吸附到附近的图符, 每条管线只推送一个`line`事件.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .detections import Detections
+from .spatial import GridIndex, box_distance, connected_components
+
+
+class LineNetwork:
+  """矢量化后的线条, 每项为一组相连的线段(一条管线)"""
+
+  __slots__ = ("polylines", "bounds", "conf", "cls", "counts", "names")
+
+  def __init__(
+    self,
+    polylines: List[List[List[Tuple[float, float]]]],
+    bounds: np.ndarray,
+    conf: np.ndarray,
+    cls: np.ndarray,
+    counts: np.ndarray,
+    names: Dict[int, str],
+  ):
+    self.polylines = polylines
+    """每条管线的折线列表, 折线为依次相连的(x, y)点"""
+    self.bounds = bounds
+    """(K, 4) float32, 管线中全部原始线条框的外接框"""
+    self.conf = conf
+    """(K,) float32, 管线中原始线条的最高置信度"""
+    self.cls = cls
+    """(K,) int32, 管线中最长线段的类别ID"""
+    self.counts = counts
+    """(K,) int64, 管线合并了多少个原始线条框"""
+    self.names = names
+    """类别ID到类别名称的映射"""
+
+  def __len__(self) -> int:
+    return len(self.polylines)
+
+
+def _runs(
+  xyxy: np.ndarray, horizontal: np.ndarray, gap: float
+) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  将同一直线上首尾相接或重叠的线条框合并为一段。
+  Returns:
+    Tuple[np.ndarray, np.ndarray]: (每个框所属的段编号, 段数)。
+  """
+  n = len(xyxy)
+  # 沿线方向的起止坐标, 垂直于线方向的中心坐标与线宽
+  a0 = np.where(horizontal, xyxy[:, 0], xyxy[:, 1])
+  a1 = np.where(horizontal, xyxy[:, 2], xyxy[:, 3])
+  c = np.where(horizontal, xyxy[:, 1] + xyxy[:, 3], xyxy[:, 0] + xyxy[:, 2]) / 2
+  t = np.where(horizontal, xyxy[:, 3] - xyxy[:, 1], xyxy[:, 2] - xyxy[:, 0])
+  i, j = _near_pairs(xyxy, gap)
+  keep = (
+    (horizontal[i] == horizontal[j])
+    & (np.abs(c[i] - c[j]) <= np.maximum(t[i], t[j]) / 2 + 1)
+    & (np.maximum(a0[i], a0[j]) - np.minimum(a1[i], a1[j]) <= gap)
+  )
+  labels = connected_components(n, i[keep], j[keep])
+  return labels, int(labels.max()) + 1 if n else 0
+
+
+def _near_pairs(boxes: np.ndarray, gap: float) -> Tuple[np.ndarray, np.ndarray]:
+  """间隙不超过`gap`的框两两组合(i < j)"""
+  if not len(boxes):
+    empty = np.zeros(0, dtype=np.int64)
+    return empty, empty
+  half = np.float32(gap / 2)
+  expanded = boxes + np.array([-half, -half, half, half], dtype=np.float32)
+  size = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+  i, j = GridIndex(expanded, max(gap, float(np.median(size)), 1.0)).pairs()
+  dx, dy = box_distance(boxes[i], boxes[j])
+  keep = (dx <= gap) & (dy <= gap)
+  return i[keep], j[keep]
+
+
+def _snap_to_symbols(
+  a0: np.ndarray,
+  a1: np.ndarray,
+  c: np.ndarray,
+  horizontal: np.ndarray,
+  free: np.ndarray,
+  symbols: np.ndarray,
+  gap: float,
+) -> None:
+  """
+  将没有连接其它线段的端点延长或截短到附近图符的边上(原地修改)。
+  Args:
+    free (np.ndarray): (K, 2)布尔数组, 起点与终点是否为自由端点。
+    symbols (np.ndarray): (M, 4)图符框。
+  """
+  if not len(symbols) or not free.any():
+    return
+  # 以端点为中心的小框查询附近图符
+  points = np.stack(
+    [
+      np.where(horizontal[:, None], np.stack([a0, a1], 1), c[:, None]),
+      np.where(horizontal[:, None], c[:, None], np.stack([a0, a1], 1)),
+    ],
+    axis=-1,
+  ).reshape(-1, 2)
+  boxes = np.concatenate([points - gap, points + gap], axis=1)
+  size = np.median(
+    np.maximum(symbols[:, 2] - symbols[:, 0], symbols[:, 3] - symbols[:, 1])
+  )
+  qi, si = GridIndex(symbols, max(gap, float(size), 1.0)).query(boxes)
+  run, end = qi // 2, qi % 2
+  keep = free[run, end]
+  run, end, si = run[keep], end[keep], si[keep]
+  h = horizontal[run]
+  # 图符在线段方向上的起止坐标, 以及在垂直方向上的范围
+  s0 = np.where(h, symbols[si, 0], symbols[si, 1])
+  s1 = np.where(h, symbols[si, 2], symbols[si, 3])
+  p0 = np.where(h, symbols[si, 1], symbols[si, 0])
+  p1 = np.where(h, symbols[si, 3], symbols[si, 2])
+  cross = (c[run] >= p0) & (c[run] <= p1)
+  # 终点吸附到图符的起边, 起点吸附到图符的止边; 另一端须在图符之外
+  target = np.where(end == 1, s0, s1)
+  position = np.where(end == 1, a1[run], a0[run])
+  outside = np.where(end == 1, a0[run] < s0, a1[run] > s1)
+  reach = np.where(
+    end == 1,
+    (position >= s0 - gap) & (position <= s1),
+    (position <= s1 + gap) & (position >= s0),
+  )
+  keep = cross & outside & reach
+  run, end, target = run[keep], end[keep], target[keep]
+  distance = np.abs(target - np.where(end == 1, a1[run], a0[run]))
+  # 距离从远到近赋值, 同一端点最后赋值的是最近的图符
+  for r, e, value in zip(
+    *(x[np.argsort(-distance, kind="stable")] for x in (run, end, target))
+  ):
+    if e:
+      a1[r] = value
+    else:
+      a0[r] = value
+
+
+def _polylines(
+  edges: List[Tuple[tuple, tuple]],
+) -> List[List[Tuple[float, float]]]:
+  """
+  将一组相连的线段分解为尽量少的折线: 从分叉点或端点出发, 沿度为2的
+  点一直走到下一个分叉点或端点, 剩余的环从任意一点出发。
+  """
+  adjacency: Dict[tuple, List[int]] = {}
+  for index, (a, b) in enumerate(edges):
+    adjacency.setdefault(a, []).append(index)
+    adjacency.setdefault(b, []).append(index)
+  used = [False] * len(edges)
+
+  def walk(start: tuple) -> Optional[List[tuple]]:
+    points = [start]
+    node = start
+    while True:
+      nxt = next((e for e in adjacency[node] if not used[e]), None)
+      if nxt is None:
+        break
+      used[nxt] = True
+      a, b = edges[nxt]
+      node = b if a == node else a
+      points.append(node)
+      if len(adjacency[node]) != 2:
+        break
+    return points if len(points) > 1 else None
+
+  polylines = []
+  starts = [node for node, ids in adjacency.items() if len(ids) != 2]
+  for node in starts + list(adjacency):
+    while any(not used[e] for e in adjacency[node]):
+      points = walk(node)
+      if points:
+        polylines.append(_simplify(points))
+  return polylines
+
+
+def _simplify(points: List[tuple]) -> List[tuple]:
+  """去掉同一直线上的中间点"""
+  result = [points[0]]
+  for point, nxt in zip(points[1:-1], points[2:]):
+    prev = result[-1]
+    if (prev[0] == point[0] == nxt[0]) or (prev[1] == point[1] == nxt[1]):
+      continue
+    result.append(point)
+  result.append(points[-1])
+  return result
+
+
+def vectorize_lines(
+  lines: Detections, symbols: Optional[np.ndarray], gap: float
+) -> LineNetwork:
+  """
+  将线条检测框矢量化为相连的折线。
+
+  1. 宽大于等于高的框视为水平线段, 否则为竖直线段, 取框的中心线;
+  2. 同一直线上间隙不超过`gap`的线段合并为一段;
+  3. 互相垂直且交点距两段都不超过`gap`的线段视为相连, 端点靠近
+     交点时对齐到交点(拐角), 相连的线段组成一条管线;
+  4. 没有连接其它线段的端点延长或截短到`gap`以内的图符边上;
+  5. 每条管线分解为尽量少的折线。
+
+  候选框对由网格索引找出, 分组使用并查集。
+  Args:
+    lines (Detections): 线条识别结果(已按置信度与映射过滤)。
+    symbols (Optional[np.ndarray]): (M, 4)图符框, 用于端点吸附。
+    gap (float): 合并与吸附的最大间隙, 单位为像素。
+  Returns:
+    LineNetwork: 矢量化结果, 按管线中第一个原始框的顺序排列。
+  """
+  xyxy = lines.xyxy.astype(np.float32, copy=False)
+  if not len(xyxy):
+    return LineNetwork(
+      [],
+      np.zeros((0, 4), dtype=np.float32),
+      np.zeros(0, dtype=np.float32),
+      np.zeros(0, dtype=np.int32),
+      np.zeros(0, dtype=np.int64),
+      lines.names,
+    )
+  width = xyxy[:, 2] - xyxy[:, 0]
+  height = xyxy[:, 3] - xyxy[:, 1]
+  horizontal = width >= height
+  labels, k = _runs(xyxy, horizontal, gap)
+
+  # 每段: 方向、起止坐标、长度加权的中心坐标、外接框
+  length = np.maximum(np.where(horizontal, width, height), 1e-3)
+  run_h = np.zeros(k, dtype=bool)
+  run_h[labels] = horizontal
+  a0 = np.full(k, np.inf, dtype=np.float64)
+  a1 = np.full(k, -np.inf, dtype=np.float64)
+  np.minimum.at(a0, labels, np.where(horizontal, xyxy[:, 0], xyxy[:, 1]))
+  np.maximum.at(a1, labels, np.where(horizontal, xyxy[:, 2], xyxy[:, 3]))
+  center = (
+    np.where(horizontal, xyxy[:, 1] + xyxy[:, 3], xyxy[:, 0] + xyxy[:, 2]) / 2
+  )
+  c = np.bincount(labels, center * length, k) / np.bincount(labels, length, k)
+  bounds = np.empty((k, 4), dtype=np.float32)
+  bounds[:, :2] = np.inf
+  bounds[:, 2:] = -np.inf
+  np.minimum.at(bounds[:, 0], labels, xyxy[:, 0])
+  np.minimum.at(bounds[:, 1], labels, xyxy[:, 1])
+  np.maximum.at(bounds[:, 2], labels, xyxy[:, 2])
+  np.maximum.at(bounds[:, 3], labels, xyxy[:, 3])
+
+  # 互相垂直的段: 交点为(竖线的x, 横线的y)
+  i, j = _near_pairs(bounds, gap)
+  keep = run_h[i] != run_h[j]
+  i, j = i[keep], j[keep]
+  hi, vi = np.where(run_h[i], i, j), np.where(run_h[i], j, i)
+  x, y = c[vi], c[hi]
+  dh = np.maximum(0, np.maximum(a0[hi] - x, x - a1[hi]))
+  dv = np.maximum(0, np.maximum(a0[vi] - y, y - a1[vi]))
+  keep = (dh <= gap) & (dv <= gap)
+  hi, vi, x, y = hi[keep], vi[keep], x[keep], y[keep]
+  # 端点对齐到交点; 交点在段中间时段不变, 该段在交点处分叉
+  free = np.ones((k, 2), dtype=bool)
+  for run, value in ((hi, x), (vi, y)):
+    for end, axis in ((0, a0), (1, a1)):
+      near = np.abs(axis[run] - value) <= gap
+      axis[run[near]] = value[near]
+      free[run[near], end] = False
+  # 与其它线段交叉但端点不在交点附近时, 延长到交点
+  for run, value in ((hi, x), (vi, y)):
+    np.minimum.at(a0, run, value)
+    np.maximum.at(a1, run, value)
+  if symbols is not None:
+    _snap_to_symbols(a0, a1, c, run_h, free, symbols, gap)
+
+  groups = connected_components(k, hi, vi)
+  count = int(groups.max()) + 1
+  # 每段上的点: 起止点以及与其它段的交点
+  stops: List[List[float]] = [[a0[r], a1[r]] for r in range(k)]
+  for h, v, px, py in zip(hi.tolist(), vi.tolist(), x.tolist(), y.tolist()):
+    stops[h].append(px)
+    stops[v].append(py)
+  edges: List[List[Tuple[tuple, tuple]]] = [[] for _ in range(count)]
+  for r in range(k):
+    values = sorted({round(float(v), 1) for v in stops[r]})
+    if len(values) == 1:
+      # 极短的线段也至少输出一条折线
+      values *= 2
+    cr = round(float(c[r]), 1)
+    if run_h[r]:
+      points = [(v, cr) for v in values]
+    else:
+      points = [(cr, v) for v in values]
+    edges[groups[r]].extend(zip(points[:-1], points[1:]))
+
+  members = groups[labels]
+  group_bounds = np.empty((count, 4), dtype=np.float32)
+  group_bounds[:, :2] = np.inf
+  group_bounds[:, 2:] = -np.inf
+  np.minimum.at(group_bounds[:, 0], members, xyxy[:, 0])
+  np.minimum.at(group_bounds[:, 1], members, xyxy[:, 1])
+  np.maximum.at(group_bounds[:, 2], members, xyxy[:, 2])
+  np.maximum.at(group_bounds[:, 3], members, xyxy[:, 3])
+  conf = np.zeros(count, dtype=np.float32)
+  np.maximum.at(conf, members, lines.conf)
+  # 每组中最长的原始框决定类别
+  order = np.lexsort((-length, members))
+  first = np.r_[True, members[order][1:] != members[order][:-1]]
+  cls = lines.cls[order[first]].astype(np.int32)
+  return LineNetwork(
+    [_polylines(group) for group in edges],
+    group_bounds,
+    conf,
+    cls,
+    np.bincount(members, minlength=count),
+    lines.names,
+  )
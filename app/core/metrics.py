@@ -0,0 +1,378 @@
+"""
+运行指标: 各阶段耗时直方图、排队等待、模型加载、缓存命中、在途请求与
+SSE事件大小, 以Prometheus文本格式导出.
+"""
+
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 推理相关耗时的直方图分桶(秒), 覆盖从毫秒级解码到分钟级的大图推理
+DURATION_BUCKETS = (
+  0.005,
+  0.01,
+  0.025,
+  0.05,
+  0.1,
+  0.25,
+  0.5,
+  1.0,
+  2.5,
+  5.0,
+  10.0,
+  30.0,
+  60.0,
+)
+# SSE事件大小的直方图分桶(字节)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _format_value(value: float) -> str:
+  if value == float("inf"):
+    return "+Inf"
+  if float(value).is_integer():
+    return str(int(value))
+  return repr(float(value))
+
+
+def _escape(value: str) -> str:
+  return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+  if not names:
+    return ""
+  pairs = ",".join(
+    f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+  )
+  return "{" + pairs + "}"
+
+
+class _Metric:
+  """指标基类: 按标签值保存子指标, 所有方法线程安全"""
+
+  kind = ""
+
+  def __init__(self, name: str, documentation: str, labelnames=()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames: Tuple[str, ...] = tuple(labelnames)
+    self._children: Dict[Tuple[str, ...], object] = {}
+    self._lock = threading.Lock()
+    registry.register(self)
+
+  def labels(self, *values):
+    """取得指定标签值的子指标, 标签值数量须与`labelnames`一致"""
+    key = tuple(str(v) for v in values)
+    child = self._children.get(key)
+    if child is None:
+      if len(key) != len(self.labelnames):
+        raise ValueError(f"{self.name} 的标签为 {self.labelnames}")
+      with self._lock:
+        child = self._children.setdefault(key, self._new_child())
+    return child
+
+  def _new_child(self):
+    raise NotImplementedError
+
+  def render(self) -> List[str]:
+    lines = [
+      f"# HELP {self.name} {self.documentation}",
+      f"# TYPE {self.name} {self.kind}",
+    ]
+    for key, child in sorted(self._children.items()):
+      lines.extend(child.render(self.name, self.labelnames, key))
+    return lines
+
+
+class _Value:
+  __slots__ = ("value", "_lock")
+
+  def __init__(self):
+    self.value = 0.0
+    self._lock = threading.Lock()
+
+  def inc(self, amount: float = 1) -> None:
+    with self._lock:
+      self.value += amount
+
+  def dec(self, amount: float = 1) -> None:
+    with self._lock:
+      self.value -= amount
+
+  def set(self, value: float) -> None:
+    self.value = value
+
+  def render(self, name, labelnames, key) -> List[str]:
+    labels = _format_labels(labelnames, key)
+    return [f"{name}{labels} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+  """只增不减的计数"""
+
+  kind = "counter"
+
+  def _new_child(self):
+    return _Value()
+
+  def inc(self, amount: float = 1) -> None:
+    """无标签指标的快捷方法"""
+    self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+  """可增可减的当前值, 如在途请求数"""
+
+  kind = "gauge"
+
+  def _new_child(self):
+    return _Value()
+
+  def inc(self, amount: float = 1) -> None:
+    self.labels().inc(amount)
+
+  def dec(self, amount: float = 1) -> None:
+    self.labels().dec(amount)
+
+
+class _HistogramValue:
+  __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+  def __init__(self, buckets: Tuple[float, ...]):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.sum = 0.0
+    self.count = 0
+    self._lock = threading.Lock()
+
+  def observe(self, value: float) -> None:
+    with self._lock:
+      self.sum += value
+      self.count += 1
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          self.counts[i] += 1
+          break
+
+  @contextmanager
+  def time(self):
+    """记录上下文中代码的执行时间(秒)"""
+    started = perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(perf_counter() - started)
+
+  def render(self, name, labelnames, key) -> List[str]:
+    with self._lock:
+      counts, total, count = list(self.counts), self.sum, self.count
+    lines = []
+    cumulative = 0
+    # 各分桶为累计值, 最后的+Inf分桶即观测总数
+    for bound, n in zip(self.buckets + (float("inf"),), counts + [0]):
+      cumulative = count if bound == float("inf") else cumulative + n
+      labels = _format_labels(
+        labelnames + ("le",), key + (_format_value(bound),)
+      )
+      lines.append(f"{name}_bucket{labels} {cumulative}")
+    labels = _format_labels(labelnames, key)
+    lines.append(f"{name}_sum{labels} {_format_value(total)}")
+    lines.append(f"{name}_count{labels} {count}")
+    return lines
+
+
+class Histogram(_Metric):
+  """按分桶统计观测值的分布, 如各阶段耗时"""
+
+  kind = "histogram"
+
+  def __init__(
+    self,
+    name: str,
+    documentation: str,
+    labelnames=(),
+    buckets: Sequence[float] = DURATION_BUCKETS,
+  ):
+    self.buckets = tuple(sorted(buckets))
+    super().__init__(name, documentation, labelnames)
+
+  def _new_child(self):
+    return _HistogramValue(self.buckets)
+
+  def observe(self, value: float) -> None:
+    self.labels().observe(value)
+
+
+class Registry:
+  """指标注册表, 导出时按注册顺序输出所有指标"""
+
+  def __init__(self):
+    self._metrics: List[_Metric] = []
+
+  def register(self, metric: _Metric) -> None:
+    self._metrics.append(metric)
+
+  def render(self) -> str:
+    """Prometheus文本格式(0.0.4)"""
+    lines = []
+    for metric in self._metrics:
+      lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+"""全局指标注册表"""
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+stage_seconds = Histogram(
+  "hmi_stage_seconds",
+  "各处理阶段耗时(秒): digest、cache、queue、decode、model、symbol、line、"
+  "text、sse",
+  ["endpoint", "stage"],
+)
+queue_wait_seconds = Histogram(
+  "hmi_queue_wait_seconds",
+  "推理排队等待时间(秒): executor为推理线程池, <模型配置>.symbol/line为"
+  "YOLO批处理, "
+  "ocr为OCR实例签出",
+  ["queue"],
+)
+model_load_seconds = Histogram(
+  "hmi_model_load_seconds",
+  "模型加载耗时(秒)",
+  ["model"],
+  buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+cache_requests = Counter(
+  "hmi_result_cache_requests_total",
+  "识别结果缓存查询次数, result为memory/disk(命中的层)或miss",
+  ["result"],
+)
+requests_in_flight = Gauge(
+  "hmi_http_requests_in_flight", "正在处理(含SSE流未结束)的HTTP请求数"
+)
+request_seconds = Histogram(
+  "hmi_http_request_seconds",
+  "HTTP请求耗时(秒), 对SSE流为整个流的持续时间",
+  ["method", "route", "status"],
+)
+sse_event_bytes = Histogram(
+  "hmi_sse_event_bytes",
+  "SSE事件大小(字节)",
+  ["event"],
+  buckets=SIZE_BUCKETS,
+)
+
+
+class RequestTimings:
+  """单个请求的各阶段耗时, 同时记入`stage_seconds`。
+
+  用于生成`Server-Timing`响应头与SSE`stats`事件。
+  """
+
+  def __init__(self, endpoint: str):
+    self.endpoint = endpoint
+    self.started = perf_counter()
+    self.stages: Dict[str, float] = {}
+
+  def record(self, stage: str, seconds: float) -> None:
+    self.stages[stage] = seconds
+    stage_seconds.labels(self.endpoint, stage).observe(seconds)
+
+  @contextmanager
+  def time(self, stage: str):
+    started = perf_counter()
+    try:
+      yield
+    finally:
+      self.record(stage, perf_counter() - started)
+
+  async def timed(self, stage: str, awaitable):
+    """等待`awaitable`并记录耗时, 失败时不记录"""
+    started = perf_counter()
+    result = await awaitable
+    self.record(stage, perf_counter() - started)
+    return result
+
+  def server_timing(self) -> str:
+    """`Server-Timing`响应头, 耗时单位为毫秒"""
+    return ", ".join(
+      f"{stage};dur={seconds * 1000:.1f}"
+      for stage, seconds in self.stages.items()
+    )
+
+  def to_dict(self) -> dict:
+    return {
+      "stages_ms": {
+        stage: round(seconds * 1000, 1)
+        for stage, seconds in self.stages.items()
+      },
+      "total_ms": round((perf_counter() - self.started) * 1000, 1),
+    }
+
+
+async def observe_events(stream):
+  """
+  包装SSE流, 按事件类型记录每个事件的大小。
+  Yields:
+    bytes: `stream`产出的UTF-8编码的事件。
+  """
+  for_event = {}
+  async for msg in stream:
+    # 一次发送的数据可能包含多个事件, 每个事件以"event: <类型>\n"开头,
+    # 以空行结束
+    start = 0
+    while start < len(msg):
+      end = msg.find(b"\n\n", start)
+      end = len(msg) if end < 0 else end + 2
+      event = b""
+      if msg.startswith(b"event: ", start):
+        event = msg[start + 7 : msg.find(b"\n", start + 7)]
+      histogram = for_event.get(event)
+      if histogram is None:
+        histogram = for_event[event] = sse_event_bytes.labels(
+          event.decode("utf-8") or "unknown"
+        )
+      histogram.observe(end - start)
+      start = end
+    yield msg
+
+
+class MetricsMiddleware:
+  """记录在途请求数与请求耗时的ASGI中间件。
+
+  对SSE等流式响应, 耗时计算到响应体发送完毕(或客户端断开)为止。
+  路由标签使用路由模板(如`/image2hmi/batch/{job_id}`), 未匹配的路径
+  记为`unmatched`, 避免标签数量无限增长。
+  """
+
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    status: Optional[int] = None
+
+    async def send_wrapper(message):
+      nonlocal status
+      if message["type"] == "http.response.start":
+        status = message["status"]
+      await send(message)
+
+    requests_in_flight.inc()
+    started = perf_counter()
+    try:
+      await self.app(scope, receive, send_wrapper)
+    finally:
+      requests_in_flight.dec()
+      route = scope.get("route")
+      request_seconds.labels(
+        scope["method"],
+        getattr(route, "path", "unmatched"),
+        status or 500,
+      ).observe(perf_counter() - started)
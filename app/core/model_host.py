@@ -0,0 +1,273 @@
+"""
+模型宿主进程: 多个uvicorn worker共用一份模型权重.
+
+`fastapi run --workers N`的每个worker都是独立进程(spawn方式启动,
+无法在fork前预加载), 各自加载YOLO与PaddleOCR模型会占用N倍内存。
+设置`MODEL_HOST_SOCKET`后, 由单独的模型宿主进程加载全部模型,
+worker通过Unix socket把推理请求发送给宿主进程:
+
+  python -m app.core.model_host fastapi run --workers 4 app/main.py
+
+宿主进程与worker之间以pickle传递数据, 连接必须通过`MODEL_HOST_AUTHKEY`
+认证; 以上方式启动时未设置密钥则随机生成, 并负责重启意外退出的宿主进程。
+"""
+
+import os
+import queue
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Any, List, Optional
+
+import numpy as np
+
+from .detections import Detections
+from .settings import settings
+
+HOSTED_MODELS = {
+  f"{profile}.{kind}": directory / path.name
+  for profile, directory in settings.MODEL_PROFILES.items()
+  for kind, path in (
+    ("symbol", settings.MODEL_PATH),
+    ("line", settings.MODEL_LINE_PATH),
+  )
+}
+"""宿主进程可加载的YOLO模型名称(`<模型配置>.symbol`或`<模型配置>.line`)
+与`.pt`文件路径"""
+
+FUSED_SUFFIX = ".fused"
+"""图符与线条模型共用预处理的组合模型名称后缀, 见`backends.PairedYoloModel`"""
+
+
+class ModelHostError(RuntimeError):
+  """宿主进程中的推理失败"""
+
+
+class ModelHostClient:
+  """模型宿主进程的客户端。
+
+  每个调用线程从连接池中取出一个连接, 调用结束后归还, 因此推理线程池
+  中的多个线程可以同时向宿主进程发送请求。宿主进程尚未启动(仍在加载
+  模型)时, 建立连接会重试`MODEL_HOST_CONNECT_TIMEOUT`秒。
+  """
+
+  def __init__(self, address: str, authkey: bytes, connect_timeout: float):
+    self.address = address
+    self.authkey = authkey
+    self.connect_timeout = connect_timeout
+    self._pool: queue.SimpleQueue = queue.SimpleQueue()
+
+  def call(self, method: str, *args) -> Any:
+    """
+    调用宿主进程中的方法并等待结果。
+    Raises:
+      ModelHostError: 宿主进程中推理失败。
+    """
+    try:
+      conn = self._pool.get_nowait()
+    except queue.Empty:
+      conn = self._connect()
+    try:
+      conn.send((method, args))
+      status, result = conn.recv()
+    except BaseException:
+      # 连接状态未知(如宿主进程重启), 丢弃该连接
+      conn.close()
+      raise
+    self._pool.put(conn)
+    if status == "error":
+      raise ModelHostError(result)
+    return result
+
+  def _connect(self) -> Connection:
+    deadline = monotonic() + self.connect_timeout
+    while True:
+      try:
+        return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+      except (FileNotFoundError, ConnectionRefusedError):
+        if monotonic() >= deadline:
+          raise
+        sleep(0.5)
+
+
+class RemoteYoloModel:
+  """由宿主进程执行推理的YOLO模型, 接口与`YoloModel`相同"""
+
+  backend = "remote"
+
+  def __init__(self, name: str, client: ModelHostClient):
+    from .backends import model_file
+
+    self.name = name
+    self.client = client
+    # 与宿主进程加载的文件相同, 用于识别结果缓存的模型版本;
+    # 共用预处理的组合模型(`<模型配置>.fused`)没有对应的文件
+    path = HOSTED_MODELS.get(name)
+    self.path = None if path is None else model_file(path)
+
+  def predict(self, img: np.ndarray, imgsz: Optional[int] = None) -> Detections:
+    return self.client.call("predict", self.name, img, imgsz)
+
+  def predict_batch(self, imgs: List[np.ndarray]) -> List[Detections]:
+    return self.client.call("predict_batch", self.name, imgs)
+
+
+class ModelHost:
+  """模型宿主: 每个客户端连接一个线程处理请求。
+
+  启动时加载`MODEL_PRELOAD_PROFILES`中的模型, 其它模型配置在第一次
+  被请求时加载, 加载后常驻。
+  """
+
+  def __init__(self):
+    from .ocr import ocr, preload_ocr
+
+    self.ocr = ocr
+    self.models = {}
+    self._lock = threading.Lock()
+    for profile in settings.MODEL_PRELOAD_PROFILES:
+      for kind in ("symbol", "line"):
+        self._model(f"{profile}.{kind}")
+    preload_ocr(settings.OCR_PRELOAD_LANGS)
+
+  def _model(self, name: str):
+    """
+    取得已加载的模型, 未加载时加载(同时只加载一个模型)。
+    `<模型配置>.fused`为该配置的图符与线条模型共用预处理的组合。
+    """
+    from .backends import PairedYoloModel, load_yolo_model
+
+    model = self.models.get(name)
+    if model is None and name.endswith(FUSED_SUFFIX):
+      profile = name[: -len(FUSED_SUFFIX)]
+      paired = PairedYoloModel(
+        self._model(f"{profile}.symbol"), self._model(f"{profile}.line")
+      )
+      with self._lock:
+        model = self.models.setdefault(name, paired)
+    if model is None:
+      if name not in HOSTED_MODELS:
+        raise ValueError(f"未知的模型: {name}")
+      with self._lock:
+        model = self.models.get(name)
+        if model is None:
+          model = self.models[name] = load_yolo_model(
+            HOSTED_MODELS[name], label=name
+          )
+    return model
+
+  def serve(self, address: str, authkey: bytes) -> None:
+    if os.path.exists(address):
+      os.unlink(address)
+    Path(address).parent.mkdir(parents=True, exist_ok=True)
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+      # 只允许同一用户连接
+      os.chmod(address, 0o600)
+      print(f"模型宿主进程已启动: {address}")
+      while True:
+        try:
+          conn = listener.accept()
+        except Exception as e:
+          # 认证失败等错误只影响该连接
+          print(f"模型宿主进程接受连接失败: {e}")
+          continue
+        threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+  def _handle(self, conn: Connection) -> None:
+    with conn:
+      while True:
+        try:
+          method, args = conn.recv()
+        except EOFError:
+          return
+        try:
+          if method == "predict":
+            name, img, imgsz = args
+            model = self._model(name)
+            # 共用预处理的组合模型不支持指定输入尺寸
+            result = (
+              model.predict(img) if imgsz is None else model.predict(img, imgsz)
+            )
+          elif method == "predict_batch":
+            name, imgs = args
+            result = self._model(name).predict_batch(imgs)
+          elif method == "ocr":
+            result = self.ocr(*args)
+          else:
+            raise ValueError(f"未知的方法: {method}")
+          conn.send(("ok", result))
+        except Exception as e:
+          conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+model_host_client = (
+  ModelHostClient(
+    settings.MODEL_HOST_SOCKET,
+    settings.MODEL_HOST_AUTHKEY,
+    settings.MODEL_HOST_CONNECT_TIMEOUT,
+  )
+  if settings.MODEL_HOST_SOCKET
+  else None
+)
+"""模型宿主进程客户端, 未设置`MODEL_HOST_SOCKET`时为None(进程内推理)"""
+
+
+def supervise(command: List[str]) -> int:
+  """
+  启动模型宿主进程与`command`(如`fastapi run --workers 4 app/main.py`),
+  宿主进程意外退出时重新启动; `command`退出后结束宿主进程。
+  未设置`MODEL_HOST_AUTHKEY`时生成随机密钥, 通过环境变量传给两者。
+  Returns:
+    int: `command`的退出码。
+  """
+  env = dict(os.environ)
+  if not env.get("MODEL_HOST_AUTHKEY"):
+    env["MODEL_HOST_AUTHKEY"] = secrets.token_hex(32)
+  host_command = [sys.executable, "-m", "app.core.model_host"]
+  host = subprocess.Popen(host_command, env=env)
+  server = subprocess.Popen(command, env=env)
+  # 终端的Ctrl+C会发给整个进程组, 只需转发SIGTERM(如docker stop)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, lambda signum, _: server.send_signal(signum))
+  while server.poll() is None:
+    if host.poll() is not None:
+      print(f"模型宿主进程已退出({host.returncode}), 重新启动")
+      host = subprocess.Popen(host_command, env=env)
+    sleep(1)
+  host.terminate()
+  try:
+    host.wait(10)
+  except subprocess.TimeoutExpired:
+    host.kill()
+  # 被信号结束时返回码为负数, 按shell的习惯转换为128+信号
+  code = server.returncode
+  return code if code >= 0 else 128 - code
+
+
+def main(command: List[str]) -> None:
+  """
+  没有参数时运行宿主进程; 有参数时以参数为命令启动服务, 见`supervise`。
+  """
+  global model_host_client
+  if not settings.MODEL_HOST_SOCKET:
+    raise SystemExit("请设置 MODEL_HOST_SOCKET 环境变量")
+  if command:
+    raise SystemExit(supervise(command))
+  if not settings.MODEL_HOST_AUTHKEY:
+    raise SystemExit("请设置 MODEL_HOST_AUTHKEY 环境变量")
+  # 宿主进程自身在进程内推理, 不能再把请求转发给自己
+  model_host_client = None
+  ModelHost().serve(settings.MODEL_HOST_SOCKET, settings.MODEL_HOST_AUTHKEY)
+
+
+if __name__ == "__main__":
+  # 以`python -m`运行时本文件是`__main__`模块, 需要修改的是
+  # `app.core.model_host`模块中的客户端
+  from app.core.model_host import main as host_main
+
+  host_main(sys.argv[1:])
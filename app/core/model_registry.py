@@ -0,0 +1,292 @@
+"""
+YOLO模型配置: 每套配置包含一个图符模型与一个线条模型(如`models/`与
+`models/dcs/`), 按请求选择; 首次使用时加载, 超出内存预算时淘汰最久
+未使用且没有请求在用的配置.
+"""
+
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .backends import PairedYoloModel, load_yolo_model, model_file
+from .batching import BatchingPredictor
+from .cache import file_fingerprint
+from .image2hmi import TiledPredictor
+from .metrics import Gauge
+from .model_host import RemoteYoloModel, model_host_client
+from .settings import settings
+
+MODEL_KINDS = ("symbol", "line")
+
+model_memory_bytes = Gauge(
+  "hmi_model_memory_bytes", "已加载的YOLO模型大小(按模型文件大小估算)"
+)
+model_profiles_loaded = Gauge("hmi_model_profiles_loaded", "已加载的模型配置数")
+
+
+def yolo_options(tiled: bool) -> str:
+  """
+  影响图符与线条识别结果的推理配置, 用于识别结果缓存键。
+  Args:
+    tiled (bool): 是否切片推理, 不切片时切片配置不影响结果。
+  """
+  options = [settings.YOLO_FUSED]
+  if tiled:
+    options += [
+      settings.YOLO_TILE_SIZE,
+      settings.YOLO_TILE_OVERLAP,
+      settings.YOLO_TILE_MERGE_THRESHOLD,
+    ]
+  return ",".join(map(str, options))
+
+
+def profile_models(directory: Path) -> Dict[str, Path]:
+  """模型目录中图符与线条模型的`.pt`文件路径"""
+  return {
+    "symbol": directory / settings.MODEL_PATH.name,
+    "line": directory / settings.MODEL_LINE_PATH.name,
+  }
+
+
+class LoadedModels:
+  """一套已加载的模型, 以及各模型的批处理器与切片推理器"""
+
+  def __init__(self, profile: str, models: dict):
+    self.profile = profile
+    self.models = models
+    self.size = sum(
+      model.path.stat().st_size
+      for kind, model in models.items()
+      # 模型宿主模式下模型不占用本进程内存
+      if kind in MODEL_KINDS
+      and not isinstance(model, RemoteYoloModel)
+      and model.path.exists()
+    )
+    """估算的内存占用, 单位为字节"""
+    self.predictors = {
+      kind: BatchingPredictor(
+        f"{profile}.{kind}",
+        model,
+        settings.YOLO_BATCH_MAX_SIZE,
+        settings.YOLO_BATCH_MAX_WAIT,
+      )
+      for kind, model in models.items()
+    }
+    self.tiled = {
+      kind: TiledPredictor(
+        predictor,
+        settings.YOLO_TILE_SIZE,
+        settings.YOLO_TILE_OVERLAP,
+        settings.YOLO_TILE_MERGE_THRESHOLD,
+        settings.YOLO_TILE_MAX_INFLIGHT,
+      )
+      for kind, predictor in self.predictors.items()
+    }
+
+  def predictor(self, kind: str, tiled: bool = False):
+    """
+    取得某个模型的推理器, 两者都提供`async predict(img)`。
+    Args:
+      kind (str): "symbol"、"line", 或启用`YOLO_FUSED`时的"fused"
+        (共用预处理, 返回(图符, 线条)元组)。
+      tiled (bool): 是否使用切片推理。
+    """
+    return (self.tiled if tiled else self.predictors)[kind]
+
+  def close(self) -> None:
+    """停止批处理任务, 释放对模型的引用"""
+    for predictor in self.predictors.values():
+      predictor.close()
+
+
+class _Entry:
+  """模型配置的加载状态"""
+
+  __slots__ = ("models", "loading", "reserved")
+
+  def __init__(self):
+    self.models: Optional[LoadedModels] = None
+    self.loading: Optional[asyncio.Future] = None
+    self.reserved = 0
+    """正在使用或等待加载的请求数量, 大于0时不会被淘汰"""
+
+
+class ModelLease:
+  """一个请求对模型配置的占用, 占用期间不会被淘汰; 用完须调用`release`"""
+
+  def __init__(self, registry: "ModelRegistry", entry: _Entry):
+    self._registry = registry
+    self._entry = entry
+    self._released = False
+    self.models: LoadedModels = entry.models
+
+  def release(self) -> None:
+    """归还占用, 可重复调用"""
+    if self._released:
+      return
+    self._released = True
+    self._registry._release(self._entry)
+
+
+class ModelRegistry:
+  """全部模型配置。
+
+  模型配置在第一次`acquire`时在线程中加载, 同一配置同时只加载一次,
+  加载期间不影响使用其它配置的请求。已加载模型的估算大小超过
+  `memory_budget`字节时, 按LRU淘汰没有请求在用的配置; 所有配置都在
+  使用时暂时超出预算, 等某个配置归还后再淘汰。所有方法需在事件循环
+  线程中调用。
+  """
+
+  def __init__(
+    self, profiles: Dict[str, Path], default: str, memory_budget: int
+  ):
+    if default not in profiles:
+      raise ValueError(f"默认模型配置 {default} 不在配置中")
+    self.default = default
+    self.memory_budget = memory_budget
+    self.paths = {
+      name: profile_models(directory) for name, directory in profiles.items()
+    }
+    self.versions = {
+      name: file_fingerprint(*(model_file(path) for path in paths.values()))
+      for name, paths in self.paths.items()
+    }
+    """各配置的模型版本, 替换模型文件或切换推理后端后缓存自动失效"""
+    self.hits = 0
+    self.loads = 0
+    self.evictions = 0
+    self._entries: OrderedDict[str, _Entry] = OrderedDict()
+
+  def resolve(self, profile: Optional[str]) -> str:
+    """
+    校验模型配置名称, 未指定时返回默认配置。
+    Raises:
+      ValueError: 名称无效。
+    """
+    profile = profile or self.default
+    if profile not in self.paths:
+      raise ValueError(
+        f"无效的模型配置: {profile}, 可选值: {', '.join(self.paths)}"
+      )
+    return profile
+
+  async def acquire(self, profile: str) -> ModelLease:
+    """
+    占用模型配置, 未加载时加载。
+    Raises:
+      Exception: 模型加载失败, 下一个请求会重新加载。
+    """
+    entry = self._entries.get(profile)
+    if entry is None:
+      entry = self._entries[profile] = _Entry()
+    else:
+      self._entries.move_to_end(profile)
+    entry.reserved += 1
+    try:
+      if entry.models is None:
+        if entry.loading is None:
+          entry.loading = asyncio.ensure_future(self._load(profile, entry))
+        # 取消等待的请求不影响加载, 其它请求仍在等待同一次加载
+        await asyncio.shield(entry.loading)
+      else:
+        self.hits += 1
+    except BaseException:
+      self._release(entry)
+      raise
+    self._evict()
+    return ModelLease(self, entry)
+
+  async def preload(self, profiles: List[str]) -> None:
+    """启动时预加载模型配置"""
+    for profile in profiles:
+      (await self.acquire(self.resolve(profile))).release()
+
+  def stats(self) -> dict:
+    profiles = {}
+    for name, version in self.versions.items():
+      entry = self._entries.get(name) or _Entry()
+      profiles[name] = {
+        "loaded": entry.models is not None,
+        "reserved": entry.reserved,
+        "size": entry.models.size if entry.models is not None else 0,
+        "version": version,
+      }
+    return {
+      "default": self.default,
+      "memory_budget": self.memory_budget,
+      "memory": self._memory(),
+      "hits": self.hits,
+      "loads": self.loads,
+      "evictions": self.evictions,
+      "profiles": profiles,
+    }
+
+  async def _load(self, profile: str, entry: _Entry) -> None:
+    try:
+      models = await asyncio.to_thread(self._load_models, profile)
+    finally:
+      entry.loading = None
+    entry.models = models
+    self.loads += 1
+    self._update_gauges()
+    print(f"已加载模型配置: {profile}")
+
+  def _load_models(self, profile: str) -> LoadedModels:
+    if model_host_client is not None:
+      # 模型宿主模式: 模型在宿主进程中加载, worker只做转发
+      kinds = MODEL_KINDS + (("fused",) if settings.YOLO_FUSED else ())
+      models = {
+        kind: RemoteYoloModel(f"{profile}.{kind}", model_host_client)
+        for kind in kinds
+      }
+    else:
+      models = {
+        kind: load_yolo_model(path, label=f"{profile}.{kind}")
+        for kind, path in self.paths[profile].items()
+      }
+      if settings.YOLO_FUSED:
+        models["fused"] = PairedYoloModel(models["symbol"], models["line"])
+    return LoadedModels(profile, models)
+
+  def _release(self, entry: _Entry) -> None:
+    entry.reserved -= 1
+    self._evict()
+
+  def _memory(self) -> int:
+    return sum(
+      entry.models.size
+      for entry in self._entries.values()
+      if entry.models is not None
+    )
+
+  def _evict(self) -> None:
+    """淘汰最久未使用的空闲配置, 直到不超过内存预算"""
+    if self.memory_budget <= 0:
+      return
+    memory = self._memory()
+    for name, entry in list(self._entries.items()):
+      if memory <= self.memory_budget:
+        break
+      if entry.reserved == 0 and entry.models is not None:
+        memory -= entry.models.size
+        entry.models.close()
+        del self._entries[name]
+        self.evictions += 1
+        print(f"淘汰模型配置: {name}")
+    self._update_gauges()
+
+  def _update_gauges(self) -> None:
+    model_memory_bytes.labels().set(self._memory())
+    model_profiles_loaded.labels().set(
+      sum(1 for entry in self._entries.values() if entry.models is not None)
+    )
+
+
+model_registry = ModelRegistry(
+  settings.MODEL_PROFILES,
+  settings.MODEL_PROFILE_DEFAULT,
+  settings.MODEL_MEMORY_BUDGET_MB * 1024 * 1024,
+)
+"""全局模型配置"""
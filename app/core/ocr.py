@@ -1,27 +1,164 @@
 # ocr.py: OCR功能模块，封装了PaddleOCR的初始化与图片文字识别接口
-import io
-from typing import Optional
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from importlib.metadata import PackageNotFoundError, version
+from time import perf_counter
+from typing import List, Optional
 
 import numpy as np
 from paddleocr import PaddleOCR
-from PIL import Image
 
-from app.core.image2hmi import calculate_area
+try:
+  # 分步识别(`_staged_ocr`)依赖PaddleOCR 2.x的内部函数
+  from paddleocr.tools.infer.predict_system import sorted_boxes
+  from paddleocr.tools.infer.utility import (
+    get_minarea_rect_crop,
+    get_rotate_crop_image,
+  )
+except ImportError:
+  sorted_boxes = get_minarea_rect_crop = get_rotate_crop_image = None
 
-# 全局只初始化一次OCR模型，避免重复加载
-ocr_models: dict[str, PaddleOCR] = {}
+from app.core import model_host
+from app.core.detections import Detections, TextDetections, box_areas
+from app.core.ingest import decode_image
+from app.core.metrics import model_load_seconds, queue_wait_seconds
+from app.core.settings import settings
 
+_checkout_wait = queue_wait_seconds.labels("ocr")
 
-# 全局只初始化一次OCR模型，避免重复加载
-def get_ocr(lang: str = "ch"):
-  """
-  获取指定语言的OCR模型实例,若未初始化则新建。
-  :param lang: 语言代码，如'ch'表示中文
-  :return: PaddleOCR实例
+try:
+  OCR_MODEL_VERSION = version("paddleocr")
+except PackageNotFoundError:
+  OCR_MODEL_VERSION = "unknown"
+"""OCR模型版本, 用于识别结果缓存键"""
+
+
+class _LanguageEngines:
+  """某种语言的OCR实例集合"""
+
+  def __init__(self):
+    self.idle: List[PaddleOCR] = []
+    self.created = 0
+    self.reserved = 0
+    """已签出或正在等待签出的请求数量, 大于0时该语言不会被淘汰"""
+    self.cond = threading.Condition()
+
+
+class OcrEnginePool:
+  """PaddleOCR实例池。
+
+  最多常驻`max_languages`种语言, 超出时淘汰最久未使用且没有请求在用
+  的语言; 每种语言最多创建`instances_per_language`个实例, 同一实例
+  同时只被一个请求使用(PaddleOCR实例不是线程安全的), 实例都在使用时
+  请求排队等待。模型在首次签出时加载, 加载期间不阻塞其它语言。
   """
-  if lang not in ocr_models:
-    ocr_models[lang] = PaddleOCR(use_angle_cls=True, lang=lang)
-  return ocr_models[lang]
+
+  def __init__(self, max_languages: int, instances_per_language: int):
+    self.max_languages = max(1, max_languages)
+    self.instances_per_language = max(1, instances_per_language)
+    self.hits = 0
+    self.loads = 0
+    self.evictions = 0
+    self._languages: OrderedDict[str, _LanguageEngines] = OrderedDict()
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def checkout(self, lang: str):
+    """
+    签出一个指定语言的OCR实例, 退出上下文时归还。
+    :param lang: 语言代码，如'ch'表示中文
+    :return: PaddleOCR实例
+    """
+    engines = self._reserve(lang)
+    try:
+      engine = self._acquire(lang, engines)
+      try:
+        yield engine
+      finally:
+        with engines.cond:
+          engines.idle.append(engine)
+          engines.cond.notify()
+    finally:
+      with self._lock:
+        engines.reserved -= 1
+        self._evict()
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        "max_languages": self.max_languages,
+        "instances_per_language": self.instances_per_language,
+        "hits": self.hits,
+        "loads": self.loads,
+        "evictions": self.evictions,
+        "languages": {
+          lang: {
+            "instances": engines.created,
+            "idle": len(engines.idle),
+            "reserved": engines.reserved,
+          }
+          for lang, engines in self._languages.items()
+        },
+      }
+
+  def _reserve(self, lang: str) -> _LanguageEngines:
+    """取得(必要时登记)语言并占用, 按LRU淘汰多余的语言"""
+    with self._lock:
+      engines = self._languages.get(lang)
+      if engines is None:
+        engines = self._languages[lang] = _LanguageEngines()
+      else:
+        self._languages.move_to_end(lang)
+      engines.reserved += 1
+      self._evict()
+      return engines
+
+  def _evict(self) -> None:
+    """淘汰最久未使用的空闲语言, 调用方需持有锁。
+    所有语言都在使用时暂时超出上限, 等某个语言归还后再淘汰。"""
+    for lang in list(self._languages):
+      if len(self._languages) <= self.max_languages:
+        return
+      if self._languages[lang].reserved == 0:
+        del self._languages[lang]
+        self.evictions += 1
+        print(f"淘汰OCR模型: {lang}")
+
+  def _acquire(self, lang: str, engines: _LanguageEngines) -> PaddleOCR:
+    """取一个空闲实例, 没有空闲实例且未达上限时加载新实例"""
+    started = perf_counter()
+    with engines.cond:
+      while not engines.idle and engines.created >= self.instances_per_language:
+        engines.cond.wait()
+      # 排队时间不含加载新实例的时间(记入`model_load_seconds`)
+      _checkout_wait.observe(perf_counter() - started)
+      if engines.idle:
+        with self._lock:
+          self.hits += 1
+        return engines.idle.pop()
+      engines.created += 1
+    try:
+      with model_load_seconds.labels(f"ocr.{lang}").time():
+        engine = PaddleOCR(
+          use_angle_cls=settings.OCR_ANGLE_CLS != "never",
+          rec_batch_num=settings.OCR_REC_BATCH_SIZE,
+          lang=lang,
+        )
+    except BaseException:
+      with engines.cond:
+        engines.created -= 1
+        engines.cond.notify()
+      raise
+    with self._lock:
+      self.loads += 1
+    return engine
+
+
+ocr_pool = OcrEnginePool(
+  settings.OCR_MAX_LANGUAGES, settings.OCR_INSTANCES_PER_LANGUAGE
+)
+"""全局OCR实例池"""
 
 
 def ocr_to_json(image_bytes: bytes, lang: Optional[str] = "ch"):
@@ -31,42 +168,232 @@ def ocr_to_json(image_bytes: bytes, lang: Optional[str] = "ch"):
   :param lang: 语言代码，默认为中文(ch), 可选'en'表示英文
   :return: 识别结果，包含文本、置信度和文本框坐标
   """
-  image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-  image_np = np.array(image)
-  ocr_result = ocr(image_np, lang)
-  result = []
-  for item in ocr_result:
-    for box, text in item:
-      x1, y1 = box[0]
-      x2, y2 = box[2]
-      payload = {"text": text[0]}
-      origin = {
-        "name": text[0],  # 识别出的文本内容
-        "confidence": text[1],  # 置信度分数
+  return ocr_result_to_json(ocr_image_bytes(image_bytes, lang))
+
+
+def ocr_image_bytes(image_bytes: bytes, lang: Optional[str] = "ch"):
+  """
+  解码图片字节流并进行OCR识别,返回PaddleOCR原始识别结果。
+  :param image_bytes: 图片的二进制内容(bytes或memoryview)
+  :param lang: 语言代码，默认为中文(ch)
+  :return: OCR识别结果, 坐标为原图坐标
+  """
+  decoded = decode_image(image_bytes)
+  return scale_ocr_result(ocr(decoded.img, lang), decoded.scale)
+
+
+def scale_ocr_result(ocr_result: list, factor: float) -> list:
+  """
+  缩放OCR识别结果中的文本框坐标, 用于将缩小解码的图片上的坐标还原到原图。
+  :param ocr_result: `ocr`的返回值
+  :param factor: 缩放比例
+  :return: 缩放后的识别结果
+  """
+  if factor == 1:
+    return ocr_result
+  return [
+    [
+      [[[x * factor, y * factor] for x, y in box], content]
+      for box, content in item
+    ]
+    if item
+    else item
+    for item in ocr_result
+  ]
+
+
+def shift_ocr_result(ocr_result: list, dx: float, dy: float) -> list:
+  """
+  平移OCR识别结果中的文本框坐标, 用于将区域内的坐标还原到整图。
+  :param ocr_result: `ocr`的返回值
+  :param dx: 水平偏移
+  :param dy: 垂直偏移
+  :return: 平移后的识别结果
+  """
+  return [
+    [[[[x + dx, y + dy] for x, y in box], content] for box, content in item]
+    if item
+    else item
+    for item in ocr_result
+  ]
+
+
+def ocr_result_to_json(ocr_result: list):
+  """
+  将PaddleOCR原始识别结果转换为JSON格式的结果列表。
+  :param ocr_result: `ocr`或`ocr_image_bytes`的返回值
+  :return: 识别结果，包含文本、置信度和文本框坐标
+  """
+  texts = TextDetections.from_ocr(ocr_result)
+  xyxy = texts.xyxy
+  created_at = f"{np.datetime64('now').astype(str)}"
+  return [
+    {
+      "payload": {"text": text},
+      "origin": {
+        "name": text,  # 识别出的文本内容
+        "confidence": conf,  # 置信度分数
         "x1": x1,  # 文本框左上角x坐标
         "y1": y1,  # 文本框左上角y坐标
         "x2": x2,  # 文本框右下角x坐标
         "y2": y2,  # 文本框右下角y坐标
-      }
-      attrs = calculate_area(x1, y1, x2, y2)
-      result.append(
-        {
-          "payload": payload,
-          "origin": origin,
-          "attrs": attrs,
-          "createdAt": f"{np.datetime64('now').astype(str)}",
-        }
-      )
-  return result
+      },
+      "attrs": {"x": x, "y": y, "width": w, "height": h},
+      "createdAt": created_at,
+    }
+    for text, conf, (x1, y1, x2, y2), (x, y, w, h) in zip(
+      texts.texts,
+      texts.conf.tolist(),
+      xyxy.tolist(),
+      box_areas(xyxy).tolist(),
+    )
+  ]
+
+
+def preload_ocr(langs: List[str]) -> None:
+  """
+  预加载并预热指定语言的OCR模型, 避免首个请求承担模型加载耗时。
+  :param langs: 语言代码列表
+  """
+  blank = np.full((32, 32, 3), 255, dtype=np.uint8)
+  for lang in langs:
+    print(f"预加载OCR模型: {lang}")
+    ocr(blank, lang)
+
+
+def ocr_options(gated: bool) -> str:
+  """
+  影响OCR识别结果的配置, 用于识别结果缓存键。
+  :param gated: 是否遮盖图符与管线区域后识别
+  :return: 配置字符串
+  """
+  options = [settings.OCR_ANGLE_CLS]
+  if settings.OCR_ANGLE_CLS == "low_confidence":
+    options.append(settings.OCR_ANGLE_CLS_THRESHOLD)
+  if gated:
+    options += [*settings.OCR_GATING_MASK, settings.OCR_SYMBOL_MASK_INSET]
+  return ",".join(map(str, options))
+
+
+def ocr_mask(
+  symbols: Optional[Detections], lines: Optional[Detections]
+) -> np.ndarray:
+  """
+  文字识别需要遮盖的区域, 按`OCR_GATING_MASK`选择: 图符内部(每边向内
+  收缩`OCR_SYMBOL_MASK_INSET`, 保留图符边缘附近的文字)与细长的管线框。
+  :param symbols: 图符识别结果, None表示不遮盖
+  :param lines: 线条识别结果, None表示不遮盖
+  :return: (N, 4)需要遮盖的区域
+  """
+  parts = [np.zeros((0, 4), dtype=np.float32)]
+  if symbols is not None and "symbol" in settings.OCR_GATING_MASK:
+    xyxy = symbols.xyxy
+    inset = (xyxy[:, 2:] - xyxy[:, :2]) * settings.OCR_SYMBOL_MASK_INSET
+    parts.append(np.hstack([xyxy[:, :2] + inset, xyxy[:, 2:] - inset]))
+  if lines is not None and "line" in settings.OCR_GATING_MASK:
+    xyxy = lines.xyxy
+    size = xyxy[:, 2:] - xyxy[:, :2]
+    # 拐角、斜线等接近方形的框可能覆盖旁边的文字, 不遮盖
+    thin = size.min(axis=1) * 4 <= size.max(axis=1)
+    parts.append(xyxy[thin])
+  return np.concatenate(parts)
+
+
+def _masked(img: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+  """以背景色(采样像素的中位数)遮盖各区域, 返回新的图片"""
+  h, w = img.shape[:2]
+  sample = img[::16, ::16].reshape(-1, *img.shape[2:])
+  background = np.median(sample, axis=0).astype(img.dtype)
+  boxes = np.clip(np.round(boxes), 0, [w, h, w, h]).astype(np.int64)
+  masked = img.copy()
+  for x1, y1, x2, y2 in boxes.tolist():
+    masked[y1:y2, x1:x2] = background
+  return masked
+
+
+def _staged_supported(engine: PaddleOCR) -> bool:
+  """`_staged_ocr`依赖的PaddleOCR内部接口是否可用"""
+  if sorted_boxes is None:
+    return False
+  names = ["text_detector", "text_recognizer", "use_angle_cls", "drop_score"]
+  if getattr(engine, "use_angle_cls", False):
+    names.append("text_classifier")
+  args = getattr(engine, "args", None)
+  return all(hasattr(engine, name) for name in names) and all(
+    hasattr(args, name) for name in ("det_box_type", "cls_thresh")
+  )
+
+
+def _staged_ocr(engine: PaddleOCR, img: np.ndarray, mask: np.ndarray):
+  """
+  分步执行PaddleOCR的文字检测、方向分类与文字识别, 返回格式与
+  `PaddleOCR.ocr`相同。`mask`中的区域在检测前被遮盖, 不会检测出文字框;
+  `OCR_ANGLE_CLS`为low_confidence时先不分类识别全部文字框, 只对置信度
+  低于`OCR_ANGLE_CLS_THRESHOLD`的文字框分类, 判定为倒置的旋转后重新
+  识别, 取置信度较高的结果。
+  """
+  dt_boxes, _ = engine.text_detector(_masked(img, mask) if len(mask) else img)
+  if dt_boxes is None or not len(dt_boxes):
+    return [None]
+  dt_boxes = sorted_boxes(dt_boxes)
+  if engine.args.det_box_type == "quad":
+    crop = get_rotate_crop_image
+  else:
+    crop = get_minarea_rect_crop
+  crops = [crop(img, box.copy()) for box in dt_boxes]
+  classify = settings.OCR_ANGLE_CLS if engine.use_angle_cls else "never"
+  if classify == "always":
+    crops, _, _ = engine.text_classifier(crops)
+  rec_res, _ = engine.text_recognizer(crops)
+  if classify == "low_confidence":
+    low = [
+      i
+      for i, (_, score) in enumerate(rec_res)
+      if score < settings.OCR_ANGLE_CLS_THRESHOLD
+    ]
+    if low:
+      rotated, angles, _ = engine.text_classifier([crops[i] for i in low])
+      flipped = [
+        k
+        for k, (label, score) in enumerate(angles)
+        if "180" in label and score > engine.args.cls_thresh
+      ]
+      if flipped:
+        retry, _ = engine.text_recognizer([rotated[k] for k in flipped])
+        for k, result in zip(flipped, retry):
+          if result[1] > rec_res[low[k]][1]:
+            rec_res[low[k]] = result
+  lines = [
+    [box.tolist(), result]
+    for box, result in zip(dt_boxes, rec_res)
+    if result[1] >= engine.drop_score
+  ]
+  return [lines or None]
 
 
-def ocr(image_np: np.ndarray, lang: Optional[str] = "ch"):
+def ocr(
+  image_np: np.ndarray,
+  lang: Optional[str] = "ch",
+  mask: Optional[np.ndarray] = None,
+):
   """
   对输入的图像进行OCR识别,返回识别结果。
   :param image_np: 输入图像的numpy数组
   :param lang: 语言代码，默认为中文(ch), 可选'en'表示英文
+  :param mask: (N, 4)检测文字前遮盖的区域(如图符内部与管线), 见`ocr_mask`
   :return: OCR识别结果
   """
-  ocr_engine = get_ocr(lang)
-  ocr_result = ocr_engine.ocr(image_np, cls=True)
-  return ocr_result
+  if model_host.model_host_client is not None:
+    return model_host.model_host_client.call("ocr", image_np, lang, mask)
+  with ocr_pool.checkout(lang) as ocr_engine:
+    if mask is None and settings.OCR_ANGLE_CLS != "low_confidence":
+      return ocr_engine.ocr(image_np, cls=settings.OCR_ANGLE_CLS == "always")
+    if not _staged_supported(ocr_engine):
+      # 内部接口不可用时退回整体识别: 在遮盖后的图片上检测与识别,
+      # low_confidence按always对全部文字框分类
+      if mask is not None and len(mask):
+        image_np = _masked(image_np, mask)
+      return ocr_engine.ocr(image_np, cls=settings.OCR_ANGLE_CLS != "never")
+    if mask is None:
+      mask = np.zeros((0, 4), dtype=np.float32)
+    return _staged_ocr(ocr_engine, image_np, mask)
@@ -0,0 +1,352 @@
+"""
+图纸修订的增量识别: 保存已识别图片的灰度图与识别结果, 新版本上传后
+与旧版本逐块比较, 只识别变化的区域, 并给出相对旧结果的增删改.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .detections import Detections, TextDetections
+from .spatial import GridIndex
+from .settings import settings
+
+STAGES = ("symbol", "line", "text")
+
+
+class Revision:
+  """一张已识别图片: 灰度图(解码尺寸)与识别结果(原图坐标)"""
+
+  __slots__ = ("gray", "scale", "results", "params")
+
+  def __init__(self, gray: np.ndarray, scale: int, results: dict, params: dict):
+    self.gray = gray
+    """解码后图片的灰度图, 用于与新版本比较"""
+    self.scale = scale
+    """原图与`gray`的尺寸比例, 见`DecodedImage.scale`"""
+    self.results = results
+    """各识别阶段的结果, 与识别结果缓存中的格式相同"""
+    self.params = params
+    """识别参数(模型配置、语言、被禁用的阶段等), 增量识别沿用"""
+
+  @property
+  def nbytes(self) -> int:
+    return self.gray.nbytes + sum(
+      result.nbytes
+      for result in self.results.values()
+      if isinstance(result, Detections)
+    )
+
+
+class RevisionStore:
+  """已识别图片的内存存储, 按图片内容哈希索引, 按字节数LRU淘汰。
+
+  只在当前进程中保存, 多worker部署时增量识别请求需要落到保存了
+  旧版本的worker上(或使用单worker)。所有方法线程安全。
+  """
+
+  def __init__(self, max_bytes: int):
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries: OrderedDict[str, Revision] = OrderedDict()
+    self._size = 0
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self) -> bool:
+    return self.max_bytes > 0
+
+  def __contains__(self, image_id: str) -> bool:
+    with self._lock:
+      return image_id in self._entries
+
+  def get(self, image_id: str) -> Optional[Revision]:
+    with self._lock:
+      revision = self._entries.get(image_id)
+      if revision is None:
+        self.misses += 1
+        return None
+      self._entries.move_to_end(image_id)
+      self.hits += 1
+      return revision
+
+  def put(self, image_id: str, revision: Revision) -> None:
+    size = revision.nbytes
+    if size > self.max_bytes:
+      return
+    with self._lock:
+      old = self._entries.pop(image_id, None)
+      if old is not None:
+        self._size -= old.nbytes
+      self._entries[image_id] = revision
+      self._size += size
+      while self._size > self.max_bytes:
+        _, evicted = self._entries.popitem(last=False)
+        self._size -= evicted.nbytes
+        self.evictions += 1
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        "entries": len(self._entries),
+        "bytes": self._size,
+        "max_bytes": self.max_bytes,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+      }
+
+
+def grayscale(img: np.ndarray) -> np.ndarray:
+  """BGR图片转为灰度图, 用于保存与比较"""
+  return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def changed_regions(
+  old: np.ndarray,
+  new: np.ndarray,
+  threshold: int,
+  block: int,
+  margin: int,
+) -> List[Tuple[tuple, tuple]]:
+  """
+  比较两个版本的灰度图, 找出变化的区域。
+
+  像素差超过`threshold`的位置按`block`见方的块汇总; 相距不超过
+  `margin`的变化块合为一个区域, 区域向外扩展`margin`像素作为识别
+  范围, 使跨越变化边界的图符完整出现在识别范围内。互相重叠的识别
+  范围继续合并, 最终各区域互不重叠。
+  Returns:
+    List[Tuple[tuple, tuple]]: (变化范围, 识别范围), 均为
+      (x1, y1, x2, y2)像素坐标, 变化范围在识别范围之内。
+  """
+  h, w = new.shape[:2]
+  bw, bh = -(-w // block), -(-h // block)
+  # 补齐到块的整数倍后按块汇总, 块内任意像素变化即为变化块
+  # (按块求平均再取整会漏掉只有一两个像素变化的块)
+  mask = np.zeros((bh * block, bw * block), dtype=bool)
+  mask[:h, :w] = cv2.absdiff(old, new) > threshold
+  blocks = mask.reshape(bh, block, bw, block).any(axis=(1, 3))
+  if not blocks.any():
+    return []
+  reach = -(-margin // block)
+  kernel = np.ones((2 * reach + 1, 2 * reach + 1), dtype=np.uint8)
+  grown = cv2.dilate(blocks.astype(np.uint8), kernel)
+  count, labels = cv2.connectedComponents(grown, connectivity=8)
+  ys, xs = np.nonzero(blocks)
+  owner = labels[ys, xs]
+  cores = np.empty((count, 4), dtype=np.int64)
+  cores[:, :2] = np.iinfo(np.int64).max
+  cores[:, 2:] = -1
+  np.minimum.at(cores[:, 0], owner, xs)
+  np.minimum.at(cores[:, 1], owner, ys)
+  np.maximum.at(cores[:, 2], owner, xs + 1)
+  np.maximum.at(cores[:, 3], owner, ys + 1)
+  regions = [
+    [x1 * block, y1 * block, min(x2 * block, w), min(y2 * block, h)]
+    for x1, y1, x2, y2 in cores[1:].tolist()
+    if x2 > 0
+  ]
+  regions = [(core, _expand(core, margin, w, h)) for core in regions]
+  # 合并重叠的识别范围, 直到互不重叠
+  merged = True
+  while merged:
+    merged = False
+    for i in range(len(regions)):
+      for j in range(i + 1, len(regions)):
+        if _overlaps(regions[i][1], regions[j][1]):
+          regions[i] = (
+            _union(regions[i][0], regions[j][0]),
+            _union(regions[i][1], regions[j][1]),
+          )
+          del regions[j]
+          merged = True
+          break
+      if merged:
+        break
+  return [(tuple(core), tuple(crop)) for core, crop in regions]
+
+
+def _expand(box: list, margin: int, w: int, h: int) -> list:
+  x1, y1, x2, y2 = box
+  return [
+    max(0, x1 - margin),
+    max(0, y1 - margin),
+    min(w, x2 + margin),
+    min(h, y2 + margin),
+  ]
+
+
+def _overlaps(a: list, b: list) -> bool:
+  return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _union(a: list, b: list) -> list:
+  return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+
+def _text_lines(ocr_result: list) -> list:
+  """展平OCR识别结果为文本行列表, 跳过空结果与格式不完整的项"""
+  return [
+    line
+    for item in ocr_result
+    if item
+    for line in item
+    if len(line[1]) >= 2 and len(line[0]) >= 4
+  ]
+
+
+def _boxes(name: str, result) -> Tuple[np.ndarray, list]:
+  """识别结果的(N, 4)框与标签(图符、线条为类别名称, 文字为文本)"""
+  if name == "text":
+    texts = TextDetections.from_ocr([result])
+    return texts.xyxy, [text.strip() for text in texts.texts]
+  return result.xyxy, [result.names.get(c) for c in result.cls.tolist()]
+
+
+def _select(name: str, result, indexes) -> object:
+  if name == "text":
+    return [result[i] for i in np.asarray(indexes).tolist()]
+  return result.select(np.asarray(indexes, dtype=np.int64))
+
+
+def _concat(name: str, a, b) -> object:
+  if name == "text":
+    return a + b
+  return Detections.concatenate([a, b])
+
+
+def _inside(xyxy: np.ndarray, cores: np.ndarray) -> np.ndarray:
+  """框的中心点是否落在任一变化范围内"""
+  if not len(xyxy) or not len(cores):
+    return np.zeros(len(xyxy), dtype=bool)
+  cx = (xyxy[:, 0] + xyxy[:, 2]) / 2
+  cy = (xyxy[:, 1] + xyxy[:, 3]) / 2
+  return (
+    (cx[:, None] >= cores[None, :, 0])
+    & (cx[:, None] < cores[None, :, 2])
+    & (cy[:, None] >= cores[None, :, 1])
+    & (cy[:, None] < cores[None, :, 3])
+  ).any(axis=1)
+
+
+def match_boxes(
+  old: np.ndarray, new: np.ndarray, threshold: float
+) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  按IoU从高到低贪心配对新旧两组框, IoU不低于`threshold`才配对。
+  候选框对由网格索引找出。
+  Returns:
+    Tuple[np.ndarray, np.ndarray]: 配对的(旧框索引, 新框索引)。
+  """
+  empty = np.zeros(0, dtype=np.int64)
+  if not len(old) or not len(new):
+    return empty, empty
+  size = np.median(np.maximum(old[:, 2] - old[:, 0], old[:, 3] - old[:, 1]))
+  ni, oi = GridIndex(old, max(float(size), 1.0)).query(new)
+  a, b = old[oi], new[ni]
+  iw = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+  ih = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+  inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+  union = (
+    (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    - inter
+  )
+  iou = inter / np.maximum(union, 1e-9)
+  keep = iou >= threshold
+  order = np.argsort(-iou[keep], kind="stable")
+  old_used, new_used = set(), set()
+  pairs = []
+  for o, n in zip(oi[keep][order].tolist(), ni[keep][order].tolist()):
+    if o in old_used or n in new_used:
+      continue
+    old_used.add(o)
+    new_used.add(n)
+    pairs.append((o, n))
+  if not pairs:
+    return empty, empty
+  matched = np.asarray(pairs, dtype=np.int64)
+  return matched[:, 0], matched[:, 1]
+
+
+class StageChanges:
+  """某个识别阶段相对旧版本的变化, 各项与识别结果格式相同"""
+
+  __slots__ = ("added", "removed", "updated")
+
+  def __init__(self, added, removed, updated: list):
+    self.added = added
+    """新增的识别结果"""
+    self.removed = removed
+    """删除的识别结果"""
+    self.updated = updated
+    """(旧结果, 新结果)列表, 位置相同但类别或文本改变, 各含一项"""
+
+
+def apply_revision(
+  old: dict, partial: dict, cores: np.ndarray
+) -> Tuple[dict, Dict[str, StageChanges]]:
+  """
+  用变化区域的识别结果更新旧版本的识别结果。
+
+  中心点落在变化范围内的旧结果被新结果替换, 其余旧结果保留; 识别
+  范围中变化范围以外的新结果丢弃(该处的旧结果仍然有效)。被替换的
+  新旧结果按位置配对: 标签相同视为未变化, 标签不同为修改, 未配对的
+  为新增或删除。
+  Args:
+    old (dict): 旧版本的识别结果(原图坐标)。
+    partial (dict): 各识别范围的识别结果(原图坐标)。
+    cores (np.ndarray): (K, 4)变化范围(原图坐标)。
+  Returns:
+    Tuple[dict, Dict[str, StageChanges]]: 新版本的识别结果与各阶段的变化。
+  """
+  merged, changes = {}, {}
+  for name in STAGES:
+    before, after = old[name], partial[name]
+    if name == "text":
+      before, after = _text_lines(before), _text_lines(after)
+      # 与`ocr`返回值的格式一致: 每张图片一项
+      wrap = _wrap_lines
+    else:
+      wrap = _same
+    old_xyxy, old_labels = _boxes(name, before)
+    new_xyxy, new_labels = _boxes(name, after)
+    old_in = np.flatnonzero(_inside(old_xyxy, cores))
+    new_in = np.flatnonzero(_inside(new_xyxy, cores))
+    kept = np.setdiff1d(np.arange(len(old_xyxy)), old_in)
+    merged[name] = wrap(
+      _concat(name, _select(name, before, kept), _select(name, after, new_in))
+    )
+
+    oi, ni = match_boxes(
+      old_xyxy[old_in], new_xyxy[new_in], settings.REVISION_MATCH_IOU
+    )
+    oi, ni = old_in[oi], new_in[ni]
+    changes[name] = StageChanges(
+      wrap(_select(name, after, np.setdiff1d(new_in, ni))),
+      wrap(_select(name, before, np.setdiff1d(old_in, oi))),
+      [
+        (wrap(_select(name, before, [o])), wrap(_select(name, after, [n])))
+        for o, n in zip(oi.tolist(), ni.tolist())
+        if old_labels[o] != new_labels[n]
+      ],
+    )
+  return merged, changes
+
+
+def _wrap_lines(lines: list) -> list:
+  return [lines]
+
+
+def _same(result):
+  return result
+
+
+revision_store = RevisionStore(settings.REVISION_STORE_MAX_BYTES)
+"""全局已识别图片存储"""
@@ -30,6 +30,313 @@ class Settings:
     )  # 秒
     """服务器发送事件(SSE)的间隔时间,单位为秒"""
 
+    self.SERVER_SEND_EVENTS_MODE = os.getenv(
+      "SERVER_SEND_EVENTS_MODE", "stream"
+    ).lower()
+    """SSE推送方式: stream(逐条立即推送)、paced(按间隔逐条推送)、
+    batch(批量推送)"""
+
+    self.SERVER_SEND_EVENTS_BATCH_SIZE = int(
+      os.getenv("SERVER_SEND_EVENTS_BATCH_SIZE", 50)
+    )
+    """批量推送时每个`batch`事件最多包含的识别结果数量"""
+
+    self.SERVER_SEND_EVENTS_BATCH_LATENCY = float(
+      os.getenv("SERVER_SEND_EVENTS_BATCH_LATENCY", 0.05)
+    )
+    """批量推送时缓冲区最长等待时间,单位为秒"""
+
+    self.INFERENCE_EXECUTOR_WORKERS = int(
+      os.getenv("INFERENCE_EXECUTOR_WORKERS", 3)
+    )
+    """推理线程池大小, 默认3(符号、线条、文字三个阶段并行)"""
+
+    self.YOLO_BATCH_MAX_SIZE = int(os.getenv("YOLO_BATCH_MAX_SIZE", 4))
+    """YOLO动态微批处理每批最多图片数量, 不大于1时禁用批处理"""
+
+    self.YOLO_BATCH_MAX_WAIT = float(os.getenv("YOLO_BATCH_MAX_WAIT", 0.01))
+    """YOLO动态微批处理收集一个批次的最长等待时间,单位为秒"""
+
+    self.YOLO_MIN_CONFIDENCE = float(os.getenv("YOLO_MIN_CONFIDENCE", 0))
+    """推送图符与线条的最低置信度, 低于该值的识别结果不推送, 0表示不过滤"""
+
+    self.OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", 0))
+    """推送文字的最低置信度, 低于该值的识别结果不推送, 0表示不过滤"""
+
+    self.IMAGE2HMI_TILED = os.getenv("IMAGE2HMI_TILED", "false").lower() in (
+      "1",
+      "true",
+      "yes",
+    )
+    """/image2hmi 默认是否启用切片推理(适合尺寸很大、符号很小的图纸)"""
+
+    self.IMAGE2HMI_ADAPTIVE = os.getenv(
+      "IMAGE2HMI_ADAPTIVE", "false"
+    ).lower() in ("1", "true", "yes")
+    """/image2hmi 默认是否按图片内容自适应选择整图或切片推理, 并在没有
+    管线时跳过线条模型"""
+
+    self.ADAPTIVE_PREPASS_SIZE = int(os.getenv("ADAPTIVE_PREPASS_SIZE", 320))
+    """自适应推理时整图预识别图符的输入尺寸,单位为像素; 固定输入尺寸的
+    ONNX模型忽略该配置, 按导出时的尺寸预识别"""
+
+    self.ADAPTIVE_MIN_SYMBOL_SIZE = float(
+      os.getenv("ADAPTIVE_MIN_SYMBOL_SIZE", 24)
+    )
+    """自适应推理时预识别结果直接作为结果的图符边长下限(缩放到预识别
+    尺寸后的像素), 预识别的图符更小时按模型输入尺寸整图或切片推理"""
+
+    self.ADAPTIVE_MAX_WHOLE_SYMBOLS = int(
+      os.getenv("ADAPTIVE_MAX_WHOLE_SYMBOLS", 150)
+    )
+    """自适应推理时预识别结果直接作为结果的图符数量上限"""
+
+    self.ADAPTIVE_MIN_LINE_RATIO = float(
+      os.getenv("ADAPTIVE_MIN_LINE_RATIO", 0.002)
+    )
+    """自适应推理时长直线像素比例低于该值的图片不识别线条"""
+
+    self.YOLO_TILE_SIZE = int(os.getenv("YOLO_TILE_SIZE", 640))
+    """切片推理的切片边长,单位为像素, 默认与YOLO输入尺寸相同"""
+
+    self.YOLO_TILE_OVERLAP = float(os.getenv("YOLO_TILE_OVERLAP", 0.2))
+    """相邻切片的重叠比例"""
+
+    self.YOLO_TILE_MERGE_THRESHOLD = float(
+      os.getenv("YOLO_TILE_MERGE_THRESHOLD", 0.6)
+    )
+    """合并切片结果时, 同类别框的交集占较小框面积超过该比例视为重复"""
+
+    self.YOLO_TILE_MAX_INFLIGHT = int(os.getenv("YOLO_TILE_MAX_INFLIGHT", 16))
+    """每张图片同时提交推理的切片数量上限, 限制超大图片的内存占用"""
+
+    self.IMAGE2HMI_MERGE_LINES = os.getenv(
+      "IMAGE2HMI_MERGE_LINES", "false"
+    ).lower() in ("1", "true", "yes")
+    """/image2hmi 默认是否将线条矢量化为管线折线, 每条管线推送一个事件"""
+
+    self.LINE_MERGE_GAP = float(os.getenv("LINE_MERGE_GAP", 10))
+    """线条矢量化时合并线段、连接拐角与吸附图符的最大间隙,单位为像素"""
+
+    self.IMAGE2HMI_BIND_TEXTS = os.getenv(
+      "IMAGE2HMI_BIND_TEXTS", "false"
+    ).lower() in ("1", "true", "yes")
+    """/image2hmi 默认是否将文字(位号)绑定到所标注的图符, 随`symbol`事件推送"""
+
+    self.TEXT_BIND_DISTANCE = float(os.getenv("TEXT_BIND_DISTANCE", 30))
+    """文字框与图符框的距离不超过该值时才绑定,单位为像素"""
+
+    self.YOLO_FUSED = os.getenv("YOLO_FUSED", "false").lower() in (
+      "1",
+      "true",
+      "yes",
+    )
+    """图符与线条模型是否共用一次预处理(letterbox与张量转换), 同时识别
+    图符与线条时两个模型并行推理同一个输入张量"""
+
+    self.YOLO_BACKEND = os.getenv("YOLO_BACKEND", "torch").lower()
+    """YOLO推理后端: torch(ultralytics/PyTorch)、onnx(ONNX Runtime)"""
+
+    self.YOLO_ONNX_INT8 = os.getenv("YOLO_ONNX_INT8", "false").lower() in (
+      "1",
+      "true",
+      "yes",
+    )
+    """ONNX后端是否加载INT8量化模型"""
+
+    self.ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", 0))
+    """ONNX Runtime单个算子内的线程数, 0表示由ONNX Runtime决定"""
+
+    self.ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", 1))
+    """ONNX Runtime算子间并行的线程数"""
+
+    self.ONNX_PROVIDERS = [
+      p.strip()
+      for p in os.getenv("ONNX_PROVIDERS", "CPUExecutionProvider").split(",")
+      if p.strip()
+    ]
+    """ONNX Runtime执行提供者, 按优先级排列, 如
+    OpenVINOExecutionProvider,CPUExecutionProvider"""
+
+    self.MODEL_HOST_SOCKET = os.getenv("MODEL_HOST_SOCKET", "")
+    """模型宿主进程的Unix socket路径, 设置后各worker不再自行加载模型,
+    而是通过该socket调用`python -m app.core.model_host`进程推理"""
+
+    self.MODEL_HOST_AUTHKEY = os.getenv("MODEL_HOST_AUTHKEY", "").encode(
+      "utf-8"
+    )
+    """worker与模型宿主进程之间连接认证的密钥, 模型宿主模式下必须设置;
+    由`python -m app.core.model_host <命令>`启动时未设置则随机生成"""
+
+    self.MODEL_HOST_CONNECT_TIMEOUT = float(
+      os.getenv("MODEL_HOST_CONNECT_TIMEOUT", 300)
+    )
+    """连接模型宿主进程的最长等待时间(宿主进程可能仍在加载模型),单位为秒"""
+
+    self.OCR_MAX_LANGUAGES = int(os.getenv("OCR_MAX_LANGUAGES", 2))
+    """最多常驻内存的OCR语言数量, 超出时按LRU淘汰"""
+
+    self.OCR_INSTANCES_PER_LANGUAGE = int(
+      os.getenv("OCR_INSTANCES_PER_LANGUAGE", 1)
+    )
+    """每种OCR语言最多创建的实例数量, 同一语言的请求可以并行处理"""
+
+    self.OCR_PRELOAD_LANGS = [
+      lang.strip()
+      for lang in os.getenv("OCR_PRELOAD_LANGS", "").split(",")
+      if lang.strip()
+    ]
+    """启动时预加载并预热的OCR语言, 逗号分隔, 如`ch,en`"""
+
+    self.OCR_ANGLE_CLS = os.getenv("OCR_ANGLE_CLS", "always").lower()
+    """文字方向分类: always(每个文字框都分类)、never(不分类, 不加载分类
+    模型)、low_confidence(只对识别置信度较低的文字框分类并重新识别)"""
+
+    self.OCR_ANGLE_CLS_THRESHOLD = float(
+      os.getenv("OCR_ANGLE_CLS_THRESHOLD", 0.9)
+    )
+    """`OCR_ANGLE_CLS`为low_confidence时, 识别置信度低于该值的文字框
+    才做方向分类"""
+
+    self.OCR_REC_BATCH_SIZE = int(os.getenv("OCR_REC_BATCH_SIZE", 6))
+    """文字识别每批的文字框数量(PaddleOCR的`rec_batch_num`)"""
+
+    self.OCR_GATING = os.getenv("OCR_GATING", "false").lower() in (
+      "1",
+      "true",
+      "yes",
+    )
+    """/image2hmi 的文字识别是否等待图符与线条识别完成, 遮盖图符内部与
+    管线区域后再检测文字"""
+
+    self.OCR_GATING_MASK = [
+      kind.strip()
+      for kind in os.getenv("OCR_GATING_MASK", "symbol,line").split(",")
+      if kind.strip()
+    ]
+    """`OCR_GATING`时遮盖的区域, 逗号分隔: symbol(图符内部)、line(管线)"""
+
+    self.OCR_SYMBOL_MASK_INSET = float(os.getenv("OCR_SYMBOL_MASK_INSET", 0.15))
+    """遮盖图符内部时每边向内收缩的比例, 保留图符边缘附近的文字"""
+
+    self.IMAGE2HMI_PROGRESSIVE = os.getenv(
+      "IMAGE2HMI_PROGRESSIVE", "false"
+    ).lower() in ("1", "true", "yes")
+    """/image2hmi 默认是否启用渐进式推送(各识别阶段完成即推送)"""
+
+    self.IMAGE2HMI_STATS_EVENT = os.getenv(
+      "IMAGE2HMI_STATS_EVENT", "false"
+    ).lower() in ("1", "true", "yes")
+    """/image2hmi 默认是否在`done`事件之前推送各阶段耗时的`stats`事件"""
+
+    self.REVISION_STORE_MAX_BYTES = int(
+      os.getenv("REVISION_STORE_MAX_BYTES", 128 * 1024 * 1024)
+    )
+    """增量识别保存已识别图片(灰度图与识别结果)的内存上限,单位为字节,
+    为0时不保存, 不能增量识别"""
+
+    self.REVISION_DIFF_THRESHOLD = int(os.getenv("REVISION_DIFF_THRESHOLD", 40))
+    """增量识别时灰度差超过该值的像素视为变化(0~255), 用于忽略压缩噪声"""
+
+    self.REVISION_BLOCK_SIZE = int(os.getenv("REVISION_BLOCK_SIZE", 32))
+    """增量识别比较两个版本时的块大小,单位为像素"""
+
+    self.REVISION_MARGIN = int(os.getenv("REVISION_MARGIN", 64))
+    """变化区域向外扩展的识别范围,单位为像素, 应大于最大图符的一半"""
+
+    self.REVISION_MAX_CHANGED_RATIO = float(
+      os.getenv("REVISION_MAX_CHANGED_RATIO", 0.5)
+    )
+    """识别范围超过整图面积的该比例时改为识别整图"""
+
+    self.REVISION_MATCH_IOU = float(os.getenv("REVISION_MATCH_IOU", 0.5))
+    """新旧识别结果的IoU不低于该值时视为同一位置的结果"""
+
+    self.RESULT_CACHE_MAX_BYTES = int(
+      os.getenv("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+    )
+    """识别结果缓存内存层上限,单位为字节, 为0时禁用内存层"""
+
+    cache_dir = os.getenv("RESULT_CACHE_DIR", "")
+    self.RESULT_CACHE_DIR = Path(cache_dir) if cache_dir else None
+    """识别结果缓存磁盘层目录, 为空时禁用磁盘层"""
+
+    self.RESULT_CACHE_DISK_MAX_BYTES = int(
+      os.getenv("RESULT_CACHE_DISK_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+    )
+    """识别结果缓存磁盘层上限,单位为字节, 为0时不限制"""
+
+    self.ADMISSION_MAX_CONCURRENT = int(
+      os.getenv("ADMISSION_MAX_CONCURRENT", 4)
+    )
+    """每个进程同时推理的请求数量上限, 超出的请求排队, 0表示不限制"""
+
+    self.ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 16))
+    """排队等待推理的请求数量上限, 队列已满时返回429"""
+
+    self.ADMISSION_QUEUE_TIMEOUT = float(
+      os.getenv("ADMISSION_QUEUE_TIMEOUT", 30)
+    )
+    """请求最长排队时间,单位为秒, 超时返回503"""
+
+    self.BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 500))
+    """批量任务最多包含的图片数量(含zip中的图片)"""
+
+    self.BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", 1024 * 1024 * 1024))
+    """批量任务中图片(zip中的图片按解压后计算)的总大小上限,单位为字节"""
+
+    self.BATCH_JOB_CONCURRENCY = int(os.getenv("BATCH_JOB_CONCURRENCY", 8))
+    """批量任务中同时处理的图片数量, 多张图片的推理合并为批量推理"""
+
+    self.BATCH_JOB_MAX_JOBS = int(os.getenv("BATCH_JOB_MAX_JOBS", 20))
+    """内存中最多保留的批量任务数量, 超出时删除最早结束的任务"""
+
+    self.IMAGE2HMI_JOBS = os.getenv("IMAGE2HMI_JOBS", "false").lower() in (
+      "1",
+      "true",
+      "yes",
+    )
+    """/image2hmi 默认是否以后台任务方式识别, 返回任务ID而非SSE流"""
+
+    job_db = os.getenv("JOB_DB_PATH", "")
+    self.JOB_DB_PATH = (
+      Path(job_db)
+      if job_db
+      else Path(__file__).parent.parent.parent / "data/jobs.sqlite3"
+    )
+    """识别任务事件日志的SQLite数据库文件, 多个worker进程共用"""
+
+    self.JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+    """每个进程中同时执行的识别任务数量"""
+
+    self.JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", 64))
+    """每个进程中最多排队的识别任务数量, 超出时返回429"""
+
+    self.JOB_RETENTION = float(os.getenv("JOB_RETENTION", 24 * 3600))
+    """识别任务结束后事件日志的保留时间,单位为秒"""
+
+    self.JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+    """读取其它worker进程中的任务时查询新事件的间隔,单位为秒"""
+
+    self.JOB_HEARTBEAT_TIMEOUT = float(os.getenv("JOB_HEARTBEAT_TIMEOUT", 60))
+    """执行任务的进程超过该时间没有更新心跳时, 其未完成的任务视为中断,
+    单位为秒; 心跳每隔该时间的1/4更新一次"""
+
+    self.IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 10 * 1024 * 1024))
+    """上传图片文件大小上限,单位为字节"""
+
+    self.IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 100_000_000))
+    """图片像素数上限, 解码前根据文件头校验, 避免为超大图片分配内存"""
+
+    self.IMAGE_DECODE_MAX_SIDE = int(os.getenv("IMAGE_DECODE_MAX_SIDE", 0))
+    """解码后图片最长边上限, 超出时按1/2、1/4、1/8缩小解码, 0表示不缩小"""
+
+    self.UPLOAD_BUFFER_POOL_BYTES = int(
+      os.getenv("UPLOAD_BUFFER_POOL_BYTES", 32 * 1024 * 1024)
+    )
+    """空闲的上传缓冲区总大小上限,单位为字节; 缓冲区按上传文件的大小
+    分配, 用完后在该上限内保留以供复用"""
+
     self.MODEL_PATH = (
       Path(__file__).parent.parent.parent / "models/hollysys-hmi.pt"
     )
@@ -40,11 +347,62 @@ class Settings:
     )
     """YOLO线条/管道识别模型文件路径"""
 
+    models = self.MODEL_PATH.parent
+    self.MODEL_PROFILES = {"standard": models, "dcs": models / "dcs"}
+    """模型配置名称到模型目录, 目录中包含与`MODEL_PATH`、`MODEL_LINE_PATH`
+    同名的图符与线条模型; 可通过`MODEL_PROFILES`环境变量追加或覆盖,
+    格式为`名称=目录,名称=目录`, 相对路径相对于项目根目录"""
+    for item in os.getenv("MODEL_PROFILES", "").split(","):
+      name, _, path = item.partition("=")
+      if name.strip() and path.strip():
+        self.MODEL_PROFILES[name.strip()] = models.parent / path.strip()
+
+    self.MODEL_PROFILE_DEFAULT = os.getenv("MODEL_PROFILE_DEFAULT", "standard")
+    """未指定`profile`参数时使用的模型配置"""
+
+    self.MODEL_PRELOAD_PROFILES = [
+      name.strip()
+      for name in os.getenv(
+        "MODEL_PRELOAD_PROFILES", self.MODEL_PROFILE_DEFAULT
+      ).split(",")
+      if name.strip()
+    ]
+    """启动时预加载的模型配置, 逗号分隔, 默认只预加载默认配置,
+    其它配置在第一次使用时加载"""
+
+    self.MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", 0))
+    """常驻内存的YOLO模型大小上限(按模型文件大小估算),单位为MB, 超出时
+    淘汰最久未使用且没有请求在用的模型配置, 0表示不限制"""
+
     self.SYMBOL_MAPPING_PATH = (
       Path(__file__).parent.parent.parent / "hmi-symbol-mapping.json"
     )
     """HMI符号映射文件路径"""
 
+    root = Path(__file__).parent.parent.parent
+    self.SYMBOL_MAPPING_PROFILES = {
+      "standard": self.SYMBOL_MAPPING_PATH,
+      "dcs": root / "hmi-symbol-mapping.dcs.json",
+    }
+    """符号映射配置名称到映射文件路径, 可通过`SYMBOL_MAPPING_PROFILES`
+    环境变量追加或覆盖, 格式为`名称=路径,名称=路径`, 相对路径相对于
+    项目根目录"""
+    for item in os.getenv("SYMBOL_MAPPING_PROFILES", "").split(","):
+      name, _, path = item.partition("=")
+      if name.strip() and path.strip():
+        self.SYMBOL_MAPPING_PROFILES[name.strip()] = root / path.strip()
+
+    self.SYMBOL_MAPPING_DEFAULT = os.getenv(
+      "SYMBOL_MAPPING_DEFAULT", "standard"
+    )
+    """未指定`mapping`参数时使用的符号映射配置"""
+
+    self.SYMBOL_MAPPING_RELOAD_INTERVAL = float(
+      os.getenv("SYMBOL_MAPPING_RELOAD_INTERVAL", 2)
+    )
+    """检查符号映射文件是否修改的间隔,单位为秒, 修改后自动重新加载,
+    0表示不检查"""
+
 
 settings = Settings()
 """应用程序设置实例"""
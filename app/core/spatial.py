@@ -0,0 +1,129 @@
+"""
+空间索引: 在大量矩形框中快速找出互相靠近的框, 以及连通分组.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+# 网格坐标编码为一个int64: (x + _OFFSET) * _STRIDE + (y + _OFFSET)
+_OFFSET = 1 << 20
+_STRIDE = 1 << 21
+
+
+def _cell_keys(boxes: np.ndarray, cell: float) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  计算每个框覆盖的全部网格。
+  Returns:
+    Tuple[np.ndarray, np.ndarray]: (网格编码, 框索引), 一个框覆盖多个
+      网格时出现多次。
+  """
+  lo = np.floor(boxes[:, :2] / cell).astype(np.int64)
+  hi = np.floor(boxes[:, 2:] / cell).astype(np.int64)
+  nx = hi[:, 0] - lo[:, 0] + 1
+  ny = hi[:, 1] - lo[:, 1] + 1
+  counts = nx * ny
+  index = np.repeat(np.arange(len(boxes)), counts)
+  # 每个框内部的网格序号, 按行展开为(x, y)
+  offsets = np.arange(counts.sum()) - np.repeat(
+    np.cumsum(counts) - counts, counts
+  )
+  cx = lo[index, 0] + offsets % nx[index]
+  cy = lo[index, 1] + offsets // nx[index]
+  return (cx + _OFFSET) * _STRIDE + (cy + _OFFSET), index
+
+
+class GridIndex:
+  """均匀网格空间索引。
+
+  每个框登记到它覆盖的所有边长为`cell`的网格中; 查询时只返回与查询框
+  落在同一网格中的候选框, 不必两两比较。候选框只保证网格相交,
+  调用方需要再按实际几何关系过滤。`cell`取框的典型尺寸时效果最好。
+  """
+
+  def __init__(self, boxes: np.ndarray, cell: float):
+    """
+    Args:
+      boxes (np.ndarray): (N, 4)的框, 左上角与右下角坐标。
+      cell (float): 网格边长, 大于0。
+    """
+    self.boxes = boxes
+    self.cell = float(cell)
+    keys, index = _cell_keys(boxes, self.cell)
+    order = np.argsort(keys, kind="stable")
+    self._keys = keys[order]
+    self._index = index[order]
+
+  def __len__(self) -> int:
+    return len(self.boxes)
+
+  def query(self, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    找出与`boxes`中每个框落在同一网格的已登记框。
+    Returns:
+      Tuple[np.ndarray, np.ndarray]: (查询框索引, 登记框索引), 每对只
+        出现一次。
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    if not len(boxes) or not len(self):
+      return empty, empty
+    keys, query = _cell_keys(boxes, self.cell)
+    start = np.searchsorted(self._keys, keys, side="left")
+    counts = np.searchsorted(self._keys, keys, side="right") - start
+    query = np.repeat(query, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(
+      np.cumsum(counts) - counts, counts
+    )
+    found = self._index[np.repeat(start, counts) + offsets]
+    # 两个框同时覆盖多个网格时去重
+    pairs = np.unique(query * len(self) + found)
+    return pairs // len(self), pairs % len(self)
+
+  def pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    已登记框中两两落在同一网格的组合。
+    Returns:
+      Tuple[np.ndarray, np.ndarray]: (i, j), 满足i < j。
+    """
+    i, j = self.query(self.boxes)
+    keep = i < j
+    return i[keep], j[keep]
+
+
+def box_distance(a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  两组框之间水平与垂直方向的间隙, 重叠的方向为0。
+  Args:
+    a, b (np.ndarray): 形状相同的(N, 4)框。
+  Returns:
+    Tuple[np.ndarray, np.ndarray]: (dx, dy)。
+  """
+  dx = np.maximum(0, np.maximum(a[:, 0] - b[:, 2], b[:, 0] - a[:, 2]))
+  dy = np.maximum(0, np.maximum(a[:, 1] - b[:, 3], b[:, 1] - a[:, 3]))
+  return dx, dy
+
+
+def connected_components(n: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+  """
+  并查集: 按边(i, j)将n个节点分组。
+  Returns:
+    np.ndarray: (n,)分组编号, 从0开始连续编号, 按每组最小的节点排序。
+  """
+  parent = list(range(n))
+
+  def find(x: int) -> int:
+    while parent[x] != x:
+      parent[x] = parent[parent[x]]
+      x = parent[x]
+    return x
+
+  for a, b in zip(i.tolist(), j.tolist()):
+    ra, rb = find(a), find(b)
+    if ra != rb:
+      # 保留较小的根, 分组编号与节点顺序一致
+      if ra < rb:
+        parent[rb] = ra
+      else:
+        parent[ra] = rb
+  roots = np.fromiter((find(x) for x in range(n)), dtype=np.int64, count=n)
+  return np.unique(roots, return_inverse=True)[1].reshape(-1)
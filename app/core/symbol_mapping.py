@@ -0,0 +1,235 @@
+"""
+符号映射: YOLO类别名称到HMI符号的映射, 支持多套映射配置(如标准图符与
+DCS图符)按请求选择, 映射文件修改后自动重新加载, 不需要重启服务.
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .encoding import dumps
+from .metrics import Counter
+from .settings import settings
+
+mapping_reloads = Counter(
+  "hmi_symbol_mapping_reloads_total",
+  "符号映射文件重新加载次数, result为ok或error(文件无效, 继续使用旧映射)",
+  ["profile", "result"],
+)
+
+
+class ClassLookup:
+  """某个模型全部类别的映射结果, 按类别ID索引"""
+
+  __slots__ = ("names", "payloads", "encoded", "mapped")
+
+  def __init__(
+    self,
+    names: List[Optional[str]],
+    payloads: List[Any],
+    encoded: List[Optional[bytes]],
+  ):
+    self.names = names
+    """类别ID到类别名称"""
+    self.payloads = payloads
+    """类别ID到HMI符号, 未配置映射的类别为None"""
+    self.encoded = encoded
+    """类别ID到预先编码为JSON的HMI符号"""
+    self.mapped = np.array([p is not None for p in payloads], dtype=bool)
+    """类别ID是否配置了映射, 用于批量过滤"""
+
+
+class MappingIndex:
+  """一个映射文件编译后的索引, 创建后不再修改, 重新加载时整体替换。
+
+  映射内容在创建时编码一次, 生成事件时直接拼接; 每个模型的类别表
+  第一次使用时编译为按类别ID索引的`ClassLookup`。
+  """
+
+  def __init__(self, mapping: dict):
+    self.mapping = mapping
+    self.encoded = {name: dumps(value) for name, value in mapping.items()}
+    self.loaded_at = datetime.now().isoformat()
+    self._lookups: Dict[tuple, ClassLookup] = {}
+
+  def to_hmi_symbol(self, name: str) -> Optional[Any]:
+    flag = self.mapping.get(name, None)
+    if flag is None:
+      print(f"未找到名称: {name}")
+    return flag
+
+  def lookup(self, names: Dict[int, str]) -> ClassLookup:
+    """
+    一次性映射模型的全部类别, 结果按类别表缓存, 未配置映射的类别
+    只提示一次。
+    Args:
+      names (Dict[int, str]): 类别ID到类别名称的映射。
+    """
+    key = tuple(names.items())
+    lookup = self._lookups.get(key)
+    if lookup is None:
+      lookup = self._lookups[key] = self._compile(names)
+    return lookup
+
+  def _compile(self, names: Dict[int, str]) -> ClassLookup:
+    size = max(names, default=-1) + 1
+    labels = [names.get(i) for i in range(size)]
+    payloads = [
+      None if name is None else self.to_hmi_symbol(name) for name in labels
+    ]
+    encoded = [
+      None if payload is None else self.encoded[name]
+      for name, payload in zip(labels, payloads)
+    ]
+    return ClassLookup(labels, payloads, encoded)
+
+  def precompile(self, previous: "MappingIndex") -> None:
+    """编译`previous`中已使用过的类别表, 替换后的第一个请求不必再编译"""
+    for key in list(previous._lookups):
+      self.lookup(dict(key))
+
+
+class SymbolMapper:
+  """一套符号映射配置, 对应一个映射文件。
+
+  `reload_if_changed`检查到文件修改后在调用线程中加载并编译新索引,
+  完成后一次赋值替换`index`; 正在生成事件的请求继续使用各自取得的
+  旧索引, 不需要加锁。
+  """
+
+  def __init__(self, mapping_path: Path, profile: str = "standard"):
+    self.path = Path(mapping_path)
+    self.profile = profile
+    self._stat = self._file_stat()
+    self.index = MappingIndex(self._load_mapping(self.path))
+
+  @property
+  def mapping(self) -> dict:
+    return self.index.mapping
+
+  @property
+  def encoded(self) -> Dict[str, bytes]:
+    return self.index.encoded
+
+  def _load_mapping(self, path: Path) -> dict:
+    try:
+      return self._read(path)
+    except Exception as e:
+      print(f"加载符号映射文件失败: {e}")
+      return {}
+
+  @staticmethod
+  def _read(path: Path) -> dict:
+    with open(path, "r", encoding="utf-8") as file:
+      mapping = json.load(file)
+    if not isinstance(mapping, dict):
+      raise ValueError(f"{path} 的内容不是JSON对象")
+    return mapping
+
+  def _file_stat(self) -> Optional[tuple]:
+    try:
+      stat = self.path.stat()
+    except OSError:
+      return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+  def to_hmi_symbol(self, name: str) -> Optional[Any]:
+    return self.index.to_hmi_symbol(name)
+
+  def lookup(self, names: Dict[int, str]) -> ClassLookup:
+    """见`MappingIndex.lookup`"""
+    return self.index.lookup(names)
+
+  def reload_if_changed(self) -> bool:
+    """
+    映射文件修改(或被删除后重新创建)时重新加载。文件无效时保留
+    当前映射, 文件再次修改后重试。
+    Returns:
+      bool: 是否替换了映射。
+    """
+    stat = self._file_stat()
+    if stat is None or stat == self._stat:
+      return False
+    self._stat = stat
+    try:
+      index = MappingIndex(self._read(self.path))
+    except Exception as e:
+      mapping_reloads.labels(self.profile, "error").inc()
+      print(f"重新加载符号映射文件失败({self.profile}): {e}")
+      return False
+    index.precompile(self.index)
+    self.index = index
+    mapping_reloads.labels(self.profile, "ok").inc()
+    print(f"已重新加载符号映射: {self.profile} ({len(index.mapping)} 项)")
+    return True
+
+  def stats(self) -> dict:
+    return {
+      "path": str(self.path),
+      "entries": len(self.index.mapping),
+      "loaded_at": self.index.loaded_at,
+    }
+
+
+class SymbolMappingRegistry:
+  """全部符号映射配置, 按名称选择"""
+
+  def __init__(self, profiles: Dict[str, Path], default: str):
+    if default not in profiles:
+      raise ValueError(f"默认符号映射 {default} 不在配置中")
+    self.default = default
+    self.mappers = {
+      name: SymbolMapper(path, name) for name, path in profiles.items()
+    }
+
+  def get(self, profile: Optional[str] = None) -> SymbolMapper:
+    """
+    取得指定名称的符号映射, 未指定时使用默认映射。
+    Raises:
+      ValueError: 名称无效。
+    """
+    mapper = self.mappers.get(profile or self.default)
+    if mapper is None:
+      raise ValueError(
+        f"无效的符号映射: {profile}, 可选值: {', '.join(self.mappers)}"
+      )
+    return mapper
+
+  def reload(self) -> List[str]:
+    """
+    重新加载已修改的映射文件。
+    Returns:
+      List[str]: 重新加载了的映射名称。
+    """
+    return [
+      name
+      for name, mapper in self.mappers.items()
+      if mapper.reload_if_changed()
+    ]
+
+  async def watch(self, interval: float) -> None:
+    """每隔`interval`秒检查一次映射文件, 文件读取与编译在线程中执行"""
+    while True:
+      await asyncio.sleep(interval)
+      try:
+        await asyncio.to_thread(self.reload)
+      except Exception as e:
+        print(f"检查符号映射文件失败: {e}")
+
+  def stats(self) -> dict:
+    return {
+      "default": self.default,
+      "profiles": {
+        name: mapper.stats() for name, mapper in self.mappers.items()
+      },
+    }
+
+
+symbol_mappings = SymbolMappingRegistry(
+  settings.SYMBOL_MAPPING_PROFILES, settings.SYMBOL_MAPPING_DEFAULT
+)
+"""全局符号映射配置"""
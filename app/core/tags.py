@@ -0,0 +1,66 @@
+"""
+位号绑定: 将OCR识别出的文字(如位号"FV-1501")关联到它所标注的图符,
+在`symbol`事件中一并推送, 客户端不必再两两比较图符与文字.
+"""
+
+from typing import List
+
+import numpy as np
+
+from .detections import Detections
+from .spatial import GridIndex, box_distance
+
+
+class TaggedDetections:
+  """图符识别结果及每个图符绑定的文字"""
+
+  __slots__ = ("detections", "tags")
+
+  def __init__(self, detections: Detections, tags: List[List[dict]]):
+    self.detections = detections
+    """图符识别结果"""
+    self.tags = tags
+    """与`detections`一一对应, 每个图符绑定的文字, 按阅读顺序排列"""
+
+  def __len__(self) -> int:
+    return len(self.detections)
+
+
+def bind_texts(
+  symbols: np.ndarray, texts: np.ndarray, distance: float
+) -> np.ndarray:
+  """
+  为每个文字框找出它所标注的图符: 框间距离不超过`distance`的图符中
+  最近的一个, 距离相同(如文字在图符内部)时取中心最近的一个。
+  图符框登记到网格索引, 每个文字框只与同一网格中的图符比较,
+  耗时与图符数和文字数之和近似成正比。
+  Args:
+    symbols (np.ndarray): (M, 4)图符框。
+    texts (np.ndarray): (N, 4)文字框。
+    distance (float): 最大距离, 单位为像素。
+  Returns:
+    np.ndarray: (N,) int64, 每个文字所属的图符索引, -1表示不属于任何图符。
+  """
+  owner = np.full(len(texts), -1, dtype=np.int64)
+  if not len(symbols) or not len(texts):
+    return owner
+  margin = np.array([-distance, -distance, distance, distance])
+  size = np.median(
+    np.maximum(symbols[:, 2] - symbols[:, 0], symbols[:, 3] - symbols[:, 1])
+  )
+  index = GridIndex(symbols + margin, max(distance, float(size), 1.0))
+  ti, si = index.query(texts)
+  dx, dy = box_distance(texts[ti], symbols[si])
+  gap = np.hypot(dx, dy)
+  keep = gap <= distance
+  ti, si, gap = ti[keep], si[keep], gap[keep]
+  centers = np.hypot(
+    (texts[ti, 0] + texts[ti, 2] - symbols[si, 0] - symbols[si, 2]) / 2,
+    (texts[ti, 1] + texts[ti, 3] - symbols[si, 1] - symbols[si, 3]) / 2,
+  )
+  # 每个文字按(距离, 中心距离)排序后取第一个候选
+  order = np.lexsort((centers, gap, ti))
+  ti, si = ti[order], si[order]
+  first = np.r_[True, ti[1:] != ti[:-1]]
+  owner[ti[first]] = si[first]
+  return owner
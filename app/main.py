@@ -1,16 +1,50 @@
 """Main entry point for the application."""
 
+import asyncio
+from contextlib import asynccontextmanager
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from .core.executor import inference_executor
+from .core.metrics import MetricsMiddleware
+from .core.model_host import model_host_client
+from .core.model_registry import model_registry
+from .core.ocr import preload_ocr
+from .core.settings import settings
+from .core.symbol_mapping import symbol_mappings
 from .routers import image2hmi, ocr, text2hmi, utils
 
 # Load environment variables
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  if model_host_client is not None and not settings.MODEL_HOST_AUTHKEY:
+    # 连接以pickle传递数据, 不能使用公开的默认密钥
+    raise RuntimeError("模型宿主模式下必须设置 MODEL_HOST_AUTHKEY")
+  if model_host_client is None:
+    # 模型宿主模式下由宿主进程预加载
+    await inference_executor.run(preload_ocr, settings.OCR_PRELOAD_LANGS)
+  # 其它模型配置在第一次使用时加载
+  await model_registry.preload(settings.MODEL_PRELOAD_PROFILES)
+  watcher = None
+  if settings.SYMBOL_MAPPING_RELOAD_INTERVAL > 0:
+    # 符号映射文件修改后自动重新加载
+    watcher = asyncio.create_task(
+      symbol_mappings.watch(settings.SYMBOL_MAPPING_RELOAD_INTERVAL)
+    )
+  yield
+  if watcher is not None:
+    watcher.cancel()
+  # 等待正在执行的推理完成后释放线程池
+  inference_executor.shutdown()
+
+
 # Initialize FastAPI app with a maximum body size of 10 MB
-app = FastAPI(max_body_size=10 * 1024 * 1024)
+app = FastAPI(max_body_size=10 * 1024 * 1024, lifespan=lifespan)
 
 app.add_middleware(
   CORSMiddleware,
@@ -19,6 +53,7 @@ app.add_middleware(
   allow_methods=["*"],
   allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Include API router
 app.include_router(text2hmi.router)
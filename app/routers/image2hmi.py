@@ -2,27 +2,364 @@
 Convert images to HMI format (router layer).
 """
 
-from typing import Optional
+import asyncio
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path
+from time import monotonic
+from typing import Callable, List, Optional
 
-from fastapi import APIRouter, File, HTTPException, UploadFile
-from fastapi.responses import StreamingResponse
+import numpy as np
+from fastapi import APIRouter, File, Header, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
 
+from app.core.adaptive import (
+  InferencePlan,
+  adaptive_options,
+  line_mode,
+  line_ratio,
+  plan_inference,
+)
+from app.core.admission import Overloaded, Ticket, admission
+from app.core.cache import cache_key, content_digest, result_cache
+from app.core.detections import Detections
+from app.core.encoding import dumps, sse_event
+from app.core.executor import InflightWork, inference_executor, inflight_work
 from app.core.image2hmi import (
+  ALLOWED_EXTENSIONS,
   HMIEventGenerator,
   ImageValidator,
-  SymbolMapper,
-  YoloModel,
+  resolve_delivery_mode,
+)
+from app.core.ingest import CHUNK_SIZE, DecodedImage, decode_image, read_upload
+from app.core.job_queue import job_queue
+from app.core.jobs import BatchFile, BatchJob, batch_jobs, job_events
+from app.core.metrics import RequestTimings, observe_events
+from app.core.model_registry import LoadedModels, model_registry, yolo_options
+from app.core.ocr import (
+  OCR_MODEL_VERSION,
+  ocr,
+  ocr_mask,
+  ocr_options,
+  scale_ocr_result,
+  shift_ocr_result,
+)
+from app.core.revisions import (
+  Revision,
+  apply_revision,
+  changed_regions,
+  grayscale,
+  revision_store,
 )
-from app.core.ocr import ocr
 from app.core.settings import settings
+from app.core.symbol_mapping import SymbolMapper, symbol_mappings
 
 router = APIRouter()
 
-# 依赖注入/单例
-symbol_mapper = SymbolMapper(settings.SYMBOL_MAPPING_PATH)
-model = YoloModel(settings.MODEL_PATH)
-line_model = YoloModel(settings.MODEL_LINE_PATH)
-event_generator = HMIEventGenerator(symbol_mapper)
+
+def _empty_results() -> dict:
+  """各识别阶段的空结果, 用于被禁用的阶段"""
+  return {"symbol": Detections.empty(), "line": Detections.empty(), "text": []}
+
+
+async def _skipped_stage(result):
+  """被禁用的识别阶段直接返回空结果"""
+  return result
+
+
+async def _restore_scale(name: str, stage, scale: int):
+  """将缩小解码的图片上的识别结果坐标还原到原图"""
+  result = await stage
+  if name == "text":
+    return scale_ocr_result(result, scale)
+  return result.rescale(scale)
+
+
+def _cache_when_complete(
+  key: str, stages: dict, on_complete: Optional[Callable] = None
+) -> dict:
+  """
+  包装渐进式推送的各识别阶段, 全部阶段成功完成后写入结果缓存,
+  并在线程中以全部结果调用`on_complete`(如有)。
+  任一阶段失败或客户端断开时不写入缓存。
+  """
+  results = _empty_results()
+  pending = set(stages)
+
+  async def wrap(name: str, stage):
+    result = await stage
+    results[name] = result
+    pending.discard(name)
+    if not pending:
+      await asyncio.to_thread(result_cache.set, key, results)
+      if on_complete is not None:
+        await asyncio.to_thread(on_complete, results)
+    return result
+
+  return {name: wrap(name, stage) for name, stage in stages.items()}
+
+
+def _hold_until_complete(build: Callable[[], dict], *holds) -> dict:
+  """
+  创建(`build()`)并以任务方式立即启动各识别阶段, 全部阶段结束(完成、
+  失败或取消)且它们提交的推理都执行完毕后, 归还推理名额与模型占用
+  (`holds`中各对象的`release`)。阶段被取消(如客户端断开)时推理线程
+  不会停止, 名额与模型要等线程执行完毕才归还; 即使SSE流没有开始迭代,
+  也会归还。
+  Returns:
+    dict: 阶段名称到任务的映射, 被禁用的阶段为None。
+  """
+
+  def release():
+    for hold in holds:
+      hold.release()
+
+  work = InflightWork(release)
+  # 阶段任务(及其创建的任务)复制当前上下文, 推理登记到`work`中
+  token = inflight_work.set(work)
+  try:
+    tasks = {
+      name: stage and asyncio.ensure_future(stage)
+      for name, stage in build().items()
+    }
+  except BaseException:
+    work.close()
+    raise
+  finally:
+    inflight_work.reset(token)
+  running = [task for task in tasks.values() if task is not None]
+  remaining = len(running)
+  if not remaining:
+    work.close()
+
+  def done(_):
+    nonlocal remaining
+    remaining -= 1
+    if not remaining:
+      work.close()
+
+  for task in running:
+    task.add_done_callback(done)
+  return tasks
+
+
+def _result_key(
+  digest: str,
+  profile: str,
+  lang: str,
+  no_ocr: bool,
+  no_symbol: bool,
+  no_line: bool,
+  tiled: bool,
+  adaptive: bool = False,
+) -> str:
+  """识别结果缓存键: 图片内容哈希、模型版本与影响识别结果的参数"""
+  return cache_key(
+    "image2hmi",
+    digest,
+    model_registry.versions[profile],
+    OCR_MODEL_VERSION,
+    None if no_ocr else lang,
+    no_ocr,
+    no_symbol,
+    no_line,
+    "adaptive" if adaptive else tiled,
+    settings.IMAGE_DECODE_MAX_SIDE,
+    None if no_ocr else ocr_options(_gated(no_symbol, no_line)),
+    None if no_symbol and no_line else yolo_options(tiled or adaptive),
+    adaptive_options() if adaptive else None,
+  )
+
+
+def _gated(no_symbol: bool, no_line: bool) -> bool:
+  """文字识别是否等待图符与线条识别完成, 遮盖其区域后识别"""
+  return settings.OCR_GATING and not (no_symbol and no_line)
+
+
+def _symbol_mapper(profile: str, mapping: Optional[str]) -> SymbolMapper:
+  """
+  请求使用的符号映射, 未指定时使用与模型配置同名的映射(如有)。
+  Raises:
+    ValueError: 符号映射名称无效。
+  """
+  if mapping is None and profile in symbol_mappings.mappers:
+    mapping = profile
+  return symbol_mappings.get(mapping)
+
+
+def _build_stages(
+  decoded: DecodedImage,
+  models: LoadedModels,
+  lang: str,
+  no_ocr: bool,
+  no_symbol: bool,
+  no_line: bool,
+  tiled: bool,
+  timings: RequestTimings,
+  plan: Optional[tuple] = None,
+) -> dict:
+  """
+  创建各识别阶段的协程, 被禁用的阶段为None。
+  符号、线条、文字三个阶段共用同一个图片数组, 各阶段耗时(含排队)
+  记入`timings`。给出`plan`(`_adaptive_plan`开始的自适应推理计划与
+  长直线比例)时按计划识别图符与线条, 忽略`tiled`, 见`_adaptive_stages`。
+  """
+  img = decoded.img
+  if plan is not None:
+    symbol, line = _adaptive_stages(plan, models, no_symbol, no_line, img)
+  elif not (no_symbol or no_line) and "fused" in models.predictors:
+    # 图符与线条共用一次预处理, 两个阶段等待同一次推理
+    pair = asyncio.ensure_future(models.predictor("fused", tiled).predict(img))
+    symbol, line = _pair_item(pair, 0), _pair_item(pair, 1)
+  else:
+    symbol = (
+      None if no_symbol else models.predictor("symbol", tiled).predict(img)
+    )
+    line = None if no_line else models.predictor("line", tiled).predict(img)
+  if no_ocr:
+    text = None
+  elif _gated(no_symbol, no_line):
+    # 图符与线条的结果同时用于推送和遮盖, 以任务方式共享
+    symbol = symbol and asyncio.ensure_future(symbol)
+    line = line and asyncio.ensure_future(line)
+    text = _gated_ocr(img, lang, symbol, line)
+  else:
+    text = inference_executor.run(ocr, img, lang)
+  stages = {"symbol": symbol, "line": line, "text": text}
+  if decoded.scale != 1:
+    stages = {
+      name: stage and _restore_scale(name, stage, decoded.scale)
+      for name, stage in stages.items()
+    }
+  return {
+    name: stage and timings.timed(name, stage) for name, stage in stages.items()
+  }
+
+
+async def _gated_ocr(
+  img: np.ndarray,
+  lang: str,
+  symbol: Optional[asyncio.Task],
+  line: Optional[asyncio.Task],
+) -> list:
+  """
+  等待图符与线条识别完成后识别文字, 检测文字前遮盖图符内部与管线区域
+  (解码尺寸的坐标)。图符或线条识别失败时不遮盖该部分, 失败由该阶段
+  自身报告。
+  """
+  tasks = [task for task in (symbol, line) if task is not None]
+  # 不用`gather`: 文字阶段被取消时不应连带取消图符与线条阶段
+  await asyncio.wait(tasks)
+  symbols, lines = (
+    None
+    if task is None or task.cancelled() or task.exception() is not None
+    else task.result()
+    for task in (symbol, line)
+  )
+  return await inference_executor.run(ocr, img, lang, ocr_mask(symbols, lines))
+
+
+def _adaptive_plan(
+  img: np.ndarray, models: LoadedModels, no_symbol: bool, no_line: bool
+) -> tuple:
+  """
+  开始低分辨率预识别图符与估计管线多少, 二者同时进行。
+  Returns:
+    tuple: (推理计划的协程, 长直线比例的future), 不识别线条时后者为None。
+  """
+  prepass = None
+  if not no_symbol:
+    # 输入尺寸与批处理中的其它图片不同, 不经过批处理
+    prepass = inference_executor.run(
+      models.models["symbol"].predict, img, settings.ADAPTIVE_PREPASS_SIZE
+    )
+  lines = None
+  if not no_line:
+    lines = asyncio.ensure_future(asyncio.to_thread(line_ratio, img))
+
+  async def plan() -> InferencePlan:
+    symbols, ratio = await asyncio.gather(
+      prepass or _skipped_stage(None),
+      _skipped_stage(None) if lines is None else asyncio.shield(lines),
+    )
+    return plan_inference(img.shape, symbols, ratio)
+
+  return plan(), lines
+
+
+def _adaptive_stages(
+  plan: tuple,
+  models: LoadedModels,
+  no_symbol: bool,
+  no_line: bool,
+  img: np.ndarray,
+) -> tuple:
+  """
+  按自适应推理计划识别图符与线条的协程, 被禁用的阶段为None。线条阶段
+  只等待长直线比例, 不跳过线条时立即推理, 与图符预识别同时进行; 图符
+  阶段等待预识别与计划。
+  Args:
+    plan (tuple): (推理计划的future, 长直线比例的future)。
+  """
+  planned, lines = plan
+
+  async def symbol() -> Detections:
+    result: InferencePlan = await asyncio.shield(planned)
+    if result.symbol == "prepass":
+      # 图符足够大: 低分辨率预识别结果即为最终结果
+      return result.prepass
+    return await models.predictor("symbol", result.symbol == "tiled").predict(
+      img
+    )
+
+  async def line() -> Detections:
+    mode = line_mode(img.shape, await asyncio.shield(lines))
+    if mode == "skip":
+      return Detections.empty()
+    return await models.predictor("line", mode == "tiled").predict(img)
+
+  return None if no_symbol else symbol(), None if no_line else line()
+
+
+async def _pair_item(pair: asyncio.Future, index: int) -> Detections:
+  """共用预处理的推理结果中的图符(0)或线条(1)部分"""
+  return (await pair)[index]
+
+
+async def _run_stages(stages: dict) -> dict:
+  """并行执行各识别阶段, 被禁用的阶段返回空结果"""
+  empty = _empty_results()
+  # 三个识别阶段在推理线程池中并行执行, 耗时为最慢的阶段而非总和
+  results = await asyncio.gather(
+    *(stage or _skipped_stage(empty[name]) for name, stage in stages.items())
+  )
+  return dict(zip(stages, results))
+
+
+def _sse_response(
+  stream, timings: RequestTimings, image_id: Optional[str] = None
+) -> StreamingResponse:
+  """
+  SSE响应: 记录各事件大小, 并以`Server-Timing`头返回已完成阶段的耗时,
+  以`X-Image-Id`头返回图片标识(增量识别时作为`base`参数)。
+  """
+  headers = {"Server-Timing": timings.server_timing()}
+  if image_id is not None:
+    headers["X-Image-Id"] = image_id
+  return StreamingResponse(
+    observe_events(stream), media_type="text/event-stream", headers=headers
+  )
+
+
+def _remember(
+  image_id: str, decoded: DecodedImage, params: dict, results: dict
+) -> None:
+  """保存已识别图片, 供增量识别与新版本比较(在线程中调用)"""
+  revision_store.put(
+    image_id,
+    Revision(grayscale(decoded.img), decoded.scale, results, params),
+  )
 
 
 @router.post("/image2hmi")
@@ -32,6 +369,16 @@ async def image2hmi(
   no_ocr: Optional[bool] = False,
   no_symbol: Optional[bool] = False,
   no_line: Optional[bool] = False,
+  progressive: Optional[bool] = None,
+  delivery: Optional[str] = None,
+  tiled: Optional[bool] = None,
+  stats: Optional[bool] = None,
+  profile: Optional[str] = None,
+  mapping: Optional[str] = None,
+  merge_lines: Optional[bool] = None,
+  bind_texts: Optional[bool] = None,
+  job: Optional[bool] = None,
+  adaptive: Optional[bool] = None,
 ):
   """
   将上传的图片转换为HMI格式。
@@ -44,12 +391,50 @@ async def image2hmi(
       no_ocr: 是否跳过OCR识别, 默认为False
       no_symbol: 是否跳过符号识别, 默认为False
       no_line: 是否跳过线条识别, 默认为False
+      progressive: 是否启用渐进式推送, 立即返回SSE流并在每个识别阶段
+        完成后立即推送该阶段的结果, 默认取`IMAGE2HMI_PROGRESSIVE`配置
+      delivery: 推送方式, 可选'stream'(逐条立即推送)、'paced'(按间隔
+        逐条推送)、'batch'(批量推送), 默认取`SERVER_SEND_EVENTS_MODE`配置
+      tiled: 是否启用切片推理, 将大图切成互相重叠的切片分别识别符号与
+        线条, 避免小图符在缩放时丢失, 默认取`IMAGE2HMI_TILED`配置
+      stats: 是否在`done`事件之前推送包含各阶段耗时的`stats`事件,
+        默认取`IMAGE2HMI_STATS_EVENT`配置
+      profile: 模型配置, 如'standard'(标准图符)、'dcs'(DCS图符),
+        默认取`MODEL_PROFILE_DEFAULT`配置
+      mapping: 符号映射配置, 默认使用与模型配置同名的符号映射,
+        没有同名映射时取`SYMBOL_MAPPING_DEFAULT`配置
+      merge_lines: 是否将线条矢量化为管线折线, 相连的线条合并为一个
+        `line`事件, 默认取`IMAGE2HMI_MERGE_LINES`配置
+      bind_texts: 是否将文字(如位号)绑定到所标注的图符, 在`symbol`事件的
+        `tags`字段中推送, 默认取`IMAGE2HMI_BIND_TEXTS`配置
+      job: 是否以后台任务方式识别, 立即返回任务ID, 通过
+        `/image2hmi/jobs/{job_id}/events`接收事件, 断线后可以凭
+        `Last-Event-ID`继续接收, 默认取`IMAGE2HMI_JOBS`配置
+      adaptive: 是否自适应推理, 整图预识别后为每张图片选择整图或切片
+        推理(忽略`tiled`), 没有管线时跳过线条模型, 所选计划以`plan`事件
+        推送, 默认取`IMAGE2HMI_ADAPTIVE`配置
   Returns:
-      StreamingResponse: 服务器发送事件(SSE)流
+      StreamingResponse: 服务器发送事件(SSE)流, `Server-Timing`响应头
+        包含返回响应前已完成的阶段耗时, `X-Image-Id`响应头为图片标识,
+        图纸修订后以该标识调用`/image2hmi/revision`增量识别。
+      推理名额已满时请求排队, 排队期间推送`queue`事件(排队位置),
+      获得名额后以渐进式推送识别结果;
+      队列已满时返回429, 排队超时推送`error`事件。
+      `job`为True时返回任务信息(JSON)
   """
+  timings = RequestTimings("image2hmi")
 
   try:
     ImageValidator.validate_file(file)
+    delivery = resolve_delivery_mode(delivery)
+    profile = model_registry.resolve(profile)
+    if merge_lines is None:
+      merge_lines = settings.IMAGE2HMI_MERGE_LINES
+    if bind_texts is None:
+      bind_texts = settings.IMAGE2HMI_BIND_TEXTS
+    event_generator = HMIEventGenerator(
+      _symbol_mapper(profile, mapping), merge_lines, bind_texts
+    )
   except ValueError as e:
     raise HTTPException(400, str(e))
   fileInfo = {
@@ -57,32 +442,639 @@ async def image2hmi(
     "content_type": file.content_type,
     "size": getattr(file, "size", None),
   }
+  if tiled is None:
+    tiled = settings.IMAGE2HMI_TILED
+  if stats is None:
+    stats = settings.IMAGE2HMI_STATS_EVENT
+  if job is None:
+    job = settings.IMAGE2HMI_JOBS
+  if adaptive is None:
+    adaptive = settings.IMAGE2HMI_ADAPTIVE
+  if job and delivery == "paced":
+    # 事件写入事件日志, 不必按间隔推送
+    delivery = "stream"
+  params = {
+    "profile": profile,
+    "lang": lang,
+    "no_ocr": no_ocr,
+    "no_symbol": no_symbol,
+    "no_line": no_line,
+    "tiled": tiled,
+    "adaptive": adaptive,
+  }
+  ticket = None
   try:
-    content = await file.read()
+    async with read_upload(file) as content:
+      digest = await timings.timed(
+        "digest", asyncio.to_thread(content_digest, content)
+      )
+      key = _result_key(digest, **params)
+      cached = await timings.timed(
+        "cache", asyncio.to_thread(result_cache.get, key)
+      )
+      if cached is not None:
+        if revision_store.enabled and digest not in revision_store:
+          # 识别结果来自缓存(如重启前的磁盘缓存), 补存增量识别所需的灰度图
+          decoded = await timings.timed(
+            "decode", inference_executor.run(decode_image, content)
+          )
+          await asyncio.to_thread(_remember, digest, decoded, params, cached)
+      elif job:
+        # 后台任务在任务队列中解码与识别, 复制上传内容
+        pending = bytes(content)
+      else:
+        ticket = admission.try_acquire()
+        if ticket is None:
+          # 需要排队: 复制上传内容, 排队期间不占用上传缓冲区
+          pending = bytes(content)
+        else:
+          try:
+            # 解码后的图片不再引用上传缓冲区, 退出上下文后缓冲区即可复用
+            decoded = await timings.timed(
+              "decode", inference_executor.run(decode_image, content)
+            )
+          except BaseException:
+            ticket.release()
+            raise
+  except Overloaded as e:
+    raise HTTPException(e.status, str(e), headers=e.headers)
+  except ValueError as e:
+    # 文件过大、尺寸过大或无法解码
+    raise HTTPException(400, f"图像解码失败: {str(e)}")
   except Exception as e:
     raise HTTPException(500, f"文件读取失败: {str(e)}")
+
+  def replay():
+    """命中缓存: 不解码图片也不调用模型, 直接重放识别结果"""
+    return event_generator.generate(
+      cached["symbol"],
+      cached["line"],
+      cached["text"],
+      fileInfo,
+      lang,
+      delivery,
+      timings,
+      stats,
+    )
+
+  if cached is not None and not job:
+    return _sse_response(replay(), timings, digest)
+
+  async def start_stages(decoded: DecodedImage, ticket: Ticket) -> dict:
+    try:
+      lease = await timings.timed("model", model_registry.acquire(profile))
+    except BaseException:
+      ticket.release()
+      raise
+
+    def build() -> dict:
+      plan = None
+      if adaptive and not (no_symbol and no_line):
+        prepare, lines = _adaptive_plan(
+          decoded.img, lease.models, no_symbol, no_line
+        )
+        plan = (asyncio.ensure_future(timings.timed("plan", prepare)), lines)
+        # 计划确定后推送`plan`事件, 不阻塞开始事件与识别结果
+        event_generator.plan = plan[0]
+      return _build_stages(
+        decoded,
+        lease.models,
+        lang,
+        no_ocr,
+        no_symbol,
+        no_line,
+        tiled,
+        timings,
+        plan,
+      )
+
+    return _hold_until_complete(build, ticket, lease)
+
+  def progressive_events(stages: dict, decoded: DecodedImage):
+    remember = None
+    if revision_store.enabled:
+
+      def remember(results: dict) -> None:
+        _remember(digest, decoded, params, results)
+
+    return event_generator.generate_progressive(
+      _cache_when_complete(
+        key,
+        {name: stage for name, stage in stages.items() if stage is not None},
+        remember,
+      ),
+      fileInfo,
+      lang,
+      delivery,
+      timings,
+      stats,
+    )
+
+  async def queued_events(bounded: bool = True):
+    """排队期间推送`queue`事件, 获得名额后渐进式推送识别结果"""
+    queued_at = monotonic()
+    ticket = None
+    try:
+      try:
+        ticket = admission.enqueue(bounded)
+        async for position in ticket.wait():
+          yield sse_event("queue", dumps({"position": position}))
+        timings.record("queue", monotonic() - queued_at)
+        decoded = await timings.timed(
+          "decode", inference_executor.run(decode_image, pending)
+        )
+      except Overloaded as e:
+        yield sse_event("error", str(e))
+        return
+      except ValueError as e:
+        yield sse_event("error", f"图像解码失败: {str(e)}")
+        return
+      # 名额交给识别阶段, 推理执行完毕后归还(`start_stages`失败时立即归还)
+      admitted, ticket = ticket, None
+      try:
+        stages = await start_stages(decoded, admitted)
+      except Exception as e:
+        yield sse_event("error", f"模型加载失败: {str(e)}")
+        return
+      async for msg in progressive_events(stages, decoded):
+        yield msg
+    finally:
+      # 获得名额前客户端断开或出错时离开队列、归还名额
+      if ticket is not None:
+        ticket.release()
+
+  if job:
+
+    def _job_stream():
+      if cached is not None:
+        return replay()
+      # 同时执行的任务数由任务队列控制, 排队不受准入队列长度与期限限制
+      return queued_events(bounded=False)
+
+    try:
+      job_id = await job_queue.submit(file.filename, _job_stream)
+    except Overloaded as e:
+      raise HTTPException(e.status, str(e), headers=e.headers)
+    return JSONResponse(
+      {
+        "id": job_id,
+        "status": "queued",
+        "events": f"/image2hmi/jobs/{job_id}/events",
+      },
+      headers={"X-Image-Id": digest},
+    )
+  if ticket is None:
+    return _sse_response(queued_events(), timings, digest)
   try:
-    img = ImageValidator.read_image_bytes(content)
+    stages = await start_stages(decoded, ticket)
   except Exception as e:
-    raise HTTPException(400, f"图像解码失败: {str(e)}")
+    raise HTTPException(500, f"模型加载失败: {str(e)}")
+  if progressive is None:
+    progressive = settings.IMAGE2HMI_PROGRESSIVE
+  if progressive:
+    # 渐进式: 推理在SSE流开始后进行, 推理失败通过`error`事件通知
+    return _sse_response(progressive_events(stages, decoded), timings, digest)
   try:
-    if no_symbol:
-      symbol_results = []
-    else:
-      symbol_results = model.predict(img)
-    if no_line:
-      line_results = []
-    else:
-      line_results = line_model.predict(img)
-    if no_ocr:
-      text_results = []
-    else:
-      text_results = ocr(img, lang=lang)
+    results = await _run_stages(stages)
   except Exception as e:
     raise HTTPException(500, f"模型推理失败: {str(e)}")
-  return StreamingResponse(
+  await asyncio.to_thread(result_cache.set, key, results)
+  if revision_store.enabled:
+    await asyncio.to_thread(_remember, digest, decoded, params, results)
+  return _sse_response(
     event_generator.generate(
-      symbol_results, line_results, text_results, fileInfo, lang
+      results["symbol"],
+      results["line"],
+      results["text"],
+      fileInfo,
+      lang,
+      delivery,
+      timings,
+      stats,
     ),
+    timings,
+    digest,
+  )
+
+
+async def _get_image_job(job_id: str) -> dict:
+  job = await asyncio.to_thread(job_queue.log.get, job_id)
+  if job is None:
+    raise HTTPException(404, f"识别任务不存在: {job_id}")
+  return job
+
+
+@router.get("/image2hmi/jobs/{job_id}")
+async def image2hmi_job(job_id: str):
+  """识别任务的状态与已记录的事件数量"""
+  job = await _get_image_job(job_id)
+  del job["instance"], job["heartbeat"]
+  return job
+
+
+@router.get("/image2hmi/jobs/{job_id}/events")
+async def image2hmi_job_events(
+  job_id: str,
+  after: Optional[int] = None,
+  last_event_id: Optional[str] = Header(None),
+):
+  """
+  推送识别任务的事件, 每个事件带`id`字段, 已记录的事件先补发, 任务
+  结束后断开。
+  Args:
+      after: 从该序号之后的事件开始推送, 默认从头开始
+      last_event_id: `Last-Event-ID`请求头, 浏览器`EventSource`断线重连
+        时自动发送, 优先于`after`
+  """
+  if last_event_id is not None:
+    try:
+      after = int(last_event_id)
+    except ValueError:
+      raise HTTPException(400, f"无效的Last-Event-ID: {last_event_id}")
+  await _get_image_job(job_id)
+  return StreamingResponse(
+    observe_events(job_queue.events(job_id, after or 0)),
+    media_type="text/event-stream",
+  )
+
+
+async def _detect_regions(
+  decoded: DecodedImage,
+  crops: List[tuple],
+  models: LoadedModels,
+  params: dict,
+  timings: RequestTimings,
+) -> dict:
+  """
+  识别图片中的各识别范围(解码尺寸的像素坐标), 各范围并行识别,
+  结果还原到原图坐标后合并, 格式与`_run_stages`的返回值相同。
+  """
+
+  async def detect(x1: int, y1: int, x2: int, y2: int) -> dict:
+    crop = DecodedImage(
+      np.ascontiguousarray(decoded.img[y1:y2, x1:x2]),
+      decoded.scale,
+      decoded.width,
+      decoded.height,
+    )
+    stages = _build_stages(
+      crop,
+      models,
+      params["lang"],
+      params["no_ocr"],
+      params["no_symbol"],
+      params["no_line"],
+      params["tiled"],
+      timings,
+    )
+    results = await _run_stages(stages)
+    dx, dy = x1 * decoded.scale, y1 * decoded.scale
+    return {
+      "symbol": results["symbol"].shift(dx, dy),
+      "line": results["line"].shift(dx, dy),
+      "text": shift_ocr_result(results["text"], dx, dy),
+    }
+
+  parts = await asyncio.gather(*(detect(*crop) for crop in crops))
+  return {
+    "symbol": Detections.concatenate([part["symbol"] for part in parts]),
+    "line": Detections.concatenate([part["line"] for part in parts]),
+    "text": [
+      [line for part in parts for item in part["text"] if item for line in item]
+    ],
+  }
+
+
+@router.post("/image2hmi/revision")
+async def image2hmi_revision(
+  file: UploadFile = File(..., description="修订后的图片文件"),
+  base: str = "",
+  mapping: Optional[str] = None,
+  stats: Optional[bool] = None,
+):
+  """
+  增量识别修订后的图纸: 与之前识别过的版本逐块比较, 只识别变化的区域,
+  推送相对旧版本删除、修改、新增的识别结果。
+  Args:
+      file: 修订后的图片文件, 尺寸必须与旧版本相同
+      base: 旧版本的图片标识, 即`/image2hmi`或本接口响应的`X-Image-Id`头
+      mapping: 符号映射配置, 同`/image2hmi`
+      stats: 同`/image2hmi`
+  Returns:
+      StreamingResponse: 服务器发送事件(SSE)流, 依次为各阶段的`remove`、
+        `update`、`add`事件, `X-Image-Id`响应头为新版本的图片标识。
+        旧版本不存在(未识别过或已被淘汰)时返回404, 需要重新完整识别
+  """
+  timings = RequestTimings("image2hmi_revision")
+  try:
+    ImageValidator.validate_file(file)
+  except ValueError as e:
+    raise HTTPException(400, str(e))
+  previous = revision_store.get(base)
+  if previous is None:
+    raise HTTPException(
+      404, f"旧版本不存在: {base}, 请先通过 /image2hmi 完整识别"
+    )
+  params = previous.params
+  try:
+    event_generator = HMIEventGenerator(
+      _symbol_mapper(params["profile"], mapping)
+    )
+  except ValueError as e:
+    raise HTTPException(400, str(e))
+  fileInfo = {
+    "filename": file.filename,
+    "content_type": file.content_type,
+    "size": getattr(file, "size", None),
+  }
+  if stats is None:
+    stats = settings.IMAGE2HMI_STATS_EVENT
+  try:
+    ticket = await timings.timed("queue", admission.acquire())
+  except Overloaded as e:
+    raise HTTPException(e.status, str(e), headers=e.headers)
+  # 名额交给识别阶段后由其在推理执行完毕时归还
+  held = False
+  try:
+    try:
+      async with read_upload(file) as content:
+        digest = await timings.timed(
+          "digest", asyncio.to_thread(content_digest, content)
+        )
+        decoded = await timings.timed(
+          "decode", inference_executor.run(decode_image, content)
+        )
+    except ValueError as e:
+      raise HTTPException(400, f"图像解码失败: {str(e)}")
+    gray = await asyncio.to_thread(grayscale, decoded.img)
+    if gray.shape != previous.gray.shape or decoded.scale != previous.scale:
+      raise HTTPException(400, "图片尺寸与旧版本不同, 请重新完整识别")
+    regions = await timings.timed(
+      "diff",
+      asyncio.to_thread(
+        changed_regions,
+        previous.gray,
+        gray,
+        settings.REVISION_DIFF_THRESHOLD,
+        settings.REVISION_BLOCK_SIZE,
+        settings.REVISION_MARGIN,
+      ),
+    )
+    h, w = gray.shape
+    crops = [crop for _, crop in regions]
+    changed = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in crops)
+    if changed > settings.REVISION_MAX_CHANGED_RATIO * w * h:
+      # 变化范围过大时整图识别, 避免各区域重复识别重叠部分
+      regions = [((0, 0, w, h), (0, 0, w, h))]
+      crops = [(0, 0, w, h)]
+    partial = _empty_results()
+    if crops:
+      try:
+        lease = await timings.timed(
+          "model", model_registry.acquire(params["profile"])
+        )
+      except Exception as e:
+        raise HTTPException(500, f"模型加载失败: {str(e)}")
+      held = True
+      detect = _hold_until_complete(
+        lambda: {
+          "detect": timings.timed(
+            "detect",
+            _detect_regions(decoded, crops, lease.models, params, timings),
+          )
+        },
+        ticket,
+        lease,
+      )["detect"]
+      try:
+        partial = await detect
+      except Exception as e:
+        raise HTTPException(500, f"模型推理失败: {str(e)}")
+  finally:
+    if not held:
+      ticket.release()
+  cores = np.asarray([core for core, _ in regions], dtype=np.float64)
+  results, changes = await asyncio.to_thread(
+    apply_revision,
+    previous.results,
+    partial,
+    cores.reshape(-1, 4) * decoded.scale,
+  )
+  revision_store.put(
+    digest, Revision(gray, decoded.scale, results, dict(params))
+  )
+  return _sse_response(
+    event_generator.generate_revision(changes, fileInfo, timings, stats),
+    timings,
+    digest,
+  )
+
+
+def _spool_uploads(uploads: List[tuple], spool: Path) -> List[BatchFile]:
+  """
+  展开上传的文件并逐个写入临时目录`spool`: 图片原样写入, zip压缩包
+  边解压边写入其中的JPG/PNG图片, 不把文件内容读入内存。图片数量超过
+  `BATCH_MAX_FILES`或总大小超过`BATCH_MAX_BYTES`时立即停止(按实际
+  读出的字节数计算, 不信任zip中记录的大小)。
+  Args:
+    uploads (List[tuple]): (文件名, 文件对象)列表。
+    spool (Path): 临时目录。
+  Returns:
+    List[BatchFile]: 暂存的图片。
+  Raises:
+    ValueError: 文件类型无效、图片超过`IMAGE_MAX_BYTES`或超出上述限制。
+  """
+  files: List[BatchFile] = []
+  total = 0
+
+  def add(name: str, source, declared: int = 0) -> None:
+    nonlocal total
+    if len(files) >= settings.BATCH_MAX_FILES:
+      raise ValueError(f"图片数量过多, 最多 {settings.BATCH_MAX_FILES}")
+    if declared > settings.IMAGE_MAX_BYTES:
+      raise ValueError(f"图片文件过大: {name}")
+    path = spool / str(len(files))
+    size = 0
+    with open(path, "wb") as out:
+      while chunk := source.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > settings.IMAGE_MAX_BYTES:
+          raise ValueError(f"图片文件过大: {name}")
+        if total + size > settings.BATCH_MAX_BYTES:
+          raise ValueError(
+            "图片总大小过大, 最多 "
+            f"{settings.BATCH_MAX_BYTES // 1024 // 1024} MB"
+          )
+        out.write(chunk)
+    total += size
+    files.append(BatchFile(len(files), name, path))
+
+  for filename, file in uploads:
+    file.seek(0)
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "zip":
+      with zipfile.ZipFile(file) as archive:
+        for info in archive.infolist():
+          name = info.filename
+          if info.is_dir() or name.startswith("__MACOSX/"):
+            continue
+          if name.rsplit(".", 1)[-1].lower() not in ALLOWED_EXTENSIONS:
+            continue
+          with archive.open(info) as member:
+            add(name, member, info.file_size)
+    elif extension in ALLOWED_EXTENSIONS:
+      add(filename, file)
+    else:
+      raise ValueError(f"仅支持 JPG/PNG 图片或 zip 压缩包: {filename}")
+  return files
+
+
+@router.post("/image2hmi/batch")
+async def image2hmi_batch(
+  files: List[UploadFile] = File(..., description="上传的图片或zip压缩包"),
+  lang: Optional[str] = "ch",
+  no_ocr: Optional[bool] = False,
+  no_symbol: Optional[bool] = False,
+  no_line: Optional[bool] = False,
+  tiled: Optional[bool] = None,
+  profile: Optional[str] = None,
+  mapping: Optional[str] = None,
+  stream: Optional[bool] = False,
+):
+  """
+  批量将图片转换为HMI格式, 任务在后台执行。
+  Args:
+      files: 上传的图片文件, 也可以是包含JPG/PNG图片的zip压缩包
+      lang, no_ocr, no_symbol, no_line, tiled, profile, mapping:
+        同`/image2hmi`
+      stream: 是否直接返回任务进度的SSE流, 默认为False(返回任务信息,
+        通过`/image2hmi/batch/{job_id}`轮询进度)
+  Returns:
+      任务信息(JSON), 或`stream`为True时的服务器发送事件(SSE)流
+  """
+  if tiled is None:
+    tiled = settings.IMAGE2HMI_TILED
+  try:
+    profile = model_registry.resolve(profile)
+    mapper = _symbol_mapper(profile, mapping)
+  except ValueError as e:
+    raise HTTPException(400, str(e))
+  event_generator = HMIEventGenerator(mapper)
+  uploads = [(upload.filename, upload.file) for upload in files]
+  spool = Path(tempfile.mkdtemp(prefix="hmi-batch-"))
+  try:
+    images = await asyncio.to_thread(_spool_uploads, uploads, spool)
+  except (ValueError, zipfile.BadZipFile) as e:
+    await asyncio.to_thread(shutil.rmtree, spool, True)
+    raise HTTPException(400, str(e))
+  except BaseException:
+    await asyncio.to_thread(shutil.rmtree, spool, True)
+    raise
+  if not images:
+    await asyncio.to_thread(shutil.rmtree, spool, True)
+    raise HTTPException(400, "没有可识别的图片")
+
+  async def process(file: BatchFile) -> dict:
+    """识别一张图片, 返回各阶段的事件数据"""
+    timings = RequestTimings("image2hmi_batch")
+    # 处理时才读入文件内容, 同时在内存中的最多`BATCH_JOB_CONCURRENCY`张
+    content = await asyncio.to_thread(file.read)
+    key = _result_key(
+      await timings.timed("digest", asyncio.to_thread(content_digest, content)),
+      profile,
+      lang,
+      no_ocr,
+      no_symbol,
+      no_line,
+      tiled,
+    )
+    results = await timings.timed(
+      "cache", asyncio.to_thread(result_cache.get, key)
+    )
+    if results is None:
+      # 与在线请求共用推理名额, 排队不受队列长度与期限限制
+      ticket = await timings.timed("queue", admission.acquire(bounded=False))
+      try:
+        decoded = await timings.timed(
+          "decode", inference_executor.run(decode_image, content)
+        )
+        # 解码后即可释放文件内容, 降低大任务的内存占用
+        content = None
+        lease = await timings.timed("model", model_registry.acquire(profile))
+      except BaseException:
+        ticket.release()
+        raise
+      results = await _hold_until_complete(
+        lambda: {
+          "results": _run_stages(
+            _build_stages(
+              decoded,
+              lease.models,
+              lang,
+              no_ocr,
+              no_symbol,
+              no_line,
+              tiled,
+              timings,
+            )
+          )
+        },
+        ticket,
+        lease,
+      )["results"]
+      await asyncio.to_thread(result_cache.set, key, results)
+    return {
+      name: [data for _, data in event_generator.stage_items(name, items)]
+      for name, items in results.items()
+    }
+
+  job = batch_jobs.submit(
+    images,
+    {
+      "lang": lang,
+      "no_ocr": no_ocr,
+      "no_symbol": no_symbol,
+      "no_line": no_line,
+      "tiled": tiled,
+      "profile": profile,
+      "mapping": mapper.profile,
+    },
+    process,
+    spool,
+  )
+  if stream:
+    return StreamingResponse(
+      observe_events(job_events(job)), media_type="text/event-stream"
+    )
+  return job.summary()
+
+
+def _get_job(job_id: str) -> BatchJob:
+  job = batch_jobs.get(job_id)
+  if job is None:
+    raise HTTPException(404, f"批量任务不存在: {job_id}")
+  return job
+
+
+@router.get("/image2hmi/batch/{job_id}")
+async def image2hmi_batch_status(job_id: str):
+  """批量任务进度与各文件状态"""
+  return _get_job(job_id).summary()
+
+
+@router.get("/image2hmi/batch/{job_id}/files/{index}")
+async def image2hmi_batch_file(job_id: str, index: int):
+  """批量任务中某个文件的状态与识别结果"""
+  job = _get_job(job_id)
+  if not 0 <= index < len(job.files):
+    raise HTTPException(404, f"文件不存在: {index}")
+  return job.files[index].to_dict()
+
+
+@router.get("/image2hmi/batch/{job_id}/events")
+async def image2hmi_batch_events(job_id: str):
+  """以SSE方式推送批量任务进度, 已完成的文件会先补发"""
+  return StreamingResponse(
+    observe_events(job_events(_get_job(job_id))),
     media_type="text/event-stream",
   )
@@ -1,9 +1,21 @@
+import asyncio
 from typing import Optional
 
 from fastapi import APIRouter, File, HTTPException, UploadFile
 from fastapi.responses import JSONResponse
 
-from app.core.ocr import ocr_to_json
+from app.core.admission import Overloaded, Ticket, admission
+from app.core.cache import cache_key, content_digest, result_cache
+from app.core.executor import inference_executor
+from app.core.ingest import read_upload
+from app.core.metrics import RequestTimings
+from app.core.ocr import (
+  OCR_MODEL_VERSION,
+  ocr_image_bytes,
+  ocr_options,
+  ocr_result_to_json,
+)
+from app.core.settings import settings
 
 router = APIRouter()
 
@@ -24,9 +36,54 @@ async def ocr_endpoint(
   """
   if not file.content_type.startswith("image/"):
     raise HTTPException(status_code=400, detail="文件必须为图片类型。")
+  timings = RequestTimings("ocr")
+
+  async def recognize(ticket: Ticket, image_bytes) -> list:
+    """使用已获得的推理名额识别并写入缓存"""
+    try:
+      result = await timings.timed(
+        "text", inference_executor.run(ocr_image_bytes, image_bytes, lang)
+      )
+    finally:
+      ticket.release()
+    await asyncio.to_thread(result_cache.set, key, result)
+    return result
+
   try:
-    image_bytes = await file.read()
-    result = ocr_to_json(image_bytes, lang)
-    return JSONResponse(content=result)
+    async with read_upload(file) as image_bytes:
+      key = cache_key(
+        "ocr",
+        await timings.timed(
+          "digest", asyncio.to_thread(content_digest, image_bytes)
+        ),
+        OCR_MODEL_VERSION,
+        lang,
+        settings.IMAGE_DECODE_MAX_SIDE,
+        ocr_options(False),
+      )
+      # 缓存PaddleOCR原始结果, 命中时不调用模型
+      ocr_result = await timings.timed(
+        "cache", asyncio.to_thread(result_cache.get, key)
+      )
+      if ocr_result is None:
+        ticket = admission.try_acquire()
+        if ticket is not None:
+          ocr_result = await recognize(ticket, image_bytes)
+        else:
+          # 需要排队: 复制上传内容, 排队期间不占用上传缓冲区
+          pending = bytes(image_bytes)
+    if ocr_result is None:
+      ticket = await timings.timed("queue", admission.acquire())
+      ocr_result = await recognize(ticket, pending)
+    with timings.time("serialize"):
+      content = ocr_result_to_json(ocr_result)
+    return JSONResponse(
+      content=content, headers={"Server-Timing": timings.server_timing()}
+    )
+  except Overloaded as e:
+    raise HTTPException(e.status, str(e), headers=e.headers)
+  except ValueError as e:
+    # 文件过大、尺寸过大或无法解码
+    raise HTTPException(status_code=400, detail=f"OCR识别失败: {str(e)}")
   except Exception as e:
     raise HTTPException(status_code=500, detail=f"OCR识别失败: {str(e)}")
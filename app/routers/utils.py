@@ -1,4 +1,16 @@
 from fastapi import APIRouter
+from fastapi.responses import Response
+
+from app.core.admission import admission
+from app.core.batching import batching_stats
+from app.core.cache import result_cache
+from app.core.ingest import upload_buffers
+from app.core.job_queue import job_queue
+from app.core.metrics import CONTENT_TYPE, registry
+from app.core.model_registry import model_registry
+from app.core.ocr import ocr_pool
+from app.core.revisions import revision_store
+from app.core.symbol_mapping import symbol_mappings
 
 router = APIRouter(prefix="/utils", tags=["utils"])
 
@@ -6,3 +18,38 @@ router = APIRouter(prefix="/utils", tags=["utils"])
 @router.get("/health-check/")
 async def health_check() -> bool:
   return True
+
+
+@router.get("/metrics/")
+async def metrics() -> Response:
+  """Prometheus格式的运行指标: 各阶段耗时、排队等待、模型加载、缓存命中、
+  在途请求与SSE事件大小。多worker部署时每个worker分别统计"""
+  return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+@router.get("/inference-stats/")
+async def inference_stats() -> dict:
+  """
+  推理统计信息:
+
+  - admission: 准入控制的名额与排队情况;
+  - models: 各模型配置的加载情况;
+  - batching: YOLO批处理的批次填充率与排队等待时间;
+  - result_cache: 识别结果缓存的命中情况;
+  - ocr_pool: OCR实例池的加载与淘汰情况;
+  - symbol_mappings: 各符号映射配置的加载时间;
+  - revisions: 增量识别保存的图片;
+  - jobs: 识别任务队列;
+  - upload_buffers: 空闲的上传缓冲区。
+  """
+  return {
+    "admission": admission.stats(),
+    "models": model_registry.stats(),
+    "batching": batching_stats(),
+    "result_cache": result_cache.stats(),
+    "ocr_pool": ocr_pool.stats(),
+    "symbol_mappings": symbol_mappings.stats(),
+    "revisions": revision_store.stats(),
+    "jobs": job_queue.stats(),
+    "upload_buffers": upload_buffers.stats(),
+  }
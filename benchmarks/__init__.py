@@ -0,0 +1 @@
+"""image2hmi 流水线的基准测试与压测工具, 用法见 docs/README.md."""
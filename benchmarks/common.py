@@ -0,0 +1,97 @@
+"""
+基准测试的公共工具: 统计、内存峰值与JSON报告.
+"""
+
+import json
+import platform
+import resource
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+IMAGES_DIR = Path(__file__).parent.parent / "images"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def sample_images(directory: Path = IMAGES_DIR) -> List[Path]:
+  """返回目录中的示例图纸, 按文件名排序保证各次运行顺序一致"""
+  return sorted(
+    p for p in directory.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS
+  )
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+  """
+  统计一组耗时(秒)。
+  Returns:
+    Dict[str, float]: 次数, 以及均值、p50、p95、最大值(毫秒)。
+  """
+  if not samples:
+    return {"count": 0}
+  ordered = sorted(samples)
+
+  def percentile(p: float) -> float:
+    index = min(len(ordered) - 1, round(p * (len(ordered) - 1)))
+    return ordered[index] * 1000
+
+  return {
+    "count": len(ordered),
+    "mean_ms": sum(ordered) / len(ordered) * 1000,
+    "p50_ms": percentile(0.5),
+    "p95_ms": percentile(0.95),
+    "max_ms": ordered[-1] * 1000,
+  }
+
+
+def peak_rss_mb() -> float:
+  """当前进程的内存峰值(MB)"""
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # macOS的单位为字节, Linux为KB
+  if sys.platform == "darwin":
+    return peak / 1024 / 1024
+  return peak / 1024
+
+
+def process_peak_rss_mb(pid: int) -> Optional[float]:
+  """
+  读取其它进程及其子进程(如uvicorn worker)的内存峰值之和(MB),
+  仅支持Linux。
+  """
+  pids = [pid]
+  try:
+    for task in Path(f"/proc/{pid}/task").iterdir():
+      children = (task / "children").read_text().split()
+      pids.extend(int(child) for child in children)
+  except OSError:
+    return None
+  total = 0
+  for item in pids:
+    try:
+      for line in Path(f"/proc/{item}/status").read_text().splitlines():
+        if line.startswith("VmHWM:"):
+          total += int(line.split()[1])
+    except OSError:
+      continue
+  return total / 1024
+
+
+def metadata(**extra) -> dict:
+  """运行环境信息, 便于比较不同机器、版本与后端的结果"""
+  return {
+    "timestamp": datetime.now().isoformat(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "machine": platform.machine(),
+    **extra,
+  }
+
+
+def write_report(report: dict, output: Optional[Path]) -> None:
+  """输出JSON报告到文件或标准输出"""
+  text = json.dumps(report, ensure_ascii=False, indent=2)
+  if output is None:
+    print(text)
+  else:
+    output.write_text(text + "\n", encoding="utf-8")
+    print(f"报告已写入: {output}")
@@ -0,0 +1,81 @@
+"""
+比较两次基准测试的JSON报告, 发现性能回退.
+
+  python -m benchmarks.compare baseline.json current.json --threshold 0.1
+
+耗时与内存越小越好, 吞吐量越大越好; 任一指标变差超过`threshold`
+比例时以状态码1退出, 便于在CI中使用。
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+# (指标, 是否越大越好)
+Metrics = Dict[str, Tuple[float, bool]]
+
+
+def flatten(report: dict) -> Metrics:
+  """提取报告中用于比较的指标"""
+  metrics: Metrics = {}
+  if report["kind"] == "pipeline":
+    for stage, summary in report["stages"].items():
+      for key in ("p50_ms", "p95_ms"):
+        if key in summary:
+          metrics[f"{stage}.{key}"] = (summary[key], False)
+    metrics["peak_rss_mb"] = (report["peak_rss_mb"], False)
+  elif report["kind"] == "load":
+    for level in report["levels"]:
+      prefix = f"c{level['concurrency']}"
+      metrics[f"{prefix}.throughput_rps"] = (level["throughput_rps"], True)
+      for name in ("ttfb", "latency"):
+        for key in ("p50_ms", "p95_ms"):
+          if key in level[name]:
+            metrics[f"{prefix}.{name}.{key}"] = (level[name][key], False)
+    if report.get("server_peak_rss_mb") is not None:
+      metrics["server_peak_rss_mb"] = (report["server_peak_rss_mb"], False)
+  else:
+    raise ValueError(f"未知的报告类型: {report['kind']}")
+  return metrics
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+  """
+  打印各指标的变化。
+  Returns:
+    bool: 是否存在超过`threshold`的回退。
+  """
+  if baseline["kind"] != current["kind"]:
+    raise ValueError("两份报告的类型不同")
+  before, after = flatten(baseline), flatten(current)
+  regressed = False
+  for name, (old, higher_is_better) in before.items():
+    if name not in after or not old:
+      continue
+    new = after[name][0]
+    change = (new - old) / old
+    worse = -change if higher_is_better else change
+    flag = ""
+    if worse > threshold:
+      flag = "  <-- 回退"
+      regressed = True
+    print(f"{name:40} {old:12.2f} -> {new:12.2f}  {change:+8.1%}{flag}")
+  return regressed
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.compare")
+  parser.add_argument("baseline", type=Path)
+  parser.add_argument("current", type=Path)
+  parser.add_argument("--threshold", type=float, default=0.1)
+  args = parser.parse_args()
+  baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+  current = json.loads(args.current.read_text(encoding="utf-8"))
+  if compare(baseline, current, args.threshold):
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,170 @@
+"""
+对运行中的服务进行并发压测.
+
+  fastapi run app/main.py &
+  python -m benchmarks.load --concurrency 1,4,8 --requests 40 \\
+    --server-pid $(pgrep -f "fastapi run") --output load.json
+
+每个并发级别下, `concurrency`个客户端循环上传images/目录中的图纸,
+直到共完成`requests`个请求, 统计吞吐量、首个事件时间(TTFB)、完整SSE流
+耗时与错误数。默认在图片末尾追加随机字节使每次上传的内容哈希不同,
+避免命中识别结果缓存(解码器会忽略图片结束标记之后的数据)。
+"""
+
+import argparse
+import asyncio
+import os
+from pathlib import Path
+from time import perf_counter
+from typing import List, Optional
+
+import httpx
+
+from .common import (
+  metadata,
+  process_peak_rss_mb,
+  sample_images,
+  summarize,
+  write_report,
+)
+
+CONTENT_TYPES = {
+  ".png": "image/png",
+  ".jpg": "image/jpeg",
+  ".jpeg": "image/jpeg",
+}
+
+
+async def _request(
+  client: httpx.AsyncClient,
+  path: Path,
+  content: bytes,
+  params: dict,
+  bust_cache: bool,
+) -> dict:
+  """发送一次/image2hmi请求并读取完整SSE流"""
+  if bust_cache:
+    content += os.urandom(16)
+  files = {"file": (path.name, content, CONTENT_TYPES[path.suffix.lower()])}
+  started = perf_counter()
+  ttfb = None
+  events = 0
+  async with client.stream(
+    "POST", "/image2hmi", files=files, params=params
+  ) as response:
+    if response.status_code != 200:
+      await response.aread()
+      raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+    async for line in response.aiter_lines():
+      if ttfb is None:
+        ttfb = perf_counter() - started
+      if line.startswith("event:"):
+        events += 1
+  return {"ttfb": ttfb, "total": perf_counter() - started, "events": events}
+
+
+async def run_level(
+  base_url: str,
+  images: List[Path],
+  concurrency: int,
+  requests: int,
+  params: dict,
+  bust_cache: bool,
+  timeout: float,
+) -> dict:
+  """以指定并发数完成`requests`个请求"""
+  contents = [(path, path.read_bytes()) for path in images]
+  counter = iter(range(requests))
+  ttfbs, totals, errors = [], [], []
+  events = 0
+
+  async def client_loop(client: httpx.AsyncClient):
+    nonlocal events
+    for i in counter:
+      path, content = contents[i % len(contents)]
+      try:
+        result = await _request(client, path, content, params, bust_cache)
+      except Exception as e:
+        errors.append(f"{path.name}: {e}")
+        continue
+      ttfbs.append(result["ttfb"])
+      totals.append(result["total"])
+      events += result["events"]
+
+  async with httpx.AsyncClient(
+    base_url=base_url, timeout=timeout, limits=httpx.Limits(max_connections=0)
+  ) as client:
+    started = perf_counter()
+    await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    elapsed = perf_counter() - started
+
+  return {
+    "concurrency": concurrency,
+    "requests": requests,
+    "elapsed_s": elapsed,
+    "throughput_rps": len(totals) / elapsed if elapsed else 0.0,
+    "events": events,
+    "ttfb": summarize(ttfbs),
+    "latency": summarize(totals),
+    "errors": len(errors),
+    "error_samples": errors[:5],
+  }
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+  parser.add_argument(
+    "images", nargs="*", type=Path, help="图片路径, 默认images/目录"
+  )
+  parser.add_argument("--url", default="http://127.0.0.1:8000")
+  parser.add_argument(
+    "--concurrency", default="1,4,8", help="并发客户端数量, 逗号分隔"
+  )
+  parser.add_argument("--requests", type=int, default=20)
+  parser.add_argument("--delivery", default="stream")
+  parser.add_argument("--lang", default="ch")
+  parser.add_argument("--no-ocr", action="store_true")
+  parser.add_argument(
+    "--use-cache", action="store_true", help="不追加随机字节, 允许命中缓存"
+  )
+  parser.add_argument("--timeout", type=float, default=300)
+  parser.add_argument(
+    "--server-pid", type=int, help="服务进程PID, 用于统计服务端内存峰值"
+  )
+  parser.add_argument("--output", type=Path)
+  args = parser.parse_args()
+
+  images = args.images or sample_images()
+  params = {"delivery": args.delivery, "lang": args.lang}
+  if args.no_ocr:
+    params["no_ocr"] = "true"
+  levels = []
+  for concurrency in (int(c) for c in args.concurrency.split(",")):
+    print(f"并发 {concurrency}: {args.requests} 个请求...")
+    levels.append(
+      asyncio.run(
+        run_level(
+          args.url,
+          images,
+          concurrency,
+          args.requests,
+          params,
+          not args.use_cache,
+          args.timeout,
+        )
+      )
+    )
+  server_rss: Optional[float] = None
+  if args.server_pid:
+    server_rss = process_peak_rss_mb(args.server_pid)
+  report = {
+    "kind": "load",
+    "meta": metadata(url=args.url, params=params, images=len(images)),
+    "levels": levels,
+    "server_peak_rss_mb": server_rss,
+  }
+  write_report(report, args.output)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,132 @@
+"""
+image2hmi流水线各阶段的进程内基准测试.
+
+  python -m benchmarks.pipeline --repeat 3 --output pipeline.json
+  python -m benchmarks.pipeline --backend onnx images/07.png
+
+阶段: decode(解码)、symbol/line(YOLO推理)、ocr(PaddleOCR)、
+ocr_json(`ocr_to_json`的结果转换)、serialize(识别结果转换为事件JSON)、
+sse(`HMIEventGenerator.generate`完整生成SSE流)。
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+from pathlib import Path
+from time import perf_counter
+
+from app.core.backends import load_yolo_model
+from app.core.image2hmi import HMIEventGenerator, SymbolMapper
+from app.core.ingest import decode_image
+from app.core.ocr import ocr, ocr_result_to_json
+from app.core.settings import settings
+
+from .common import (
+  metadata,
+  peak_rss_mb,
+  sample_images,
+  summarize,
+  write_report,
+)
+
+
+async def _consume(stream) -> int:
+  count = 0
+  async for _ in stream:
+    count += 1
+  return count
+
+
+def run(
+  images: list, repeat: int, backend: str, lang: str, delivery: str
+) -> dict:
+  symbol_model = load_yolo_model(settings.MODEL_PATH, backend)
+  line_model = load_yolo_model(settings.MODEL_LINE_PATH, backend)
+  generator = HMIEventGenerator(SymbolMapper(settings.SYMBOL_MAPPING_PATH))
+  timings = defaultdict(list)
+  per_image = {}
+  loop = asyncio.new_event_loop()
+
+  def timed(totals: dict, stage: str, func, *args):
+    started = perf_counter()
+    result = func(*args)
+    elapsed = perf_counter() - started
+    timings[stage].append(elapsed)
+    totals[stage] += elapsed
+    return result
+
+  # 预热: 首次推理包含模型初始化, 不计入结果
+  warmup = decode_image(images[0].read_bytes()).img
+  symbol_model.predict(warmup)
+  line_model.predict(warmup)
+  ocr(warmup, lang)
+
+  for path in images:
+    content = path.read_bytes()
+    totals = defaultdict(float)
+    for _ in range(repeat):
+      decoded = timed(totals, "decode", decode_image, content)
+      img = decoded.img
+      symbols = timed(totals, "symbol", symbol_model.predict, img)
+      lines = timed(totals, "line", line_model.predict, img)
+      texts = timed(totals, "ocr", ocr, img, lang)
+      timed(totals, "ocr_json", ocr_result_to_json, texts)
+      results = {"symbol": symbols, "line": lines, "text": texts}
+
+      def serialize():
+        return [
+          data
+          for name, items in results.items()
+          for _, data in generator.encoded_items(name, items)
+        ]
+
+      events = timed(totals, "serialize", serialize)
+      stream = generator.generate(
+        symbols, lines, texts, {"filename": path.name}, lang, delivery
+      )
+      timed(totals, "sse", loop.run_until_complete, _consume(stream))
+    per_image[path.name] = {
+      "size_bytes": len(content),
+      "shape": list(img.shape),
+      "detections": {
+        "symbol": len(symbols),
+        "line": len(lines),
+        "events": len(events),
+      },
+      "mean_ms": {k: v / repeat * 1000 for k, v in totals.items()},
+    }
+  loop.close()
+
+  return {
+    "kind": "pipeline",
+    "meta": metadata(
+      backend=backend,
+      lang=lang,
+      delivery=delivery,
+      repeat=repeat,
+      images=len(images),
+    ),
+    "stages": {stage: summarize(samples) for stage, samples in timings.items()},
+    "images": per_image,
+    "peak_rss_mb": peak_rss_mb(),
+  }
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.pipeline")
+  parser.add_argument(
+    "images", nargs="*", type=Path, help="图片路径, 默认images/目录"
+  )
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--backend", default=settings.YOLO_BACKEND)
+  parser.add_argument("--lang", default="ch")
+  parser.add_argument("--delivery", default="stream")
+  parser.add_argument("--output", type=Path)
+  args = parser.parse_args()
+  images = args.images or sample_images()
+  report = run(images, args.repeat, args.backend, args.lang, args.delivery)
+  write_report(report, args.output)
+
+
+if __name__ == "__main__":
+  main()
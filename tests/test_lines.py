@@ -0,0 +1,74 @@
+import numpy as np
+
+from app.core.detections import Detections
+from app.core.lines import vectorize_lines
+
+NAMES = {0: "line"}
+
+
+def _lines(*boxes) -> Detections:
+  xyxy = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+  return Detections(
+    xyxy,
+    np.linspace(0.9, 0.5, len(xyxy), dtype=np.float32),
+    np.zeros(len(xyxy), dtype=np.int32),
+    NAMES,
+  )
+
+
+def test_collinear_segments_merge_into_one_line():
+  # 同一水平线上的三段, 间隙分别为4与0(重叠)
+  network = vectorize_lines(
+    _lines([0, 8, 50, 12], [54, 9, 100, 11], [90, 8, 150, 12]), None, 5
+  )
+  assert len(network) == 1
+  assert network.polylines[0] == [[(0.0, 10.0), (150.0, 10.0)]]
+  assert network.counts.tolist() == [3]
+  assert network.bounds[0].tolist() == [0, 8, 150, 12]
+  assert network.conf[0] == np.float32(0.9)
+
+
+def test_gap_larger_than_threshold_keeps_segments_apart():
+  network = vectorize_lines(_lines([0, 8, 50, 12], [70, 8, 120, 12]), None, 5)
+  assert len(network) == 2
+  assert network.counts.tolist() == [1, 1]
+
+
+def test_t_junction():
+  # 竖线的上端距横线2像素, 对齐到交点, 横线在交点处分叉
+  network = vectorize_lines(
+    _lines([0, 48, 100, 52], [48, 54, 52, 100]), None, 5
+  )
+  assert len(network) == 1
+  polylines = sorted(network.polylines[0])
+  assert polylines == [
+    [(0.0, 50.0), (50.0, 50.0)],
+    [(50.0, 50.0), (50.0, 100.0)],
+    [(50.0, 50.0), (100.0, 50.0)],
+  ]
+
+
+def test_corner_is_one_polyline():
+  network = vectorize_lines(_lines([0, 48, 52, 52], [48, 48, 52, 100]), None, 5)
+  assert network.polylines == [[[(0.0, 50.0), (50.0, 50.0), (50.0, 100.0)]]]
+
+
+def test_isolated_boxes_stay_separate():
+  network = vectorize_lines(
+    _lines([0, 0, 30, 4], [200, 200, 204, 240], [400, 0, 430, 4]), None, 5
+  )
+  assert len(network) == 3
+  assert network.counts.tolist() == [1, 1, 1]
+  assert network.polylines[1] == [[(202.0, 200.0), (202.0, 240.0)]]
+
+
+def test_free_end_snaps_to_symbol():
+  symbols = np.array([[60, 30, 80, 70]], dtype=np.float32)
+  network = vectorize_lines(_lines([0, 48, 56, 52]), symbols, 5)
+  assert network.polylines == [[[(0.0, 50.0), (60.0, 50.0)]]]
+
+
+def test_empty():
+  network = vectorize_lines(_lines(), None, 5)
+  assert len(network) == 0
+  assert network.bounds.shape == (0, 4)
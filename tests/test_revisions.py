@@ -0,0 +1,186 @@
+import numpy as np
+
+from app.core.detections import Detections
+from app.core.revisions import apply_revision, changed_regions, match_boxes
+
+NAMES = {0: "valve", 1: "pump"}
+BLOCK = 32
+MARGIN = 16
+
+
+def _detections(*items) -> Detections:
+  """(x1, y1, x2, y2, 类别)"""
+  rows = np.array(items, dtype=np.float32).reshape(-1, 5)
+  return Detections(
+    rows[:, :4], np.full(len(rows), 0.9, dtype=np.float32), rows[:, 4], NAMES
+  )
+
+
+def _results(symbol: Detections) -> dict:
+  return {"symbol": symbol, "line": _detections(), "text": [[]]}
+
+
+def _regions(old, new):
+  return changed_regions(old, new, 10, BLOCK, MARGIN)
+
+
+def test_unchanged_image_has_no_regions():
+  img = np.random.default_rng(0).integers(0, 256, (200, 300), dtype=np.uint8)
+  assert _regions(img, img.copy()) == []
+
+
+def test_changes_below_threshold_are_ignored():
+  old = np.full((128, 128), 200, dtype=np.uint8)
+  new = old.copy()
+  new[10:20, 10:20] = 205
+  assert _regions(old, new) == []
+
+
+def test_single_changed_tile():
+  old = np.full((256, 256), 255, dtype=np.uint8)
+  new = old.copy()
+  # 变化落在第(2, 1)块内
+  new[40:45, 70:80] = 0
+  assert _regions(old, new) == [((64, 32, 96, 64), (48, 16, 112, 80))]
+
+
+def test_single_changed_pixel_on_block_edge():
+  old = np.full((256, 256), 255, dtype=np.uint8)
+  new = old.copy()
+  new[63, 95] = 0
+  assert _regions(old, new) == [((64, 32, 96, 64), (48, 16, 112, 80))]
+  new = old.copy()
+  new[64, 96] = 0
+  assert _regions(old, new) == [((96, 64, 128, 96), (80, 48, 144, 112))]
+
+
+def test_regions_clipped_to_image():
+  # 宽高不是块大小的整数倍, 最后一块只到图片边缘
+  old = np.full((100, 90), 255, dtype=np.uint8)
+  new = old.copy()
+  new[97:, 85:] = 0
+  assert _regions(old, new) == [((64, 96, 90, 100), (48, 80, 90, 100))]
+
+
+def test_nearby_changes_merge_and_distant_changes_stay_apart():
+  old = np.full((512, 512), 255, dtype=np.uint8)
+  new = old.copy()
+  new[5, 5] = 0
+  new[5, 40] = 0
+  new[400, 400] = 0
+  assert _regions(old, new) == [
+    ((0, 0, 64, 32), (0, 0, 80, 48)),
+    ((384, 384, 416, 416), (368, 368, 432, 432)),
+  ]
+
+
+def test_changes_one_block_apart_merge():
+  old = np.full((512, 512), 255, dtype=np.uint8)
+  new = old.copy()
+  # 两个变化块之间隔着一块, 按块扩展`MARGIN`后相连
+  new[5, 5] = 0
+  new[5, 70] = 0
+  assert _regions(old, new) == [((0, 0, 96, 32), (0, 0, 112, 48))]
+
+
+def test_apply_revision_unchanged():
+  old = _results(_detections([10, 10, 30, 30, 0], [100, 100, 120, 120, 1]))
+  merged, changes = apply_revision(
+    old, _results(_detections()), np.zeros((0, 4))
+  )
+  assert merged["symbol"].xyxy.tolist() == old["symbol"].xyxy.tolist()
+  assert len(changes["symbol"].added) == 0
+  assert len(changes["symbol"].removed) == 0
+  assert changes["symbol"].updated == []
+
+
+def test_apply_revision_replaces_only_boxes_centred_in_changed_region():
+  cores = np.array([[64, 32, 96, 64]], dtype=np.float32)
+  old = _results(
+    _detections(
+      # 中心(80, 48)在变化范围内: 被替换
+      [70, 40, 90, 56, 0],
+      # 跨越变化范围边界, 中心(100, 48)在范围外: 保留
+      [90, 40, 110, 56, 0],
+      # 中心(64, 48)在左边界上(左闭): 在范围内, 未重新识别到即删除
+      [54, 40, 74, 56, 1],
+      # 中心(96, 60)在右边界上(右开): 在范围外, 保留
+      [86, 52, 106, 68, 1],
+    )
+  )
+  partial = _results(
+    _detections(
+      # 与旧框位置相同但类别不同: 修改
+      [71, 40, 91, 56, 1],
+      # 识别范围中变化范围以外的结果: 丢弃, 旧结果仍有效
+      [91, 40, 111, 56, 1],
+      # 变化范围内的新结果: 新增
+      [66, 34, 74, 40, 0],
+    )
+  )
+  merged, changes = apply_revision(old, partial, cores)
+  assert merged["symbol"].xyxy.tolist() == [
+    [90, 40, 110, 56],
+    [86, 52, 106, 68],
+    [71, 40, 91, 56],
+    [66, 34, 74, 40],
+  ]
+  assert merged["symbol"].cls.tolist() == [0, 1, 1, 0]
+  symbol = changes["symbol"]
+  assert symbol.added.xyxy.tolist() == [[66, 34, 74, 40]]
+  assert symbol.removed.xyxy.tolist() == [[54, 40, 74, 56]]
+  [(before, after)] = symbol.updated
+  assert before.xyxy.tolist() == [[70, 40, 90, 56]]
+  assert after.cls.tolist() == [1]
+
+
+def test_apply_revision_same_label_is_not_a_change():
+  cores = np.array([[0, 0, 64, 64]], dtype=np.float32)
+  old = _results(_detections([10, 10, 30, 30, 0]))
+  merged, changes = apply_revision(
+    old, _results(_detections([11, 10, 31, 30, 0])), cores
+  )
+  assert merged["symbol"].xyxy.tolist() == [[11, 10, 31, 30]]
+  assert len(changes["symbol"].added) == 0
+  assert len(changes["symbol"].removed) == 0
+  assert changes["symbol"].updated == []
+
+
+def test_apply_revision_text():
+  cores = np.array([[0, 0, 64, 64]], dtype=np.float32)
+
+  def line(x, text):
+    return [[[x, 10], [x + 20, 10], [x + 20, 20], [x, 20]], (text, 0.9)]
+
+  old = {
+    "symbol": _detections(),
+    "line": _detections(),
+    "text": [[line(10, "FV-1"), line(100, "P-2")]],
+  }
+  partial = {
+    "symbol": _detections(),
+    "line": _detections(),
+    "text": [[line(10, "FV-2")]],
+  }
+  merged, changes = apply_revision(old, partial, cores)
+  assert [item[1][0] for item in merged["text"][0]] == ["P-2", "FV-2"]
+  [(before, after)] = changes["text"].updated
+  assert before[0][0][1][0] == "FV-1"
+  assert after[0][0][1][0] == "FV-2"
+
+
+def test_match_boxes_greedy_by_iou():
+  old = np.array([[0, 0, 10, 10], [20, 0, 30, 10]], dtype=np.float32)
+  new = np.array(
+    [[21, 0, 31, 10], [1, 0, 11, 10], [0, 0, 10, 10], [50, 50, 60, 60]],
+    dtype=np.float32,
+  )
+  oi, ni = match_boxes(old, new, 0.5)
+  assert sorted(zip(oi.tolist(), ni.tolist())) == [(0, 2), (1, 0)]
+
+
+def test_match_boxes_below_threshold():
+  old = np.array([[0, 0, 10, 10]], dtype=np.float32)
+  new = np.array([[8, 8, 18, 18]], dtype=np.float32)
+  oi, ni = match_boxes(old, new, 0.5)
+  assert len(oi) == len(ni) == 0
@@ -0,0 +1,43 @@
+import numpy as np
+
+from app.core.spatial import GridIndex, box_distance, connected_components
+
+
+def _boxes(*boxes) -> np.ndarray:
+  return np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+
+def test_grid_pairs_only_nearby_boxes():
+  boxes = _boxes([0, 0, 10, 10], [5, 5, 15, 15], [100, 100, 110, 110])
+  i, j = GridIndex(boxes, 10).pairs()
+  assert list(zip(i.tolist(), j.tolist())) == [(0, 1)]
+
+
+def test_grid_query_box_spanning_cells():
+  boxes = _boxes([0, 0, 5, 5], [40, 0, 45, 5], [0, 40, 5, 45])
+  query, found = GridIndex(boxes, 10).query(_boxes([0, 0, 41, 2]))
+  assert query.tolist() == [0, 0]
+  assert sorted(found.tolist()) == [0, 1]
+
+
+def test_grid_query_empty():
+  query, found = GridIndex(_boxes(), 10).query(_boxes([0, 0, 1, 1]))
+  assert len(query) == len(found) == 0
+
+
+def test_box_distance():
+  a = _boxes([0, 0, 10, 10], [0, 0, 10, 10])
+  b = _boxes([15, 5, 20, 8], [2, 30, 4, 40])
+  dx, dy = box_distance(a, b)
+  assert dx.tolist() == [5, 0]
+  assert dy.tolist() == [0, 20]
+
+
+def test_connected_components_numbered_by_first_node():
+  labels = connected_components(5, np.array([3, 1]), np.array([4, 3]))
+  assert labels.tolist() == [0, 1, 2, 1, 1]
+
+
+def test_connected_components_without_edges():
+  empty = np.zeros(0, dtype=np.int64)
+  assert connected_components(3, empty, empty).tolist() == [0, 1, 2]